@@ -6,9 +6,10 @@ import signal
 import datetime
 from functools import wraps
 from dotenv import load_dotenv
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, stream_with_context
 from werkzeug.utils import secure_filename
 from celery.result import AsyncResult
+from botocore.exceptions import ClientError
 
 # Load environment variables
 load_dotenv()
@@ -32,15 +33,33 @@ from services.s3_utils import (
     get_s3_client
 )
 # FIX: Import the new, correct data fetching functions from comparison_utils
-from services.comparison_utils import get_comparison_details, get_total_damage_counts
+from services.comparison_utils import get_comparison_details, get_comparison_details_page, get_total_damage_counts
 
 # Comparison service import
 from services.compare import run_comparison
 
 from services.com_s3_utils import find_comparison_dates_with_results
+from services.comparison_index import (
+    comparison_views,
+    comparison_page,
+    group_comparisons,
+    response_cache_key as comparisons_cache_key,
+    RESPONSE_CACHE_SECONDS as COMPARISONS_CACHE_SECONDS,
+    RESPONSE_STALE_SECONDS as COMPARISONS_STALE_SECONDS
+)
+from services.response_cache import get_or_compute, mark_stale, serialize
+from services.s3_scheduler import scheduler as s3_scheduler
+from services.task_progress import status_payload, event_stream, task_infos
+from services.multipart_upload import (
+    stream_form_upload,
+    start_presigned_upload,
+    presign_part_urls,
+    complete_presigned_upload,
+    abort_presigned_upload
+)
 
 # --- NEW: Import the cache refresh function ---
-from services.cache_manager import refresh_cache_now
+from services.cache_manager import start_cache_refresh, get_refresh_job, DETAILS_CACHE_SECONDS, DETAILS_STALE_SECONDS
 
 
 # --- Blueprint and Mock Data ---
@@ -65,6 +84,47 @@ def format_bytes(byte_count):
         n += 1
     return f"{byte_count:.2f} {power_labels[n]}B"
 
+def json_body(body, status=200, etag=None):
+    """
+    Response for an already serialized JSON body, e.g. straight from the response cache.
+    With an ETag (or etag=True to derive one from the body) a matching
+    If-None-Match is answered with 304 Not Modified.
+    """
+    response = current_app.response_class(body, status=status, mimetype='application/json')
+    if etag:
+        # Weak, since the body may be sent gzip-encoded (see app.py).
+        if etag is True:
+            response.add_etag(weak=True)
+        else:
+            response.set_etag(etag, weak=True)
+        # Clients may keep the body but must revalidate before using it.
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+    return response
+
+# Task event stream tokens: only valid for opening one task's /task-events stream.
+TASK_EVENTS_SCOPE = 'task-events'
+TASK_EVENTS_TOKEN_SECONDS = 60
+
+# Most task IDs one bulk /task-status request may ask for.
+MAX_BULK_TASK_IDS = 500
+
+# Largest page /comparisons and /comparison-details serve per request.
+MAX_PAGE_SIZE = 500
+DEFAULT_PAGE_SIZE = 50
+
+def page_limit():
+    """The ?limit= of a paged request, clamped to MAX_PAGE_SIZE. Raises ValueError if it is not a positive integer."""
+    limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+def list_arg(name):
+    """A filter given as ?name=a,b or ?name=a&name=b; None when absent."""
+    values = [v.strip() for raw in request.args.getlist(name) for v in raw.split(',') if v.strip()]
+    return set(values) or None
+
 def is_valid_date(date_str):
     """Validates date string formatYYYY-MM-DD."""
     try:
@@ -88,6 +148,9 @@ def token_required(f):
 
         try:
             data = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
+            # Scoped tokens (e.g. task event stream tokens) are not session tokens.
+            if 'scope' in data:
+                raise jwt.InvalidTokenError('Token is scoped to a single resource.')
             kwargs['current_user'] = data
         except Exception as e:
             return jsonify({'message': 'Token is invalid or expired!', 'error': str(e)}), 401
@@ -117,12 +180,39 @@ def login():
 
     return jsonify({'success': False, 'message': 'Invalid credentials'}), 403
 
+def raw_video_folder(upload_date, user_name, camera_angle, video_type):
+    """S3 folder for a raw video upload; upload_date is 'YYYY-MM-DD' and must be validated first."""
+    date_obj = datetime.datetime.strptime(upload_date, "%Y-%m-%d")
+    upload_date_str = date_obj.strftime("%d-%m-%Y")
+
+    base_folder = current_app.config['S3_UPLOAD_FOLDER']
+    # Override only for video uploads: change 'Wagon_H' to 'wagon' in the base folder
+    video_base_folder = base_folder.replace('Wagon_H', 'wagon')
+    return os.path.join(
+        video_base_folder,
+        upload_date_str,
+        user_name,
+        'Raw-videos',
+        camera_angle,
+        video_type
+    ).replace("\\", "/")
+
+def raw_video_filename(original_filename, load_status):
+    """Appends the load status ('loaded' / 'unloaded') to the file name when one is given."""
+    if load_status in ['loaded', 'unloaded']:
+        name, ext = os.path.splitext(original_filename)
+        return f"{name}_{load_status}{ext}"
+    return original_filename
+
 @api_bp.route('/s3-upload', methods=['POST'])
 @token_required
 def s3_upload(current_user):
     if current_user['role'] != 's3_uploader':
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
 
+    if current_app.config['S3_STREAMING_UPLOAD'] and request.mimetype == 'multipart/form-data':
+        return s3_streaming_upload()
+
     if 'video' not in request.files:
         return jsonify({'success': False, 'error': 'No video file found in request'}), 400
 
@@ -138,28 +228,10 @@ def s3_upload(current_user):
     if not is_valid_date(upload_date):
         return jsonify({'success': False, 'error': 'Invalid upload date format.'}), 400
 
-    date_obj = datetime.datetime.strptime(upload_date, "%Y-%m-%d")
-    upload_date_str = date_obj.strftime("%d-%m-%Y")
-
-    base_folder = current_app.config['S3_UPLOAD_FOLDER']
-    # Override only for video uploads: change 'Wagon_H' to 'wagon' in the base folder
-    video_base_folder = base_folder.replace('Wagon_H', 'wagon')
-    folder_path = os.path.join(
-        video_base_folder,
-        upload_date_str,
-        user_name,
-        'Raw-videos',
-        camera_angle,
-        video_type
-    ).replace("\\", "/")
+    folder_path = raw_video_folder(upload_date, user_name, camera_angle, video_type)
 
     # Prepare the filename with load_status if provided
-    original_filename = file.filename
-    if load_status in ['loaded', 'unloaded']:
-        name, ext = os.path.splitext(original_filename)
-        new_filename = f"{name}_{load_status}{ext}"
-    else:
-        new_filename = original_filename
+    new_filename = raw_video_filename(file.filename, load_status)
 
     success, message, s3_key = upload_file_to_s3(
         file,
@@ -169,6 +241,163 @@ def s3_upload(current_user):
     )
     return jsonify({'success': success, 'message': message, 's3_key': s3_key})
 
+def s3_streaming_upload():
+    """
+    Streams the request body of /s3-upload into an S3 multipart upload (feature
+    flag S3_STREAMING_UPLOAD). The form fields must precede the 'video' part,
+    since the S3 key is derived from them before the file data arrives.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if not boundary:
+        return jsonify({'success': False, 'error': 'Missing multipart boundary'}), 400
+
+    def resolve_key(fields, filename):
+        upload_date = fields.get('upload_date')
+        camera_angle = fields.get('camera_angle')
+        video_type = fields.get('video_type')
+        user_name = fields.get('user_name')
+        if not all([filename, upload_date, camera_angle, video_type, user_name]):
+            raise ValueError('Missing form data for S3 upload; send the form fields before the video.')
+        if not is_valid_date(upload_date):
+            raise ValueError('Invalid upload date format.')
+        load_status = fields.get('load_status', '').strip().lower()
+        new_filename = secure_filename(raw_video_filename(filename, load_status))
+        return f"{raw_video_folder(upload_date, user_name, camera_angle, video_type)}/{new_filename}"
+
+    try:
+        _, s3_key, size = stream_form_upload(
+            request.stream, boundary, current_app.config['S3_BUCKET'], 'video', resolve_key
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Streaming upload failed: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': f"Error: {str(e)}"}), 500
+
+    logging.info(f"Streamed {size} bytes to S3 key: {s3_key}")
+    return jsonify({'success': True, 'message': f"File {os.path.basename(s3_key)} uploaded successfully.", 's3_key': s3_key})
+
+def is_raw_video_key(s3_key):
+    """True when s3_key follows the raw_video_folder() layout, so clients can only sign uploads there."""
+    video_base_folder = current_app.config['S3_UPLOAD_FOLDER'].replace('Wagon_H', 'wagon')
+    parts = s3_key.split('/') if s3_key and '..' not in s3_key else []
+    return s3_key.startswith(video_base_folder + '/') and 'Raw-videos' in parts
+
+def multipart_request_params(data):
+    """Returns (s3_key, upload_id) from a multipart request body, or an error response."""
+    s3_key = data.get('s3_key')
+    upload_id = data.get('upload_id')
+    if not s3_key or not upload_id:
+        return None, (jsonify({'success': False, 'error': 's3_key and upload_id are required'}), 400)
+    if not is_raw_video_key(s3_key):
+        return None, (jsonify({'success': False, 'error': 'Invalid S3 key for a video upload'}), 400)
+    return (s3_key, upload_id), None
+
+@api_bp.route('/s3-multipart/start', methods=['POST'])
+@token_required
+def s3_multipart_start(current_user):
+    """
+    Starts a direct-to-S3 multipart upload. Takes the same fields as /s3-upload
+    plus the file's name, size and content type; the browser then PUTs the
+    parts to the URLs from /s3-multipart/part-urls.
+    """
+    if current_user['role'] != 's3_uploader':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    data = request.get_json() or {}
+    filename = data.get('filename')
+    upload_date = data.get('upload_date')
+    camera_angle = data.get('camera_angle')
+    video_type = data.get('video_type')
+    user_name = data.get('user_name')
+    load_status = (data.get('load_status') or '').strip().lower()
+
+    if not all([filename, upload_date, camera_angle, video_type, user_name]):
+        return jsonify({'success': False, 'error': 'Missing form data for S3 upload'}), 400
+    if not is_valid_date(upload_date):
+        return jsonify({'success': False, 'error': 'Invalid upload date format.'}), 400
+    if filename.rsplit('.', 1)[-1].lower() not in ALLOWED_EXTENSIONS:
+        return jsonify({'success': False, 'error': 'Unsupported video format.'}), 400
+    size = data.get('size')
+    if size and (isinstance(size, bool) or not str(size).isdecimal()):
+        return jsonify({'success': False, 'error': 'size must be a non-negative integer'}), 400
+
+    folder_path = raw_video_folder(upload_date, user_name, camera_angle, video_type)
+    s3_key = f"{folder_path}/{secure_filename(raw_video_filename(filename, load_status))}"
+    try:
+        upload = start_presigned_upload(
+            current_app.config['S3_BUCKET'], s3_key,
+            content_type=data.get('content_type'),
+            total_size=int(size) if size else None
+        )
+    except Exception as e:
+        logging.error(f"Failed to start multipart upload for {s3_key}: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': f"Error: {str(e)}"}), 500
+    return jsonify({'success': True, **upload})
+
+@api_bp.route('/s3-multipart/part-urls', methods=['POST'])
+@token_required
+def s3_multipart_part_urls(current_user):
+    """Presigns PUT URLs for the requested part numbers of a multipart upload."""
+    if current_user['role'] != 's3_uploader':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    data = request.get_json() or {}
+    params, error = multipart_request_params(data)
+    if error:
+        return error
+    part_numbers = data.get('part_numbers') or []
+    if not isinstance(part_numbers, list) or not part_numbers:
+        return jsonify({'success': False, 'error': 'part_numbers must be a non-empty list'}), 400
+    try:
+        urls = presign_part_urls(current_app.config['S3_BUCKET'], *params, part_numbers)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'urls': urls})
+
+@api_bp.route('/s3-multipart/complete', methods=['POST'])
+@token_required
+def s3_multipart_complete(current_user):
+    """Assembles the uploaded parts into the final video object."""
+    if current_user['role'] != 's3_uploader':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    data = request.get_json() or {}
+    params, error = multipart_request_params(data)
+    if error:
+        return error
+    s3_key = params[0]
+    try:
+        size = complete_presigned_upload(current_app.config['S3_BUCKET'], *params, parts=data.get('parts'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except ClientError as e:
+        logging.error(f"Failed to complete multipart upload for {s3_key}: {e}")
+        return jsonify({'success': False, 'error': f"S3 error: {e.response['Error']['Message']}"}), 400
+    return jsonify({
+        'success': True,
+        'message': f"File {os.path.basename(s3_key)} uploaded successfully.",
+        's3_key': s3_key,
+        'size': size
+    })
+
+@api_bp.route('/s3-multipart/abort', methods=['POST'])
+@token_required
+def s3_multipart_abort(current_user):
+    """Cancels a multipart upload and discards its parts."""
+    if current_user['role'] != 's3_uploader':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    data = request.get_json() or {}
+    params, error = multipart_request_params(data)
+    if error:
+        return error
+    try:
+        abort_presigned_upload(current_app.config['S3_BUCKET'], *params)
+    except ClientError as e:
+        return jsonify({'success': False, 'error': f"S3 error: {e.response['Error']['Message']}"}), 400
+    return jsonify({'success': True})
+
 @api_bp.route('/s3-upload-status', methods=['POST'])
 @token_required
 def s3_upload_status(current_user):
@@ -263,40 +492,76 @@ def process_s3_videos(current_user):
 def task_status(current_user, task_id):
     # Use the main celery app instance to get the task result
     task = AsyncResult(task_id, app=celery)
-    
-    response = {'state': task.state}
-    
-    if task.state == 'PENDING':
-        response.update({
-            'status': 'Task is pending.',
-            'progress': 0
-        })
-    elif task.state == 'PROGRESS':
-        # task.info should contain the 'meta' dictionary from update_state
-        response.update(task.info or {
-            'status': 'Processing...',
-            'progress': 0
-        })
-    elif task.state == 'SUCCESS':
-        # For success, task.result holds the return value of the task
-        response.update({
-            'status': 'Task completed successfully!',
-            'progress': 100,
-            'result': task.result
-        })
-    elif task.state == 'FAILURE':
-        # For failure, task.info contains the exception.
-        # We just need to convert it to a string for the frontend.
-        response.update({
-            'status': str(task.info), # This will be the exception message
-            'progress': 100,
-            'error': True
-        })
-    else:
-        # Handle other states like REVOKED
-        response.update({'status': task.state})
-        
-    return jsonify(response)
+    return jsonify(status_payload(task.state, task.info))
+
+
+@api_bp.route('/task-status', methods=['POST'])
+@token_required
+def bulk_task_status(current_user):
+    """
+    Statuses of many tasks at once: {"task_ids": [...]} in, {"tasks": {id: status}}
+    out, each status shaped like /task-status/<task_id>. One result-backend
+    round trip for all of them.
+    """
+    data = request.get_json(silent=True) or {}
+    task_ids = data.get('task_ids')
+    if not isinstance(task_ids, list) or not all(isinstance(t, str) and t for t in task_ids):
+        return jsonify({'success': False, 'error': 'task_ids must be a list of task IDs.'}), 400
+    task_ids = list(dict.fromkeys(task_ids))
+    if len(task_ids) > MAX_BULK_TASK_IDS:
+        return jsonify({'success': False, 'error': f'At most {MAX_BULK_TASK_IDS} task IDs per request.'}), 400
+
+    infos = task_infos(celery, task_ids)
+    return jsonify({'success': True, 'tasks': {task_id: status_payload(*infos[task_id]) for task_id in task_ids}})
+
+
+@api_bp.route('/task-events/<task_id>/token', methods=['POST'])
+@token_required
+def task_events_token(current_user, task_id):
+    """
+    Short-lived token for opening /task-events/<task_id>. EventSource cannot
+    send headers, so the stream is authorized by this token in its query
+    string; it is only good for this one task's stream.
+    """
+    token = jwt.encode({
+        'username': current_user.get('username'),
+        'scope': TASK_EVENTS_SCOPE,
+        'task_id': task_id,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=TASK_EVENTS_TOKEN_SECONDS)
+    }, current_app.config['JWT_SECRET_KEY'], algorithm="HS256")
+    return jsonify({'success': True, 'token': token, 'expires_in': TASK_EVENTS_TOKEN_SECONDS})
+
+
+@api_bp.route('/task-events/<task_id>', methods=['GET'])
+def task_events(task_id):
+    """
+    Server-Sent Events stream of a task's progress, in the /task-status shape,
+    ending with its final state. Authorized by ?token= from
+    POST /task-events/<task_id>/token.
+    """
+    try:
+        claims = jwt.decode(request.args.get('token', ''), current_app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
+    except Exception as e:
+        return jsonify({'message': 'Token is invalid or expired!', 'error': str(e)}), 401
+    if claims.get('scope') != TASK_EVENTS_SCOPE or claims.get('task_id') != task_id:
+        return jsonify({'message': 'Token is not valid for this task.'}), 403
+
+    redis_client = getattr(current_app, 'redis', None)
+    if not redis_client:
+        return jsonify({'success': False, 'error': 'Progress events need Redis; poll /task-status instead.'}), 503
+
+    def current_state():
+        task = AsyncResult(task_id, app=celery)
+        return status_payload(task.state, task.info)
+
+    response = current_app.response_class(
+        stream_with_context(event_stream(redis_client, task_id, current_state)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stops nginx-style proxies from buffering the stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @api_bp.route('/cancel-task/<task_id>', methods=['POST'])
@@ -346,6 +611,12 @@ def get_system_status(current_user):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@api_bp.route('/s3-scheduler', methods=['GET'])
+@token_required
+def get_s3_scheduler_status(current_user):
+    """Per-prefix S3 concurrency limits of this API process, with throttle and retry counts."""
+    return jsonify({'success': True, 'enabled': s3_scheduler.enabled, 'prefixes': s3_scheduler.snapshot()})
+
 @api_bp.route('/chart-data', methods=['GET'])
 @token_required
 def get_chart_data(current_user):
@@ -357,31 +628,36 @@ def comparison_details(current_user, s3_path):
     if not s3_path:
         return jsonify({'success': False, 'error': 'S3 path parameter is missing.'}), 400
 
-    cache_key = f"comparison_details:{s3_path}"
-    CACHE_TTL = 3600  # Cache for 1 hour
-
     try:
-        # Caching logic (optional, can be removed if not using Redis)
-        if hasattr(current_app, 'redis') and current_app.redis:
-            cached_data = current_app.redis.get(cache_key)
-            if cached_data:
-                return jsonify(json.loads(cached_data))
-        current_app.logger.info(f"hasattr(current_app, 'redis') : {hasattr(current_app, 'redis')} | current_app.redis{current_app.redis}")
-
-        # FIX: Call the correct function from comparison_utils
-        details_data = get_comparison_details(
-            s3_base_path=s3_path,
-            bucket_name=current_app.config['S3_BUCKET']
+        bucket_name = current_app.config['S3_BUCKET']
+        if 'limit' in request.args or 'cursor' in request.args:
+            # Paged requests read and presign just their page, so they skip the whole-path cache.
+            try:
+                limit = page_limit()
+            except ValueError:
+                return jsonify({'success': False, 'error': f'limit must be an integer between 1 and {MAX_PAGE_SIZE}.'}), 400
+            page = get_comparison_details_page(s3_path, bucket_name, limit, request.args.get('cursor'))
+            if not page.get('success'):
+                status = 400 if page.get('error') == 'Invalid cursor.' else 500
+                return jsonify({'success': False, 'error': page.get('error', 'Failed to retrieve details.')}), status
+            return json_body(serialize(page), etag=True)
+
+        # One S3 scan per path at a time; stale data is served while it refreshes.
+        # The body embeds presigned URLs, so it is only cached briefly.
+        cached = get_or_compute(
+            getattr(current_app, 'redis', None),
+            f"comparison_details:{s3_path}",
+            lambda: get_comparison_details(s3_base_path=s3_path, bucket_name=bucket_name),
+            ttl=DETAILS_CACHE_SECONDS,
+            stale=DETAILS_STALE_SECONDS
         )
         
-        if not details_data.get("success"):
+        # Cache hits come back as the stored body only; they are always successful.
+        details_data = cached.payload
+        if details_data is not None and not details_data.get("success"):
             return jsonify({'success': False, 'error': details_data.get("error", "Failed to retrieve details.")}), 500
 
-        # Set cache
-        if hasattr(current_app, 'redis') and current_app.redis:
-            current_app.redis.set(cache_key, json.dumps(details_data), ex=CACHE_TTL)
-
-        return jsonify(details_data)
+        return json_body(cached.body, etag=cached.etag)
 
     except Exception as e:
         current_app.logger.error(f"Error processing comparison details for path '{s3_path}': {e}", exc_info=True)
@@ -393,33 +669,19 @@ def get_damage_counts(current_user, s3_path):
     if not s3_path:
         return jsonify({'success': False, 'error': 'S3 path is required.'}), 400
 
-    cache_key = f"damage_counts:{s3_path}"
-    CACHE_TTL = 3600 # Cache for 1 hour
-
     try:
-        # Caching logic
-        if hasattr(current_app, 'redis') and current_app.redis:
-            cached_data = current_app.redis.get(cache_key)
-            if cached_data:
-                return jsonify(json.loads(cached_data))
-                
-        current_app.logger.info(f"hasattr(current_app, 'redis') : {hasattr(current_app, 'redis')} | current_app.redis{current_app.redis}")
-
-
-        # FIX: Call the correct function from comparison_utils
-        counts_data = get_total_damage_counts(
-            s3_base_path=s3_path,
-            bucket_name=current_app.config['S3_BUCKET']
+        bucket_name = current_app.config['S3_BUCKET']
+        cached = get_or_compute(
+            getattr(current_app, 'redis', None),
+            f"damage_counts:{s3_path}",
+            lambda: get_total_damage_counts(s3_base_path=s3_path, bucket_name=bucket_name)
         )
         
-        if not counts_data.get("success"):
+        counts_data = cached.payload
+        if counts_data is not None and not counts_data.get("success"):
             return jsonify({'success': False, 'error': 'Failed to retrieve damage counts.'}), 500
-        
-        # Set cache
-        if hasattr(current_app, 'redis') and current_app.redis:
-            current_app.redis.set(cache_key, json.dumps(counts_data), ex=CACHE_TTL)
 
-        return jsonify(counts_data)
+        return json_body(cached.body, etag=cached.etag)
 
     except Exception as e:
         current_app.logger.error(f"Error getting damage counts for {s3_path}: {e}")
@@ -455,7 +717,8 @@ def run_comparison_route(current_user):
     if hasattr(current_app, 'redis') and current_app.redis:
         details_key = f"comparison_details:{relative_path}"
         counts_key = f"damage_counts:{relative_path}"
-        current_app.redis.delete(details_key, counts_key)
+        # Marked stale rather than deleted: readers keep getting the old data while it refreshes.
+        mark_stale(current_app.redis, details_key, counts_key)
         logging.info(f"Invalidated cache for keys: {details_key}, {counts_key}")
 
     try:
@@ -499,7 +762,8 @@ def run_top_detection_route(current_user):
     if hasattr(current_app, 'redis') and current_app.redis:
         details_key = f"comparison_details:{relative_path}"
         counts_key = f"damage_counts:{relative_path}"
-        current_app.redis.delete(details_key, counts_key)
+        # Marked stale rather than deleted: readers keep getting the old data while it refreshes.
+        mark_stale(current_app.redis, details_key, counts_key)
         logging.info(f"Invalidated cache for keys: {details_key}, {counts_key}")
 
     try:
@@ -518,7 +782,7 @@ def get_comparison_dates(current_user):
         bucket_name = current_app.config['S3_BUCKET']
         base_prefix = current_app.config['S3_UPLOAD_FOLDER']
         dates = find_comparison_dates_with_results(bucket_name, base_prefix)
-        return jsonify({'success': True, 'dates': dates})
+        return json_body(serialize({'success': True, 'dates': dates}), etag=True)
     except Exception as e:
         current_app.logger.error(f"Error fetching comparison dates: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -527,120 +791,97 @@ def get_comparison_dates(current_user):
 @token_required
 def get_comparisons(current_user):
     """
-    Returns a list of comparison entries from S3, each with left, right, and top data (if available).
+    Returns a list of comparison entries for every date and user, each with left, right, and top data (if available).
     For each view, returns an array of wagons (one per JSON file).
+    Entries come from the materialized comparison index; image URLs are presigned per request.
+
+    Optional query parameters page and filter the list instead:
+        limit       entries per page (default 50, at most 500)
+        cursor      'next_cursor' of the previous page
+        date_from   first date, YYYY-MM-DD (inclusive)
+        date_to     last date, YYYY-MM-DD (inclusive)
+        user        one or more users (comma separated or repeated)
+        view        one or more of left, right, top
+        order       'asc' (default) or 'desc' for newest first
+    Paged responses carry 'next_cursor', null on the last page.
     """
     bucket_name = current_app.config['S3_BUCKET']
     base_prefix = current_app.config.get('S3_COMPARISON_PREFIX', '2024_Oct_CR_WagonDamageDetection/Wagon_H/')
-    s3_client = get_s3_client()
-    if not s3_client:
-        return jsonify({'success': False, 'error': 'S3 client initialization failed'}), 500
-
-    cache_key = 'comparison_results'
-    CACHE_TTL = 3600  # 1 hour
+    paging_args = ('limit', 'cursor', 'date_from', 'date_to', 'user', 'view', 'order')
+    if any(arg in request.args for arg in paging_args):
+        return get_comparisons_page(bucket_name, base_prefix)
     try:
-        if hasattr(current_app, 'redis') and current_app.redis:
-            cached_data = current_app.redis.get(cache_key)
-            if cached_data:
-                return jsonify(json.loads(cached_data))
+        cached = get_or_compute(
+            getattr(current_app, 'redis', None),
+            comparisons_cache_key(bucket_name, base_prefix),
+            lambda: {'success': True, 'comparisons': group_comparisons(bucket_name, comparison_views(bucket_name, base_prefix))},
+            ttl=COMPARISONS_CACHE_SECONDS,
+            stale=COMPARISONS_STALE_SECONDS
+        )
+        return json_body(cached.body, etag=cached.etag)
     except Exception as e:
-        current_app.logger.error(f"Error accessing Redis cache: {e}")
-
-    # List all date folders
-    paginator = s3_client.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=bucket_name, Prefix=base_prefix, Delimiter='/')
-    date_folders = []
-    for page in pages:
-        for prefix in page.get('CommonPrefixes', []):
-            date_folders.append(prefix['Prefix'])
-
-    results = []
-    for date_prefix in date_folders:
-        # Check for admin1/Comparision_Results/
-        admin_prefix = f"{date_prefix}admin1/Comparision_Results/"
-        # Check if this folder exists by listing with Delimiter
-        admin_pages = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=admin_prefix, Delimiter='/')
-        if 'CommonPrefixes' not in admin_pages and 'Contents' not in admin_pages:
-            continue
-        entry = {
-            'date': date_prefix.rstrip('/').split('/')[-1],
-            'user': 'admin1',
-            'results': {}
-        }
-        for view in ['left', 'right', 'top']:
-            view_prefix = f"{admin_prefix}{view}/"
-            if view in ['left', 'right']:
-                # List JSON files in the view folder
-                view_objs = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=view_prefix)
-                if 'Contents' not in view_objs:
-                    continue
-                json_files = [obj['Key'] for obj in view_objs['Contents'] if obj['Key'].endswith('.json')]
-                view_data = []
-                for json_file in json_files:
-                    obj = s3_client.get_object(Bucket=bucket_name, Key=json_file)
-                    content = obj['Body'].read().decode('utf-8')
-                    try:
-                        data = json.loads(content)
-                    except Exception as e:
-                        data = {'error': f'Invalid JSON: {str(e)}'}
-                    image_key = json_file[:-5] + '.jpg'
-                    data['image_url'] = generate_presigned_url(bucket_name, image_key, 3600)
-                    for img_key in ['entry_image', 'exit_image']:
-                        if img_key in data:
-                            img_path = f"{view_prefix}{data[img_key]}"
-                            data[img_key + '_url'] = generate_presigned_url(bucket_name, img_path, 3600)
-                    data['wagon_id'] = json_file.split('/')[-1].replace('.json', '')
-                    view_data.append(data)
-                if view_data:
-                    entry['results'][view] = view_data
-            elif view == 'top':
-                top_data = []
-                for direction in ['entry', 'exit']:
-                    dir_prefix = f"{view_prefix}{direction}/"
-                    dir_objs = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=dir_prefix)
-                    if 'Contents' not in dir_objs:
-                        continue
-                    json_files = [obj['Key'] for obj in dir_objs['Contents'] if obj['Key'].endswith('.json')]
-                    for json_file in json_files:
-                        obj = s3_client.get_object(Bucket=bucket_name, Key=json_file)
-                        content = obj['Body'].read().decode('utf-8')
-                        try:
-                            data = json.loads(content)
-                        except Exception as e:
-                            data = {'error': f'Invalid JSON: {str(e)}'}
-                        # Image is in the same folder, same base name
-                        image_key = json_file[:-5] + '.jpg'
-                        data['image_url'] = generate_presigned_url(bucket_name, image_key, 3600)
-                        data['wagon_id'] = json_file.split('/')[-1].replace('.json', '')
-                        data['direction'] = direction
-                        top_data.append(data)
-                if top_data:
-                    entry['results'][view] = top_data
-        # Only add if at least one view exists
-        if entry['results']:
-            results.append(entry)
-    response_data = {'success': True, 'comparisons': results}
+        current_app.logger.error(f"Error reading comparison index: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': 'An internal server error occurred.'}), 500
+
+def get_comparisons_page(bucket_name, base_prefix):
+    """A paged, filtered /comparisons response; only the page is read from the index and presigned."""
+    date_from, date_to = request.args.get('date_from'), request.args.get('date_to')
+    if any(d and not is_valid_date(d) for d in (date_from, date_to)):
+        return jsonify({'success': False, 'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400
     try:
-        if hasattr(current_app, 'redis') and current_app.redis:
-            current_app.redis.set(cache_key, json.dumps(response_data), ex=CACHE_TTL)
+        limit = page_limit()
+    except ValueError:
+        return jsonify({'success': False, 'error': f'limit must be an integer between 1 and {MAX_PAGE_SIZE}.'}), 400
+    order = request.args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'success': False, 'error': "order must be 'asc' or 'desc'."}), 400
+
+    try:
+        comparisons, next_cursor = comparison_page(
+            bucket_name, base_prefix, limit,
+            cursor=request.args.get('cursor'),
+            date_from=date_from,
+            date_to=date_to,
+            users=list_arg('user'),
+            views=list_arg('view'),
+            descending=order == 'desc'
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
-        current_app.logger.error(f"Error setting Redis cache: {e}")
-    return jsonify(response_data)
+        current_app.logger.error(f"Error reading comparison index page: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': 'An internal server error occurred.'}), 500
+    return json_body(serialize({'success': True, 'comparisons': comparisons, 'next_cursor': next_cursor}), etag=True)
 
 # --- NEW: Route for manually refreshing the cache ---
 @api_bp.route('/cache/refresh', methods=['POST'])
 @token_required
 def refresh_cache(current_user):
     """
-    Manually triggers a refresh of the S3 comparison data cache.
+    Starts a background refresh of the S3 comparison data cache and returns
+    its job; while one is running, returns that job instead (joined: true).
+    Cached data keeps being served until the refresh replaces it.
     """
     if not hasattr(current_app, 'redis') or not current_app.redis:
         return jsonify({'success': False, 'error': 'Cache (Redis) is not available.'}), 500
 
-    # The refresh_cache_now function handles its own logging and exceptions
-    success, message = refresh_cache_now(current_app)
+    try:
+        job, started = start_cache_refresh(current_app._get_current_object())
+    except Exception as e:
+        current_app.logger.error(f"Could not start cache refresh: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': 'Could not start the cache refresh.'}), 500
+
+    message = 'Cache refresh started.' if started else 'A cache refresh is already running.'
+    return jsonify({'success': True, 'message': message, 'job_id': job['job_id'], 'joined': not started, 'job': job}), 202
+
+@api_bp.route('/cache/refresh/<job_id>', methods=['GET'])
+@token_required
+def refresh_cache_status(current_user, job_id):
+    """Status of a cache refresh job, shaped like /task-status."""
+    if not hasattr(current_app, 'redis') or not current_app.redis:
+        return jsonify({'success': False, 'error': 'Cache (Redis) is not available.'}), 500
 
-    if success:
-        return jsonify({'success': True, 'message': message}), 200
-    else:
-        return jsonify({'success': False, 'error': message}), 500
+    job = get_refresh_job(current_app.redis, job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown cache refresh job.'}), 404
+    return jsonify(job)
@@ -1,13 +1,19 @@
-from flask import Flask
+from flask import Flask, request
 from flask_cors import CORS
 from api.routes import api_bp
 from config import Config
 import os
 from dotenv import load_dotenv
+import gzip
 import logging
 import redis
+try:
+    import brotli
+except ImportError:  # optional; responses are gzip-compressed without it
+    brotli = None
 # --- NEW: Import the scheduler initializer ---
 from services.cache_manager import init_scheduler
+from services.s3_client import start_call_tracking, stop_call_tracking
 
 load_dotenv()
 
@@ -17,7 +23,7 @@ def create_app():
     logging.basicConfig(level=logging.INFO)
     
     # Enable CORS for all /api/* routes from any origin (for local dev)
-    CORS(app, resources={r"/api/*": {"origins": "*"}})
+    CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=['X-S3-Calls', 'ETag'])
         # --- Caching Implementation: Start ---
     # Initialize the Redis client.
     # This uses the REDIS_URL from your configuration, defaulting to a standard local Redis instance.
@@ -39,6 +45,39 @@ def create_app():
 
     app.register_blueprint(api_bp, url_prefix='/api')
 
+    # Count the S3 calls each request makes; exposed as a response header.
+    @app.before_request
+    def track_s3_calls():
+        start_call_tracking()
+
+    @app.after_request
+    def report_s3_calls(response):
+        calls = stop_call_tracking()
+        if calls:
+            response.headers['X-S3-Calls'] = str(sum(calls.values()))
+            logging.debug(f"S3 calls for {request.path}: {calls}")
+        return response
+
+    # Compress large JSON responses for clients that accept it.
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.direct_passthrough
+                or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+            return response
+        data = response.get_data()
+        if len(data) < app.config['RESPONSE_COMPRESS_MIN_BYTES']:
+            return response
+        if brotli and 'br' in request.accept_encodings:
+            response.set_data(brotli.compress(data, quality=5))
+            response.headers['Content-Encoding'] = 'br'
+        elif 'gzip' in request.accept_encodings:
+            response.set_data(gzip.compress(data, compresslevel=app.config['RESPONSE_COMPRESS_LEVEL']))
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            return response
+        response.vary.add('Accept-Encoding')
+        return response
+
     # --- NEW: Initialize the scheduler ---
     if app.redis:
         init_scheduler(app)
@@ -0,0 +1,275 @@
+"""
+Reproducible CPU-only benchmarks for the comparison pipeline.
+
+Exercises get_descriptor, match_defects, pipeline and run_comparison on
+synthetic entry/exit images, with the YOLO models stubbed (see stubs.py) and
+S3 replaced by moto. Reports throughput, p50/p95 latency per stage and peak
+RSS, then compares the results against baseline.json.
+
+Run from the backend/ directory:
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --pairs 20 --update-baseline
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+from collections import defaultdict
+
+from . import stubs
+
+stubs.install()
+
+import cv2
+import numpy as np
+import torch
+
+from services.metrics import StageTimer
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+BENCH_BUCKET = 'benchmark-bucket'
+BENCH_PATH = 'bench/01-01-2025/admin1/Processed_Frames/left'
+IMAGE_SIZE = (720, 1280)
+# Latency changes smaller than this are within run-to-run noise and never flagged.
+MIN_DELTA_MS = 10.0
+
+
+class SampleTimer(StageTimer):
+    """StageTimer that also keeps every sample so percentiles can be computed."""
+
+    def __init__(self):
+        super().__init__()
+        self.samples = defaultdict(list)
+
+    def record(self, name, seconds):
+        super().record(name, seconds)
+        self.samples[name].append(seconds)
+
+
+def percentiles(samples):
+    values_ms = np.asarray(samples) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(values_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(values_ms, 95)), 3)
+    }
+
+
+def stage_percentiles(timer):
+    return {name: percentiles(samples) for name, samples in timer.samples.items()}
+
+
+def make_pair(rng):
+    """Builds a synthetic entry/exit pair: a textured wagon side with painted defects."""
+    height, width = IMAGE_SIZE
+    entry = rng.integers(60, 120, size=(height, width, 3), dtype=np.uint8)
+    entry = cv2.GaussianBlur(entry, (7, 7), 0)
+    for _ in range(8):
+        x, y = int(rng.integers(0, width - 80)), int(rng.integers(0, height - 80))
+        color = tuple(int(c) for c in rng.integers(0, 255, size=3))
+        cv2.rectangle(entry, (x, y), (x + int(rng.integers(20, 80)), y + int(rng.integers(20, 80))), color, -1)
+    exit_img = entry.copy()
+    x, y = int(rng.integers(0, width - 80)), int(rng.integers(0, height - 80))
+    cv2.circle(exit_img, (x + 40, y + 40), 30, (20, 20, 200), -1)
+    return entry, exit_img
+
+
+def bench_get_descriptor(comparison_utils, pairs, rng):
+    samples = []
+    for entry, _ in pairs:
+        for _ in range(stubs.DEFECTS_PER_IMAGE):
+            x1, y1 = int(rng.integers(0, IMAGE_SIZE[1] - 64)), int(rng.integers(0, IMAGE_SIZE[0] - 64))
+            start = time.perf_counter()
+            comparison_utils.get_descriptor(entry, (x1, y1, x1 + 48, y1 + 48))
+            samples.append(time.perf_counter() - start)
+    return {'calls': len(samples), 'calls_per_sec': round(len(samples) / sum(samples), 2), **percentiles(samples)}
+
+
+def bench_match_defects(comparison_utils, pairs):
+    timer = SampleTimer()
+    samples = []
+    for entry, exit_img in pairs:
+        entry_defects = comparison_utils.detect_defects(entry, 'models/detector.pt')
+        exit_defects = comparison_utils.detect_defects(exit_img, 'models/detector.pt')
+        start = time.perf_counter()
+        comparison_utils.match_defects(entry_defects, exit_defects, entry, exit_img, timer=timer)
+        samples.append(time.perf_counter() - start)
+    return {
+        'calls': len(samples),
+        'calls_per_sec': round(len(samples) / sum(samples), 2),
+        **percentiles(samples),
+        'stages': stage_percentiles(timer)
+    }
+
+
+def bench_pipeline(comparison_utils, pairs):
+    timer = SampleTimer()
+    samples = []
+    for entry, exit_img in pairs:
+        start = time.perf_counter()
+        image, _ = comparison_utils.pipeline(entry, exit_img, 'models/best_weights.pt', 'models/detector.pt', timer=timer)
+        with timer.stage('jpeg_encoding'):
+            cv2.imencode('.jpg', image)
+        samples.append(time.perf_counter() - start)
+    return {
+        'pairs': len(samples),
+        'pairs_per_sec': round(len(samples) / sum(samples), 2),
+        **percentiles(samples),
+        'stages': stage_percentiles(timer)
+    }
+
+
+def bench_run_comparison(pairs):
+    """Runs run_comparison end to end against moto, cold and then as an unchanged rerun."""
+    import boto3
+    from moto import mock_aws
+
+    os.environ.update({
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'AWS_REGION': 'us-east-1',
+        'AWS_DEFAULT_REGION': 'us-east-1'
+    })
+
+    with mock_aws():
+        from services import compare
+
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BENCH_BUCKET)
+        for i, (entry, exit_img) in enumerate(pairs, start=1):
+            s3.put_object(Bucket=BENCH_BUCKET, Key=f"{BENCH_PATH}/entry/entry_{i}.jpg", Body=cv2.imencode('.jpg', entry)[1].tobytes())
+            s3.put_object(Bucket=BENCH_BUCKET, Key=f"{BENCH_PATH}/exit/exit_{i}.jpg", Body=cv2.imencode('.jpg', exit_img)[1].tobytes())
+
+        timer = SampleTimer()
+        start = time.perf_counter()
+        success, message, report = compare.run_comparison(BENCH_BUCKET, BENCH_PATH, timer=timer)
+        cold_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rerun_success, _, rerun_report = compare.run_comparison(BENCH_BUCKET, BENCH_PATH)
+        rerun_s = time.perf_counter() - start
+
+    if not (success and rerun_success):
+        raise RuntimeError(f"run_comparison failed during benchmark: {message}")
+    return {
+        'pairs': len(report['processed']),
+        'pairs_per_sec': round(len(report['processed']) / cold_s, 2),
+        'cold_run_s': round(cold_s, 3),
+        'unchanged_rerun_s': round(rerun_s, 3),
+        'rerun_skipped': len(rerun_report['skipped']),
+        'stages': stage_percentiles(timer)
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Prints a metric-by-metric comparison and returns the list of regressions.
+    Throughput metrics (*_per_sec) regress when they drop, latency and memory
+    metrics when they grow, by more than `tolerance` (a fraction). Latency
+    changes under MIN_DELTA_MS are ignored.
+    """
+    current = flatten(results)
+    previous = flatten(baseline.get('results', {}))
+    regressions = []
+    print(f"\n{'metric':<60}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name in sorted(previous):
+        if name not in current or not previous[name]:
+            continue
+        if not (name.endswith('_per_sec') or name.endswith('_ms') or name.endswith('_s') or name.endswith('_mb')):
+            continue
+        change = (current[name] - previous[name]) / previous[name]
+        if name.endswith('_per_sec'):
+            regressed = change < -tolerance
+        else:
+            delta_ms = (current[name] - previous[name]) * (1000 if name.endswith('_s') else 1)
+            regressed = change > tolerance and (name.endswith('_mb') or delta_ms > MIN_DELTA_MS)
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{name:<60}{previous[name]:>12}{current[name]:>12}{change:>+10.1%}{flag}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, default=10, help='Number of synthetic entry/exit pairs.')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--threads', type=int, default=1, help='torch intra-op threads; pinned for repeatability.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative change before flagging a regression.')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='Overwrite the baseline with this run.')
+    parser.add_argument('--skip-s3', action='store_true', help='Skip the run_comparison benchmark (no moto needed).')
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+
+    from services import comparison_utils
+
+    pairs = [make_pair(rng) for _ in range(args.pairs)]
+    # One warm-up pass so lazy initialisation does not skew the first samples.
+    comparison_utils.pipeline(*pairs[0], 'models/best_weights.pt', 'models/detector.pt')
+
+    results = {
+        'get_descriptor': bench_get_descriptor(comparison_utils, pairs, rng),
+        'match_defects': bench_match_defects(comparison_utils, pairs),
+        'pipeline': bench_pipeline(comparison_utils, pairs),
+    }
+    if not args.skip_s3:
+        results['run_comparison'] = bench_run_comparison(pairs)
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    print(json.dumps(results, indent=2))
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'environment': {
+                    'python': platform.python_version(),
+                    'torch': torch.__version__,
+                    'machine': platform.machine(),
+                    'pairs': args.pairs,
+                    'threads': args.threads,
+                    'seed': args.seed
+                },
+                'results': results
+            }, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline to create one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}.")
+        return 1
+    print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
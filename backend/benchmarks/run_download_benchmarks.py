@@ -0,0 +1,120 @@
+"""
+Throughput of the tuned S3 download helpers (services/s3_transfer.py) for
+large videos, at several concurrency levels.
+
+By default S3 is moto running in-process, which keeps every object in memory:
+a 5 GiB run needs well over 10 GB of RAM, and the absolute numbers measure
+moto as much as our code. Point --endpoint-url at a local S3 stand-in such as
+MinIO or `moto_server` for more realistic figures.
+
+Run from the backend/ directory:
+    python -m benchmarks.run_download_benchmarks
+    python -m benchmarks.run_download_benchmarks --sizes-mb 256 1024 --concurrency 1 4 16
+    python -m benchmarks.run_download_benchmarks --endpoint-url http://localhost:9000 --sizes-mb 1024 2048 5120
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+BENCH_BUCKET = 'download-benchmark'
+MIB = 1024 * 1024
+# Objects are assembled from one random block uploaded repeatedly as multipart parts.
+UPLOAD_PART_SIZE = 64 * MIB
+MODES = ('path', 'buffer', 'fd')
+
+
+def s3_backend(endpoint_url):
+    """moto in-process unless an endpoint for a running S3 stand-in is given."""
+    if endpoint_url:
+        os.environ['S3_ENDPOINT_URL'] = endpoint_url
+        return contextlib.nullcontext()
+    from moto import mock_aws
+    os.environ.pop('S3_ENDPOINT_URL', None)
+    return mock_aws()
+
+
+def create_object(client, key, size_bytes):
+    block = os.urandom(UPLOAD_PART_SIZE)
+    upload_id = client.create_multipart_upload(Bucket=BENCH_BUCKET, Key=key)['UploadId']
+    parts = []
+    for number, start in enumerate(range(0, size_bytes, UPLOAD_PART_SIZE), start=1):
+        body = block[:min(UPLOAD_PART_SIZE, size_bytes - start)]
+        etag = client.upload_part(Bucket=BENCH_BUCKET, Key=key, UploadId=upload_id, PartNumber=number, Body=body)['ETag']
+        parts.append({'PartNumber': number, 'ETag': etag})
+    client.complete_multipart_upload(Bucket=BENCH_BUCKET, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+
+
+def run_download(s3_transfer, mode, key, size_bytes, concurrency, chunk_size, scratch_dir, buffer):
+    start = time.perf_counter()
+    if mode == 'path':
+        s3_transfer.download_to_path(BENCH_BUCKET, key, os.path.join(scratch_dir, 'video.mp4'), concurrency, chunk_size)
+    elif mode == 'buffer':
+        s3_transfer.download_into_buffer(BENCH_BUCKET, key, buffer, concurrency, chunk_size)
+    else:
+        fd = os.open(os.path.join(scratch_dir, 'video.mp4'), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            s3_transfer.download_to_fd(BENCH_BUCKET, key, fd, concurrency, chunk_size)
+        finally:
+            os.close(fd)
+    elapsed = time.perf_counter() - start
+    return {'seconds': round(elapsed, 3), 'mib_per_sec': round(size_bytes / MIB / elapsed, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[1024, 2048, 5120], help='Object sizes in MiB.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--chunk-mb', type=int, default=16, help='Ranged GET size in MiB.')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--endpoint-url', help='S3-compatible endpoint to benchmark against instead of in-process moto.')
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_REGION', 'us-east-1')
+    # Enough pooled connections for the highest concurrency level.
+    os.environ['S3_MAX_POOL_CONNECTIONS'] = str(max(max(args.concurrency), 10))
+    chunk_size = args.chunk_mb * MIB
+
+    results = []
+    with s3_backend(args.endpoint_url):
+        from services import s3_transfer
+        from services.s3_client import client_manager
+
+        client_manager.reset()
+        client = client_manager.get_client()
+        with contextlib.suppress(client.exceptions.BucketAlreadyOwnedByYou):
+            client.create_bucket(Bucket=BENCH_BUCKET)
+
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            for size_mb in args.sizes_mb:
+                key = f"bench/Raw-videos/video_{size_mb}mb.mp4"
+                size_bytes = size_mb * MIB
+                print(f"Creating s3://{BENCH_BUCKET}/{key} ({size_mb} MiB)...", flush=True)
+                create_object(client, key, size_bytes)
+                buffer = bytearray(size_bytes) if 'buffer' in args.modes else None
+
+                for concurrency in args.concurrency:
+                    for mode in args.modes:
+                        result = run_download(s3_transfer, mode, key, size_bytes, concurrency, chunk_size, scratch_dir, buffer)
+                        results.append({'size_mb': size_mb, 'mode': mode, 'concurrency': concurrency, 'chunk_mb': args.chunk_mb, **result})
+                        print(f"{size_mb:>6} MiB  {mode:<7} concurrency={concurrency:<3} "
+                              f"{result['seconds']:>8.2f} s  {result['mib_per_sec']:>8.1f} MiB/s", flush=True)
+
+                del buffer
+                client.delete_object(Bucket=BENCH_BUCKET, Key=key)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'endpoint': args.endpoint_url or 'moto (in-process)', 'results': results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
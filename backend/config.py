@@ -15,6 +15,22 @@ class Config:
     S3_BUCKET = os.getenv('S3_BUCKET_NAME', 'aispry-project')
     S3_REGION = os.getenv('AWS_REGION', 'us-east-1')
     S3_UPLOAD_FOLDER = os.getenv('S3_UPLOAD_FOLDER', '2024_Oct_CR_WagonDamageDetection/wagon')
+    S3_COMPARISON_PREFIX = os.getenv('S3_COMPARISON_PREFIX', '2024_Oct_CR_WagonDamageDetection/Wagon_H/')
+
+    # Stream /s3-upload request bodies straight into S3 multipart uploads (services/multipart_upload.py)
+    S3_STREAMING_UPLOAD = os.getenv('S3_STREAMING_UPLOAD', 'false').lower() == 'true'
+
+    # JSON responses at least this large are gzip (or brotli, if installed) compressed
+    RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+    RESPONSE_COMPRESS_LEVEL = int(os.getenv('RESPONSE_COMPRESS_LEVEL', 5))
+
+    # S3 key catalog (services/s3_catalog.py): prefixes to index and how often to sync them
+    S3_CATALOG_PREFIXES = [S3_UPLOAD_FOLDER, S3_COMPARISON_PREFIX]
+    S3_CATALOG_SYNC_SECONDS = int(os.getenv('S3_CATALOG_SYNC_SECONDS', 60))
+    S3_CATALOG_RECONCILE_HOURS = int(os.getenv('S3_CATALOG_RECONCILE_HOURS', 6))
+
+    # Comparison index (services/comparison_index.py): updated by comparison tasks, fully rebuilt this often
+    COMPARISON_INDEX_REBUILD_MINUTES = int(os.getenv('COMPARISON_INDEX_REBUILD_MINUTES', 60))
 
     # FIX: Use the Docker service name 'redis' instead of an IP address.
     # The default value is kept for anyone running without Docker.
@@ -1,65 +1,251 @@
-import logging
+import os
 import json
+import time
+import uuid
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
+from redis.exceptions import WatchError
 
-def cache_comparison_data(app):
+CACHE_KEY_PREFIXES = ('comparison_details', 'damage_counts')
+# comparison_details bodies embed presigned image URLs, which the presigner hands
+# out with at least PRESIGN_MIN_REMAINING (600s) left, so cached bodies must stay younger.
+DETAILS_CACHE_SECONDS = 60
+DETAILS_STALE_SECONDS = 300
+# (ttl, stale) per cache key prefix; None means response_cache's defaults.
+CACHE_LIFETIMES = {'comparison_details': (DETAILS_CACHE_SECONDS, DETAILS_STALE_SECONDS)}
+# Entries whose bodies embed presigned URLs: an unchanged listing does not keep
+# them valid, so stale ones are always recomputed rather than re-marked fresh.
+URL_BEARING_PREFIXES = ('comparison_details',)
+# Paths warmed in parallel per cycle.
+WARM_CONCURRENCY = int(os.getenv('CACHE_WARM_CONCURRENCY', 8))
+# Hash of path -> listing fingerprint at the time its entries were last computed.
+FINGERPRINTS_KEY = 'cache_warm:fingerprints'
+# Timing and outcome counts of the most recent warm cycle.
+LAST_CYCLE_KEY = 'cache_warm:last_cycle'
+# Manual refresh jobs: a lock holding the running job's ID, and each job's status.
+# The running job extends the lock and saves a heartbeat every
+# REFRESH_HEARTBEAT_SECONDS; a job silent for REFRESH_LOCK_SECONDS (e.g. its
+# API process died) counts as failed and no longer holds off new refreshes.
+REFRESH_LOCK_KEY = 'cache_refresh:running'
+REFRESH_LOCK_SECONDS = int(os.getenv('CACHE_REFRESH_LOCK_SECONDS', 60))
+REFRESH_HEARTBEAT_SECONDS = REFRESH_LOCK_SECONDS / 4
+REFRESH_JOB_TTL = 86400
+
+
+def cache_paths_for_task(relative_path):
     """
-    Scans S3 for comparison data and caches it in Redis.
-    This function runs within the Flask application context to access config and Redis.
+    Cached paths that a comparison task's results feed: the task path itself
+    and, for a top-view direction (.../top/entry), the view path (.../top).
+    """
+    paths = [relative_path]
+    head, _, tail = relative_path.partition('/Processed_Frames/')
+    if '/' in tail:
+        paths.append(f"{head}/Processed_Frames/{tail.split('/')[0]}")
+    return paths
+
+
+def update_cached_path(redis_client, bucket, path, prefixes=CACHE_KEY_PREFIXES):
+    """
+    Recomputes and stores the cache entries of one path (by default the
+    details and the damage counts). Returns True only if all were computed
+    successfully (and stored, when there is Redis); a failed one leaves its
+    previous entry in place.
+    """
+    from services.comparison_utils import get_comparison_details, get_total_damage_counts
+    from services.response_cache import store
+
+    computers = {'comparison_details': get_comparison_details, 'damage_counts': get_total_damage_counts}
+    stored = True
+    for prefix in prefixes:
+        payload = computers[prefix](s3_base_path=path, bucket_name=bucket)
+        if not (payload and payload.get('success')):
+            logging.warning(f"Could not recompute {prefix} for {path}: {(payload or {}).get('error', 'no result')}")
+            stored = False
+        elif redis_client:
+            store(redis_client, f"{prefix}:{path}", payload, *CACHE_LIFETIMES.get(prefix, (None, None)))
+    return stored
+
+
+def handle_task_completed(redis_client, bucket, relative_path):
+    """
+    Completion event of a comparison or top-detection task: re-indexes the
+    results it wrote and recomputes only the cache entries they feed.
+    """
+    from services.comparison_index import index_task_path
+
+    index_task_path(bucket, relative_path)
+    for path in cache_paths_for_task(relative_path):
+        warm_path(redis_client, bucket, path, force=True)
+    logging.info(f"Updated cached comparison data for {relative_path}.")
+
+
+def comparison_paths(app):
+    """Yields every date/admin/view path whose comparison data is cached."""
+    from services.com_s3_utils import find_comparison_dates_with_results
+    from services.s3_utils import get_s3_client
+    from services.s3_catalog import get_ready_catalog
+
+    bucket = app.config['S3_BUCKET']
+    base_prefix = app.config.get('S3_UPLOAD_FOLDER')
+    s3 = get_s3_client()
+
+    # This function returns dates in 'YYYY-MM-DD' format
+    dates = find_comparison_dates_with_results(bucket, base_prefix)
+    logging.info(f"Found {len(dates)} dates with comparison results to cache.")
+
+    for date_str_ymd in dates:
+        # S3 paths are constructed with 'DD-MM-YYYY'
+        try:
+            date_obj = datetime.strptime(date_str_ymd, '%Y-%m-%d')
+            date_str_dmy = date_obj.strftime('%d-%m-%Y')
+        except ValueError:
+            logging.warning(f"Skipping date '{date_str_ymd}' due to unexpected format.")
+            continue
+
+        prefix_for_admins = f"{base_prefix}/{date_str_dmy}/"
+        
+        # Get admin subfolders for the given date
+        catalog = get_ready_catalog(bucket, prefix_for_admins)
+        if catalog:
+            admin_prefixes = catalog.list_common_prefixes(prefix_for_admins)
+        else:
+            pages = s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix_for_admins, Delimiter='/')
+            admin_prefixes = [cp['Prefix'] for page in pages for cp in page.get('CommonPrefixes', [])]
+        admins = [prefix.rstrip('/').split('/')[-1] for prefix in admin_prefixes]
+
+        for admin in admins:
+            for view in ('left', 'right', 'top'):
+                # This path needs to match exactly what the frontend requests for details
+                yield f"{base_prefix}/{date_str_dmy}/{admin}/Processed_Frames/{view}"
+
+
+def warm_path(redis_client, bucket, path, force=False):
+    """
+    Brings the cache entries of one path up to date. Unless forced, a path whose
+    listing fingerprint has not changed since its entries were computed is not
+    read again: its stale URL-free entries are just re-marked fresh, and only
+    stale entries embedding presigned URLs are recomputed. Returns (outcome,
+    {stage: seconds}) with outcome 'updated', 'refreshed', 'skipped' or
+    'failed'. The fingerprint is only recorded once both entries were
+    recomputed, so a failed path is retried on the next pass.
+    """
+    from services.com_s3_utils import listing_fingerprint
+    from services.response_cache import load_body, store_body
+
+    timings = {}
+    start = time.perf_counter()
+    fingerprint = listing_fingerprint(bucket, path)
+    timings['cache_warm.fingerprint'] = time.perf_counter() - start
+
+    if not force and fingerprint and redis_client:
+        previous = redis_client.hget(FINGERPRINTS_KEY, path)
+        cached = [(prefix, *load_body(redis_client, f"{prefix}:{path}")) for prefix in CACHE_KEY_PREFIXES]
+        # Short-lived URL-bearing entries may have expired outright; they are recomputed either way.
+        unchanged = previous and previous.decode('utf-8') == fingerprint and all(
+            body is not None for prefix, body, _ in cached if prefix not in URL_BEARING_PREFIXES
+        )
+        if unchanged:
+            stale = [(prefix, body) for prefix, body, fresh in cached if not fresh]
+            for prefix, body in stale:
+                if prefix not in URL_BEARING_PREFIXES:
+                    store_body(redis_client, f"{prefix}:{path}", body, *CACHE_LIFETIMES.get(prefix, (None, None)))
+            expiring = [prefix for prefix, _ in stale if prefix in URL_BEARING_PREFIXES]
+            if expiring:
+                start = time.perf_counter()
+                refreshed = update_cached_path(redis_client, bucket, path, expiring)
+                timings['cache_warm.compute'] = time.perf_counter() - start
+                if not refreshed:
+                    return 'failed', timings
+            return ('refreshed' if stale else 'skipped'), timings
+
+    start = time.perf_counter()
+    stored = update_cached_path(redis_client, bucket, path)
+    timings['cache_warm.compute'] = time.perf_counter() - start
+    if not stored:
+        return 'failed', timings
+    if fingerprint and redis_client:
+        redis_client.hset(FINGERPRINTS_KEY, path, fingerprint)
+    return 'updated', timings
+
+
+def warm_comparison_cache(app, force=False, progress=None):
+    """
+    Warms the cache entries of every path with up to CACHE_WARM_CONCURRENCY
+    paths in flight. Logs and stores (LAST_CYCLE_KEY) the cycle's timing.
+    progress(done, total) is called as paths finish.
     """
+    from services.metrics import StageTimer
+
     with app.app_context():
-        logging.info("Starting scheduled cache update for comparison data...")
+        start = time.perf_counter()
+        timer = StageTimer()
+        outcomes = Counter()
+        bucket = app.config['S3_BUCKET']
         try:
-            # Imports are inside the function to work with the app context
-            from services.com_s3_utils import find_comparison_dates_with_results
-            from services.s3_utils import get_s3_client
-            from services.comparison_utils import get_comparison_details, get_total_damage_counts
-
-            bucket = app.config['S3_BUCKET']
-            base_prefix = app.config.get('S3_UPLOAD_FOLDER')
-            s3 = get_s3_client()
-
-            # This function returns dates in 'YYYY-MM-DD' format
-            dates = find_comparison_dates_with_results(bucket, base_prefix)
-            logging.info(f"Found {len(dates)} dates with comparison results to cache.")
-
-            for date_str_ymd in dates:
-                # S3 paths are constructed with 'DD-MM-YYYY'
-                try:
-                    date_obj = datetime.strptime(date_str_ymd, '%Y-%m-%d')
-                    date_str_dmy = date_obj.strftime('%d-%m-%Y')
-                except ValueError:
-                    logging.warning(f"Skipping date '{date_str_ymd}' due to unexpected format.")
-                    continue
-
-                prefix_for_admins = f"{base_prefix}/{date_str_dmy}/"
-                
-                # Get admin subfolders for the given date
-                pages = s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix_for_admins, Delimiter='/')
-                admins = [cp['Prefix'].rstrip('/').split('/')[-1] for page in pages for cp in page.get('CommonPrefixes', [])]
-
-                for admin in admins:
-                    for view in ('left', 'right', 'top'):
-                        # This path needs to match exactly what the frontend requests for details
-                        path = f"{base_prefix}/{date_str_dmy}/{admin}/Processed_Frames/{view}"
-                        
-                        details = get_comparison_details(s3_base_path=path, bucket_name=bucket)
-                        counts = get_total_damage_counts(s3_base_path=path, bucket_name=bucket)
-                        
-                        if app.redis:
-                            if details and details.get('success'):
-                                app.redis.set(f"comparison_details:{path}", json.dumps(details), ex=3600)
-                            if counts and counts.get('success'):
-                                app.redis.set(f"damage_counts:{path}", json.dumps(counts), ex=3600)
-            logging.info("Finished caching comparison data.")
+            with timer.stage('cache_warm.list_paths'):
+                paths = list(comparison_paths(app))
+            with ThreadPoolExecutor(max_workers=WARM_CONCURRENCY, thread_name_prefix='cache-warm') as executor:
+                futures = {executor.submit(warm_path, app.redis, bucket, path, force): path for path in paths}
+                for future in as_completed(futures):
+                    try:
+                        outcome, timings = future.result()
+                    except Exception as e:
+                        logging.error(f"Cache warm failed for {futures[future]}: {e}", exc_info=True)
+                        outcome, timings = 'failed', {}
+                    outcomes[outcome] += 1
+                    for stage, seconds in timings.items():
+                        timer.record(stage, seconds)
+                    if progress:
+                        progress(sum(outcomes.values()), len(paths))
         except Exception as e:
-            logging.error(f"Error during scheduled cache update: {e}", exc_info=True)
+            logging.error(f"Error during cache warm: {e}", exc_info=True)
+            outcomes['failed'] += 1
+            paths = []
+
+        cycle = {
+            'finished_on': datetime.now().isoformat(),
+            'seconds': round(time.perf_counter() - start, 3),
+            'force': force,
+            'paths': len(paths),
+            'outcomes': dict(outcomes),
+            'stages': timer.summary()
+        }
+        logging.info(f"Cache warm cycle: {len(paths)} paths in {cycle['seconds']}s, {dict(outcomes)}.")
+        try:
+            if app.redis:
+                app.redis.set(LAST_CYCLE_KEY, json.dumps(cycle))
+        except Exception as e:
+            logging.warning(f"Could not store cache warm timing: {e}")
+        return cycle
+
+
+def cache_comparison_data(app):
+    """
+    Recomputes the cached comparison data of every path, changed or not.
+    This function runs within the Flask application context to access config and Redis.
+    """
+    logging.info("Starting full cache update for comparison data...")
+    return warm_comparison_cache(app, force=True)
+
+
+def reconcile_comparison_cache(app):
+    """
+    Periodic safety net behind the task completion events: recomputes only the
+    paths whose S3 listing changed since they were cached (e.g. results written
+    outside a task, or an event that was lost) or whose entries are missing.
+    """
+    return warm_comparison_cache(app, force=False)
 
 
-def refresh_cache_now(app):
+def refresh_cache_now(app, progress=None):
     """
-    Clears the existing comparison cache and immediately repopulates it.
+    Re-indexes the comparison results and recomputes every cached entry. Old
+    entries keep being served until their replacements are written.
+    progress(done, total) is called as paths finish.
     Returns a tuple of (success_boolean, message_string).
     """
     logging.info("Manual cache refresh triggered.")
@@ -68,34 +254,168 @@ def refresh_cache_now(app):
         return False, "Redis unavailable"
 
     try:
-        # Clear old keys using scan_iter to be non-blocking
-        keys_to_delete = []
-        for key in app.redis.scan_iter('comparison_details:*'):
-            keys_to_delete.append(key)
-        for key in app.redis.scan_iter('damage_counts:*'):
-            keys_to_delete.append(key)
-        
-        if keys_to_delete:
-            app.redis.delete(*keys_to_delete)
-            logging.info(f"Deleted {len(keys_to_delete)} old cache keys.")
-
-        # Immediately repopulate
-        cache_comparison_data(app)
+        rebuild_comparison_index(app)
+        cycle = warm_comparison_cache(app, force=True, progress=progress)
+        failed = cycle['outcomes'].get('failed', 0)
         logging.info("Cache repopulation complete.")
-        return True, "Cache cleared & refreshed"
+        if failed:
+            return False, f"Cache refreshed with {failed} of {cycle['paths']} paths failing"
+        return True, f"Cache refreshed ({cycle['paths']} paths)"
     except Exception as e:
         logging.error(f"Cache refresh failed: {e}", exc_info=True)
         return False, str(e)
 
 
+def _refresh_job_key(job_id):
+    return f"cache_refresh:job:{job_id}"
+
+
+def get_refresh_job(redis_client, job_id):
+    """
+    Status of a cache refresh job, shaped like /task-status, or None if unknown.
+    An unfinished job whose heartbeat stopped is reported as FAILURE.
+    """
+    raw = redis_client.get(_refresh_job_key(job_id))
+    if not raw:
+        return None
+    job = json.loads(raw)
+    if _is_abandoned(job):
+        job.update(state='FAILURE', status='The refresh stopped responding; start it again.', progress=100, error=True)
+    return job
+
+
+def _is_abandoned(job):
+    """True for an unfinished job whose heartbeat stopped, e.g. because its API process died."""
+    return job['state'] in ('PENDING', 'PROGRESS') and time.time() - job.get('heartbeat', 0) > REFRESH_LOCK_SECONDS
+
+
+def _save_refresh_job(redis_client, job):
+    redis_client.set(_refresh_job_key(job['job_id']), json.dumps(job), ex=REFRESH_JOB_TTL)
+
+
+def start_cache_refresh(app):
+    """
+    Starts refresh_cache_now as a background job and returns (job, started).
+    While a refresh is already running (in any API process) its job is
+    returned instead, with started False, so concurrent requests join it.
+    """
+    for _ in range(5):
+        job = {'job_id': uuid.uuid4().hex, 'state': 'PENDING', 'status': 'Refresh is pending.', 'progress': 0,
+               'started_on': datetime.now().isoformat(), 'heartbeat': time.time()}
+        lock = app.redis.lock(REFRESH_LOCK_KEY, timeout=REFRESH_LOCK_SECONDS, thread_local=False)
+        if lock.acquire(blocking=False, token=job['job_id']):
+            _save_refresh_job(app.redis, job)
+            threading.Thread(target=_run_cache_refresh, args=(app, job, lock),
+                             name=f"cache-refresh:{job['job_id']}", daemon=True).start()
+            return job, True
+        running_id = app.redis.get(REFRESH_LOCK_KEY)
+        raw = app.redis.get(_refresh_job_key(running_id.decode('utf-8'))) if running_id else None
+        running = json.loads(raw) if raw else None
+        if running and _is_abandoned(running):
+            # Its process is gone: record the failure and free the lock for a new run.
+            _save_refresh_job(app.redis, get_refresh_job(app.redis, running['job_id']))
+            _clear_refresh_lock(app.redis, running['job_id'])
+            continue
+        if running and running['state'] in ('PENDING', 'PROGRESS'):
+            return running, False
+        # The lock was taken but its job not yet saved, or the job just finished.
+        time.sleep(0.1)
+    raise RuntimeError("Could not start or join a cache refresh.")
+
+
+def _clear_refresh_lock(redis_client, job_id):
+    """Deletes the refresh lock if it is still held by job_id."""
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(REFRESH_LOCK_KEY)
+            if pipe.get(REFRESH_LOCK_KEY) == job_id.encode('utf-8'):
+                pipe.multi()
+                pipe.delete(REFRESH_LOCK_KEY)
+                pipe.execute()
+        except WatchError:
+            pass  # someone else took or freed it meanwhile
+
+
+def _run_cache_refresh(app, job, lock):
+    redis_client = app.redis
+    job_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def update(**fields):
+        with job_lock:
+            job.update(fields, heartbeat=time.time())
+            try:
+                _save_refresh_job(redis_client, job)
+            except Exception as e:
+                logging.warning(f"Could not save cache refresh job {job['job_id']}: {e}")
+
+    def progress(done, total):
+        update(status=f'Refreshed {done} of {total} paths', progress=int(done / total * 100) if total else 100)
+
+    def heartbeat():
+        # Keeps the lock and the job alive through stages that report no progress.
+        while not stopped.wait(REFRESH_HEARTBEAT_SECONDS):
+            try:
+                lock.reacquire()
+            except Exception as e:
+                logging.warning(f"Could not extend cache refresh lock: {e}")
+            update()
+
+    threading.Thread(target=heartbeat, name=f"cache-refresh-heartbeat:{job['job_id']}", daemon=True).start()
+    try:
+        update(state='PROGRESS', status='Rebuilding comparison index...')
+        success, message = refresh_cache_now(app, progress=progress)
+        if success:
+            update(state='SUCCESS', status=message, progress=100, finished_on=datetime.now().isoformat())
+        else:
+            update(state='FAILURE', status=message, progress=100, error=True, finished_on=datetime.now().isoformat())
+    finally:
+        stopped.set()
+        try:
+            lock.release()
+        except Exception as e:
+            logging.warning(f"Could not release cache refresh lock: {e}")
+
+
+def sync_s3_catalog(app, full=False):
+    """
+    Brings the S3 key catalog up to date for the configured prefixes.
+    Incremental by default; full=True runs a reconciliation listing.
+    """
+    from services.s3_catalog import sync_prefixes
+    sync_prefixes(app.config['S3_BUCKET'], app.config['S3_CATALOG_PREFIXES'], full=full)
+
+
+def rebuild_comparison_index(app):
+    """
+    Re-indexes all comparison results behind /comparisons. Tasks index what they
+    write; this picks up results that arrived any other way.
+    """
+    from services.comparison_index import rebuild_index
+    try:
+        rebuild_index(app.config['S3_BUCKET'], app.config['S3_COMPARISON_PREFIX'])
+    except Exception as e:
+        logging.error(f"Error rebuilding comparison index: {e}", exc_info=True)
+
+
 def init_scheduler(app):
     """
     Initializes and starts the background scheduler.
     """
     scheduler = BackgroundScheduler(daemon=True)
+    # Keep the S3 key catalog current; the first sync of a prefix is a full listing.
+    scheduler.add_job(func=sync_s3_catalog, args=[app], trigger='date', run_date=datetime.now() + timedelta(seconds=5))
+    scheduler.add_job(func=sync_s3_catalog, args=[app], trigger='interval',
+                      seconds=app.config['S3_CATALOG_SYNC_SECONDS'], max_instances=1, coalesce=True)
+    scheduler.add_job(func=sync_s3_catalog, args=[app], kwargs={'full': True}, trigger='interval',
+                      hours=app.config['S3_CATALOG_RECONCILE_HOURS'], max_instances=1, coalesce=True)
+    scheduler.add_job(func=rebuild_comparison_index, args=[app], trigger='date', run_date=datetime.now() + timedelta(seconds=10))
+    scheduler.add_job(func=rebuild_comparison_index, args=[app], trigger='interval',
+                      minutes=app.config['COMPARISON_INDEX_REBUILD_MINUTES'], max_instances=1, coalesce=True)
+    # Task completion events keep the cache current; this pass only fills in what they missed.
     # Run once on startup after a short delay to allow the app to be ready
-    scheduler.add_job(func=cache_comparison_data, args=[app], trigger='date', run_date=datetime.now() + timedelta(seconds=15))
+    scheduler.add_job(func=reconcile_comparison_cache, args=[app], trigger='date', run_date=datetime.now() + timedelta(seconds=15))
     # Schedule to run every 5 minutes thereafter
-    scheduler.add_job(func=cache_comparison_data, args=[app], trigger="interval", minutes=5)
+    scheduler.add_job(func=reconcile_comparison_cache, args=[app], trigger="interval", minutes=5, max_instances=1, coalesce=True)
     scheduler.start()
     logging.info("Background scheduler started for caching.")
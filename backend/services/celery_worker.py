@@ -1,4 +1,5 @@
 from celery import Celery, shared_task
+from celery.signals import worker_init, worker_process_shutdown, task_prerun, task_postrun, task_revoked
 from kombu import Queue
 import time
 import logging
@@ -8,7 +9,12 @@ from datetime import datetime
 from .frame_extractor import FrameExtractor
 from .s3_utils import list_videos_in_folder
 from .compare import run_comparison, run_top_detection
+from .cache_manager import handle_task_completed
+from .s3_catalog import get_redis
 from .kafka_producer import publish_detection
+from .metrics import start_metrics_server, mark_process_dead
+from .s3_client import start_call_tracking, stop_call_tracking
+from .task_progress import ProgressTask, publish_final_state
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,7 +27,9 @@ CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://redis:6
 celery = Celery(
     'tasks',
     broker=CELERY_BROKER_URL,
-    backend=CELERY_RESULT_BACKEND
+    backend=CELERY_RESULT_BACKEND,
+    # Publishes update_state calls for /task-events subscribers.
+    task_cls=ProgressTask
 )
 
 celery.conf.update(
@@ -36,6 +44,38 @@ celery.conf.update(
     task_acks_late=True,
 )
 
+
+@worker_init.connect
+def expose_worker_metrics(**kwargs):
+    """Serve the pipeline stage histograms from the main worker process."""
+    start_metrics_server()
+
+
+@worker_process_shutdown.connect
+def cleanup_worker_metrics(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
+
+
+@task_prerun.connect
+def track_task_s3_calls(**kwargs):
+    start_call_tracking()
+
+
+@task_postrun.connect
+def report_task_s3_calls(task_id=None, task=None, **kwargs):
+    calls = stop_call_tracking()
+    logger.info(f"Task {task.name if task else ''}[{task_id}] made {sum(calls.values())} S3 calls: {calls}")
+
+
+@task_postrun.connect
+def publish_task_result(task_id=None, state=None, retval=None, **kwargs):
+    publish_final_state(task_id, state, retval)
+
+
+@task_revoked.connect
+def publish_task_revoked(request=None, **kwargs):
+    publish_final_state(getattr(request, 'id', None), 'REVOKED', None)
+
 @celery.task(bind=True)
 def process_single_s3_video_task(self, bucket_name, s3_key):
     """
@@ -203,20 +243,30 @@ def run_comparison_task(self, bucket_name, relative_path):
     try:
         logging.info(f"Running comparison task for: {relative_path}")
         # Pass the task instance to the comparison function
-        status, msg = run_comparison(bucket_name, relative_path, task=self)
+        status, msg, report = run_comparison(bucket_name, relative_path, task=self)
         
         # If the comparison function reports a logical failure, raise an exception
         if not status:
             raise Exception(msg)
             
-        # On success, return the final message
-        final_result = {'status': msg, 'progress': 100, 'message': msg}
+        # On success, return the final message along with what was skipped
+        final_result = {
+            'status': msg,
+            'progress': 100,
+            'message': msg,
+            'processed_pairs': report['processed'],
+            'skipped_pairs': report['skipped'],
+            'timings': report['timings']
+        }
         self.update_state(state='SUCCESS', meta=final_result)
         return final_result
     except Exception as e:
         logging.error(f"Error during comparison: {str(e)}", exc_info=True)
         # Re-raise the exception to let Celery handle the failure state
         raise e
+    finally:
+        # Even a failed run may have written results; refresh what depends on them.
+        publish_results_updated(bucket_name, relative_path)
         
         
 @celery.task(bind=True)
@@ -234,4 +284,20 @@ def run_top_detection_task(self, bucket_name, relative_path):
         return final_result
     except Exception as e:
         logging.error(f"Error during top detection: {str(e)}", exc_info=True)
-        raise e
\ No newline at end of file
+        raise e
+    finally:
+        publish_results_updated(bucket_name, relative_path)
+
+
+def publish_results_updated(bucket_name, relative_path):
+    """Completion event of a comparison task; handled off the task by comparison_results_updated_task."""
+    try:
+        comparison_results_updated_task.delay(bucket_name, relative_path)
+    except Exception as e:
+        logging.error(f"Could not publish results update for {relative_path}: {e}")
+
+
+@celery.task
+def comparison_results_updated_task(bucket_name, relative_path):
+    """Updates the comparison index and cache entries fed by one task path."""
+    handle_task_completed(get_redis(), bucket_name, relative_path)
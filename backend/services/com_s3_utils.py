@@ -1,6 +1,8 @@
 import boto3
 from botocore.exceptions import NoCredentialsError, ClientError
 from .s3_utils import get_s3_client
+from .presigner import presign_url
+from .s3_catalog import record_upload, get_ready_catalog
 import tempfile
 import shutil
 import os
@@ -10,8 +12,14 @@ import json
 import numpy as np
 import re
 import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+# Upper bound on concurrent GETs issued by read_s3_jsons; stays below the
+# shared client's connection pool (S3_MAX_POOL_CONNECTIONS).
+JSON_READ_CONCURRENCY = int(os.getenv('S3_JSON_READ_CONCURRENCY', 16))
+
 
 def download_files_from_s3_to_temp(bucket:str, s3_path: str, temp_dir:str):
     s3 = get_s3_client()
@@ -38,19 +46,48 @@ def download_files_from_s3_to_temp(bucket:str, s3_path: str, temp_dir:str):
         logging.error(f"Something went wrong during S3 download: {e}", exc_info=True)
 
     return local_paths
+
+
+def download_keys_to_temp(bucket: str, keys: list, temp_dir: str):
+    """
+    Downloads only the given S3 keys into temp_dir, keeping their base names.
+    Returns the list of base names that were downloaded successfully.
+    """
+    s3 = get_s3_client()
+    local_paths = []
+    for key in keys:
+        try:
+            s3.download_file(bucket, key, os.path.join(temp_dir, os.path.basename(key)))
+            local_paths.append(os.path.basename(key))
+        except Exception as e:
+            logging.error(f"Failed to download s3://{bucket}/{key}: {e}", exc_info=True)
+    return local_paths
     
     
-def upload_image_to_s3(image_np, bucket_name, s3_key):
+def encode_jpeg(image_np):
     """
-    Uploads a BGR OpenCV image (NumPy array) to S3 as a .jpg.
+    Encodes a BGR OpenCV image (NumPy array) to JPEG bytes.
     """
-    client = get_s3_client()
     success, encoded_image = cv2.imencode('.jpg', image_np)
     if not success:
         raise ValueError("Image encoding failed.")
-    image_bytes = io.BytesIO(encoded_image.tobytes())
+    return encoded_image.tobytes()
 
-    client.upload_fileobj(image_bytes, bucket_name, s3_key, ExtraArgs={'ContentType': 'image/jpeg'})
+
+def upload_jpeg_bytes_to_s3(image_bytes, bucket_name, s3_key):
+    """
+    Uploads already-encoded JPEG bytes to S3.
+    """
+    client = get_s3_client()
+    response = client.put_object(Bucket=bucket_name, Key=s3_key, Body=image_bytes, ContentType='image/jpeg')
+    record_upload(bucket_name, s3_key, len(image_bytes), response.get('ETag'))
+
+
+def upload_image_to_s3(image_np, bucket_name, s3_key):
+    """
+    Uploads a BGR OpenCV image (NumPy array) to S3 as a .jpg.
+    """
+    upload_jpeg_bytes_to_s3(encode_jpeg(image_np), bucket_name, s3_key)
     
     
 def upload_json_to_s3(json_data, bucket_name, s3_key):
@@ -58,9 +95,10 @@ def upload_json_to_s3(json_data, bucket_name, s3_key):
     Uploads a Python dictionary to S3 as a .json file.
     """
     client=get_s3_client()
-    json_bytes = io.BytesIO(json.dumps(json_data, indent=2).encode('utf-8'))
+    json_bytes = json.dumps(json_data, indent=2).encode('utf-8')
 
-    client.upload_fileobj(json_bytes, bucket_name, s3_key, ExtraArgs={'ContentType': 'application/json'})
+    response = client.put_object(Bucket=bucket_name, Key=s3_key, Body=json_bytes, ContentType='application/json')
+    record_upload(bucket_name, s3_key, len(json_bytes), response.get('ETag'))
 
 def check_folder_exists_in_s3(bucket_name,folder_prefix):
     """
@@ -84,6 +122,7 @@ def upload_to_s3_from_folder(output_dir, bucket_name, s3_folder):
     for file in os.listdir(output_dir):
         file_path = os.path.join(output_dir,file)
         client.upload_file(file_path,bucket_name,s3_folder+'/'+file)
+        record_upload(bucket_name, s3_folder+'/'+file, os.path.getsize(file_path))
 
 
 # --- NEW FUNCTIONS TO SUPPORT comparison_utils.py ---
@@ -107,16 +146,39 @@ def read_s3_json(bucket_name, s3_key):
         logging.error(f"Error reading JSON from s3://{bucket_name}/{s3_key}: {e}", exc_info=True)
         return None
 
-def list_s3_objects(bucket_name, prefix, extension=None):
+def read_s3_jsons(bucket_name, s3_keys, max_workers=None):
+    """
+    Reads many JSON files concurrently. Returns a list of parsed objects in the
+    same order as s3_keys, with the same per-key handling as read_s3_json:
+    missing or unreadable files come back as None, other S3 errors are raised.
+    """
+    s3_keys = list(s3_keys)
+    if not s3_keys:
+        return []
+    workers = min(max_workers or JSON_READ_CONCURRENCY, len(s3_keys))
+    if workers <= 1:
+        return [read_s3_json(bucket_name, key) for key in s3_keys]
+    # Run each read in a copy of the caller's context so per-request S3 call tracking still sees it.
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='s3-json') as executor:
+        return list(executor.map(lambda key: context.copy().run(read_s3_json, bucket_name, key), s3_keys))
+
+def list_s3_objects(bucket_name, prefix, extension=None, use_catalog=False):
     """
     Lists object keys in an S3 folder, optionally filtering by extension.
     This version is more robust and correctly handles folder prefixes.
+    With use_catalog=True the keys come from the S3 catalog when it covers the prefix.
     """
-    s3 = get_s3_client()
-    paginator = s3.get_paginator('list_objects_v2')
-    
     if not prefix.endswith('/'):
         prefix += '/'
+
+    if use_catalog:
+        catalog = get_ready_catalog(bucket_name, prefix)
+        if catalog:
+            return catalog.list_keys(prefix, extension)
+
+    s3 = get_s3_client()
+    paginator = s3.get_paginator('list_objects_v2')
         
     pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix)
     object_keys = []
@@ -139,20 +201,150 @@ def list_s3_objects(bucket_name, prefix, extension=None):
         return []
 
 
-def get_s3_public_url(bucket_name, s3_key):
+def list_s3_objects_with_metadata(bucket_name, prefix, extension=None):
     """
-    Generates a pre-signed public URL for an S3 object.
+    Lists objects under a prefix with their ETag, size and LastModified.
+    Returns a dict of {key: {'etag', 'size', 'last_modified'}}.
     """
     s3 = get_s3_client()
+    paginator = s3.get_paginator('list_objects_v2')
+
+    if not prefix.endswith('/'):
+        prefix += '/'
+
+    objects = {}
     try:
-        s3.head_object(Bucket=bucket_name, Key=s3_key)
-        
-        url = s3.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket_name, 'Key': s3_key},
-            ExpiresIn=3600  
-        )
-        return url
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                key = obj['Key']
+                if key.endswith('/') or (extension and not key.endswith(extension)):
+                    continue
+                objects[key] = {
+                    'etag': obj['ETag'].strip('"'),
+                    'size': obj['Size'],
+                    'last_modified': obj['LastModified'].isoformat()
+                }
+    except Exception as e:
+        logging.error(f"Error listing objects in s3://{bucket_name}/{prefix}: {e}", exc_info=True)
+    return objects
+
+
+def listing_fingerprint(bucket_name, prefix):
+    """
+    Cheap change detector for everything under a prefix: "<key count>:<newest
+    LastModified>". Answered from the S3 catalog when it covers the prefix,
+    otherwise by one listing. Returns None if the listing fails.
+    """
+    if not prefix.endswith('/'):
+        prefix += '/'
+    count, newest = 0, 0.0
+    catalog = get_ready_catalog(bucket_name, prefix)
+    try:
+        if catalog:
+            for _, meta in catalog.iter_objects(prefix):
+                count += 1
+                newest = max(newest, (meta or {}).get('last_modified') or 0.0)
+        else:
+            paginator = get_s3_client().get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+                for obj in page.get('Contents', []):
+                    count += 1
+                    newest = max(newest, obj['LastModified'].timestamp())
+    except Exception as e:
+        logging.error(f"Error fingerprinting s3://{bucket_name}/{prefix}: {e}", exc_info=True)
+        return None
+    return f"{count}:{newest:.3f}"
+
+# Bookkeeping objects written next to results. They deliberately do not end in
+# '.json' so the readers that list result folders for '*.json' never see them.
+RUN_MANIFEST_NAME = "_run.manifest"
+
+
+def read_manifest(bucket_name, s3_key):
+    """
+    Reads a manifest object from S3. Returns an empty dict when it does not
+    exist or cannot be parsed, so callers can treat it as "nothing done yet".
+    """
+    try:
+        return read_s3_json(bucket_name, s3_key) or {}
+    except ClientError as e:
+        logging.warning(f"Could not read manifest s3://{bucket_name}/{s3_key}: {e}")
+        return {}
+
+
+def write_manifest(manifest, bucket_name, s3_key):
+    """
+    Writes a manifest dictionary to S3 as compact JSON.
+    """
+    client = get_s3_client()
+    body = json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+    response = client.put_object(Bucket=bucket_name, Key=s3_key, Body=body, ContentType='application/json')
+    record_upload(bucket_name, s3_key, len(body), response.get('ETag'))
+
+
+# One object per result folder holding every per-wagon JSON of that folder, so
+# readers can load a whole folder with a single GET.
+SUMMARY_MANIFEST_NAME = "_summary.manifest"
+
+
+def summary_entry(data, image_name):
+    """A per-wagon entry of a folder summary: the wagon's JSON and its image file name."""
+    return {'image': image_name, 'data': data}
+
+
+def write_folder_summary(entries, bucket_name, folder):
+    """
+    Writes the summary manifest of a result folder. `entries` maps each JSON
+    file name in the folder to a summary_entry().
+    """
+    write_manifest({
+        'version': 1,
+        'generated_on': datetime.now().strftime("%d-%m-%Y %H:%M:%S"),
+        'files': entries
+    }, bucket_name, f"{folder.rstrip('/')}/{SUMMARY_MANIFEST_NAME}")
+
+
+def read_folder_summary(bucket_name, folder):
+    """Returns {json file name: entry} from a folder's summary manifest, or {} if it has none."""
+    return read_manifest(bucket_name, f"{folder.rstrip('/')}/{SUMMARY_MANIFEST_NAME}").get('files', {})
+
+
+def read_folder_jsons(bucket_name, folder, s3_keys):
+    """
+    Reads JSON files that all live directly in `folder`, in order. Files covered
+    by the folder's summary manifest are served from it; anything it does not
+    cover (or every file, when there is no summary) is read individually.
+    """
+    s3_keys = list(s3_keys)
+    if not s3_keys:
+        return []
+    summary = read_folder_summary(bucket_name, folder)
+    results = [summary[os.path.basename(key)]['data'] if os.path.basename(key) in summary else None for key in s3_keys]
+    missing = [i for i, key in enumerate(s3_keys) if os.path.basename(key) not in summary]
+    if missing:
+        if summary:
+            logging.info(f"Summary of {folder} misses {len(missing)} of {len(s3_keys)} files; reading them individually.")
+        for i, data in zip(missing, read_s3_jsons(bucket_name, [s3_keys[i] for i in missing])):
+            results[i] = data
+    return results
+
+
+def get_s3_public_url(bucket_name, s3_key, existing_keys=None, verify=False):
+    """
+    Generates a pre-signed public URL for an S3 object.
+
+    Signing is local, so by default no request is made. Pass `existing_keys`
+    (e.g. a set built from a listing the caller already did) to return None for
+    keys that are not present, or verify=True to confirm existence with a
+    HEAD request as a last resort.
+    """
+    if existing_keys is not None and s3_key not in existing_keys:
+        logging.warning(f"Cannot generate URL. Object not found at s3://{bucket_name}/{s3_key}")
+        return None
+    try:
+        if verify:
+            get_s3_client().head_object(Bucket=bucket_name, Key=s3_key)
+        return presign_url(bucket_name, s3_key, 3600)
     except ClientError as e:
         if e.response['Error']['Code'] == '404':
             logging.warning(f"Cannot generate URL. Object not found at s3://{bucket_name}/{s3_key}")
@@ -168,14 +360,18 @@ def find_comparison_dates_with_results(bucket_name, base_prefix):
     OPTIMIZED: Efficiently finds dates with comparison results by listing relevant
     files directly instead of iterating through folders.
     """
-    s3 = get_s3_client()
     if not base_prefix.endswith('/'):
         base_prefix += '/'
     
-    paginator = s3.get_paginator('list_objects_v2')
-    # Search for any JSON file within any 'Comparision_Results' folder.
-    # This is much faster than listing directories level by level.
-    pages = paginator.paginate(Bucket=bucket_name, Prefix=base_prefix)
+    catalog = get_ready_catalog(bucket_name, base_prefix)
+    if catalog:
+        # Answer from the key catalog instead of walking the bucket.
+        pages = [{'Contents': ({'Key': key} for key in catalog.iter_keys(base_prefix) if '/Comparision_Results/' in key)}]
+    else:
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+        # Search for any JSON file within any 'Comparision_Results' folder.
+        # This is much faster than listing directories level by level.
+        pages = paginator.paginate(Bucket=bucket_name, Prefix=base_prefix)
     
     valid_dates = set()
     # Regex to capture the date part (DD-MM-YYYY or YYYY-MM-DD) from the S3 key.
@@ -1,12 +1,19 @@
 import os
 import cv2
+import json
 from services.com_s3_utils import *
 import tempfile 
 import shutil
 import re
+import hashlib
+from datetime import datetime
 from services.comparison_utils import pipeline, yaml_loader, top_detect_and_annotate
 import logging
 from services.s3_utils import upload_file_to_s3
+from services.metrics import StageTimer, timed
+
+# How many processed pairs to accumulate before the run manifest is rewritten.
+MANIFEST_FLUSH_EVERY = 10
 
 
 def extract_number(filename):
@@ -21,40 +28,99 @@ def clear_temp_dir(temp_dir:str):
         shutil.rmtree(temp_dir)
     
 
-def run_comparison(bucket_name:str,path:str, task=None):
+def get_model_version(model_path:str):
+    """
+    Returns a short content fingerprint of a model file so results can be tied
+    to the weights that produced them. Falls back to the file name if missing.
+    """
+    if not os.path.exists(model_path):
+        return os.path.basename(model_path)
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"{os.path.basename(model_path)}:{digest.hexdigest()[:16]}"
+
+
+def is_pair_up_to_date(record, entry_etag, exit_etag, models, existing_outputs):
+    """
+    A pair can be skipped when its inputs and models are unchanged since the
+    last run and both of its outputs are still present in S3.
+    """
+    if not record:
+        return False
+    return (
+        record.get('entry', {}).get('etag') == entry_etag
+        and record.get('exit', {}).get('etag') == exit_etag
+        and record.get('models') == models
+        and all(key in existing_outputs for key in record.get('outputs', {}).values())
+    )
+
+
+def refresh_folder_summary(bucket_name, folder, json_names, new_entries):
+    """
+    Rewrites the summary manifest of a result folder so that it covers
+    json_names. Entries produced by this run come from new_entries, the others
+    from the previous summary or, failing that, from the JSON files themselves.
+    Nothing is written when the summary is already up to date.
+    """
+    previous = read_folder_summary(bucket_name, folder)
+    entries = {}
+    unknown = []
+    for name in sorted(set(json_names) | set(new_entries)):
+        if name in new_entries:
+            entries[name] = new_entries[name]
+        elif name in previous:
+            entries[name] = previous[name]
+        else:
+            unknown.append(name)
+    for name, data in zip(unknown, read_s3_jsons(bucket_name, [f"{folder}/{name}" for name in unknown])):
+        if data is not None:
+            entries[name] = summary_entry(data, data.get('image_name', f"{os.path.splitext(name)[0]}.jpg"))
+    if entries != previous:
+        write_folder_summary(entries, bucket_name, folder)
+
+
+def run_comparison(bucket_name:str,path:str, task=None, timer=None):
     """
     Runs a side-by-side comparison between 'entry' and 'exit' images.
+
+    A manifest stored next to the results records the input ETags, model
+    versions and output keys of every processed pair, so a rerun only
+    recomputes pairs that are new or changed. A summary manifest with every
+    pair's JSON is kept alongside for the readers.
+    Returns (success, message, report) where report lists processed and skipped
+    pairs and the per-stage timings of this run (collected in `timer` if given).
     """
     output_path = path.replace('/Processed_Frames/','/Comparision_Results/')
+    manifest_key = f"{output_path}/{RUN_MANIFEST_NAME}"
+    report = {'total_pairs': 0, 'processed': [], 'skipped': [], 'timings': {}}
+    timer = timer or StageTimer()
     
     entry_path = os.path.join(path, 'entry').replace("\\", "/")
     exit_path = os.path.join(path, 'exit').replace("\\", "/")
 
     if not (check_folder_exists_in_s3(bucket_name, entry_path) and check_folder_exists_in_s3(bucket_name, exit_path)):
-        return False, "Proper 'entry' and 'exit' paths don't exist."
+        return False, "Proper 'entry' and 'exit' paths don't exist.", report
     
-    entry_temp_dir = tempfile.mkdtemp()
-    exit_temp_dir = tempfile.mkdtemp()
-    entry_list = download_files_from_s3_to_temp(bucket_name, entry_path, entry_temp_dir)
-    exit_list = download_files_from_s3_to_temp(bucket_name, exit_path, exit_temp_dir)
+    entry_objects = list_s3_objects_with_metadata(bucket_name, entry_path)
+    exit_objects = list_s3_objects_with_metadata(bucket_name, exit_path)
+    entry_keys = {os.path.basename(key): key for key in entry_objects}
+    exit_keys = {os.path.basename(key): key for key in exit_objects}
+    entry_list = list(entry_keys)
+    exit_list = list(exit_keys)
     
     if not entry_list:
         logging.error(f"No files found in {entry_path}. Stopping the process.")
-        clear_temp_dir(entry_temp_dir)
-        clear_temp_dir(exit_temp_dir)
-        return (False, f"No files in {entry_path}. Stopping the process.")
+        return (False, f"No files in {entry_path}. Stopping the process.", report)
     
     if not exit_list:
         logging.error(f"No files found in {exit_path}. Stopping the process.")
-        clear_temp_dir(entry_temp_dir)
-        clear_temp_dir(exit_temp_dir)
-        return (False, f"No files in {exit_path}. Stopping the process.")
+        return (False, f"No files in {exit_path}. Stopping the process.", report)
         
     if len(entry_list) != len(exit_list):
         logging.error(f"Mismatched file counts: {len(entry_list)} entry images and {len(exit_list)} exit images.")
-        clear_temp_dir(entry_temp_dir)
-        clear_temp_dir(exit_temp_dir)
-        return (False, f"Number of entry images ({len(entry_list)}) does not match exit images ({len(exit_list)}).")
+        return (False, f"Number of entry images ({len(entry_list)}) does not match exit images ({len(exit_list)}).", report)
     
     try:
         entry_list = sorted(entry_list, key=extract_number)
@@ -63,43 +129,111 @@ def run_comparison(bucket_name:str,path:str, task=None):
         logging.warning(f"Failed to sort image lists: {e}. Proceeding without sorting.")
         
     images = list(zip(entry_list, exit_list))
-    total_images = len(images)
-    processed_images = 0
+    report['total_pairs'] = len(images)
     
     config = yaml_loader()
     logging.info(f"{config}")
     config = config["MODELS"]
+    models = {
+        'wagon': get_model_version(config['WAGON_MODEL_PATH']),
+        'damage': get_model_version(config['DAMAGE_MODEL_PATH'])
+    }
+
+    # --- Work out which pairs actually need recomputing ---
+    manifest = read_manifest(bucket_name, manifest_key)
+    pair_records = manifest.get('pairs', {})
+    existing_outputs = list_s3_objects_with_metadata(bucket_name, output_path)
+    pending = []
+    for ent, exi in images:
+        base_filename = f"{os.path.splitext(ent)[0]}&{os.path.splitext(exi)[0]}"
+        entry_etag = entry_objects[entry_keys[ent]]['etag']
+        exit_etag = exit_objects[exit_keys[exi]]['etag']
+        if is_pair_up_to_date(pair_records.get(base_filename), entry_etag, exit_etag, models, existing_outputs):
+            report['skipped'].append(base_filename)
+        else:
+            pending.append((ent, exi, base_filename, entry_etag, exit_etag))
+
+    if report['skipped']:
+        logging.info(f"Skipping {len(report['skipped'])} unchanged pairs under {output_path}.")
+    existing_jsons = [os.path.basename(key) for key in existing_outputs if key.endswith('.json')]
+    if not pending:
+        # Backfills the summary of folders produced before summaries existed.
+        try:
+            refresh_folder_summary(bucket_name, output_path, existing_jsons, {})
+        except Exception as e:
+            logging.warning(f"Failed to write summary manifest for {output_path}: {e}")
+        return (True, f"All {len(images)} pairs are up to date; nothing to recompute.", report)
+
+    entry_temp_dir = tempfile.mkdtemp()
+    exit_temp_dir = tempfile.mkdtemp()
+    with timed(timer, "download"):
+        download_keys_to_temp(bucket_name, [entry_keys[ent] for ent, *_ in pending], entry_temp_dir)
+        download_keys_to_temp(bucket_name, [exit_keys[exi] for _, exi, *_ in pending], exit_temp_dir)
+
+    total_images = len(pending)
+    processed_images = 0
+    summary_entries = {}
+    success = True
     try:
-        for ent, exi in images:
+        for ent, exi, base_filename, entry_etag, exit_etag in pending:
             entry_img = cv2.imread(os.path.join(entry_temp_dir, ent))
             exit_img = cv2.imread(os.path.join(exit_temp_dir, exi))
-            img, json_data = pipeline(entry_img, exit_img, config['WAGON_MODEL_PATH'], config['DAMAGE_MODEL_PATH'])
+            img, json_data = pipeline(entry_img, exit_img, config['WAGON_MODEL_PATH'], config['DAMAGE_MODEL_PATH'], timer=timer)
             
-            base_filename = f"{os.path.splitext(ent)[0]}&{os.path.splitext(exi)[0]}"
             file_path = f"{output_path}/{base_filename}.jpg"
             json_path = f"{output_path}/{base_filename}.json"
             
             json_data['entry_image'] = ent
             json_data['exit_image'] = exi
             
-            upload_image_to_s3(img, bucket_name, file_path)
-            upload_json_to_s3(json_data, bucket_name, json_path)
+            with timed(timer, "jpeg_encoding"):
+                image_bytes = encode_jpeg(img)
+            with timed(timer, "upload"):
+                upload_jpeg_bytes_to_s3(image_bytes, bucket_name, file_path)
+                upload_json_to_s3(json_data, bucket_name, json_path)
+            summary_entries[f"{base_filename}.json"] = summary_entry(json_data, f"{base_filename}.jpg")
+            pair_records[base_filename] = {
+                'entry': {'key': entry_keys[ent], 'etag': entry_etag},
+                'exit': {'key': exit_keys[exi], 'etag': exit_etag},
+                'models': models,
+                'outputs': {'image': file_path, 'json': json_path},
+                'processed_on': datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+            }
+            report['processed'].append(base_filename)
             processed_images += 1
+            if processed_images % MANIFEST_FLUSH_EVERY == 0:
+                write_manifest({'version': 1, 'pairs': pair_records}, bucket_name, manifest_key)
             if task:
                 progress = int((processed_images / total_images) * 100)
                 task.update_state(
                     state='PROGRESS',
-                    meta={'status': f'Processing image {processed_images}/{total_images}', 'progress': progress}
+                    meta={
+                        'status': f'Processing image {processed_images}/{total_images} ({len(report["skipped"])} unchanged skipped)',
+                        'progress': progress
+                    }
                 )
     except Exception as e:
         logging.error(f"An error occurred during the comparison pipeline: {e}", exc_info=True)
+        success = False
+    finally:
+        # Persist whatever finished so a rerun after a failure resumes from here.
+        if report['processed']:
+            try:
+                write_manifest({'version': 1, 'pairs': pair_records}, bucket_name, manifest_key)
+            except Exception as e:
+                logging.error(f"Failed to write run manifest {manifest_key}: {e}", exc_info=True)
+            try:
+                refresh_folder_summary(bucket_name, output_path, existing_jsons, summary_entries)
+            except Exception as e:
+                logging.error(f"Failed to write summary manifest for {output_path}: {e}", exc_info=True)
         clear_temp_dir(entry_temp_dir)
         clear_temp_dir(exit_temp_dir)
-        return (False, "Something went wrong during comparison. Please check server logs.") 
-    
-    clear_temp_dir(entry_temp_dir)
-    clear_temp_dir(exit_temp_dir)
-    return (True, "Comparison processing is complete and results have been saved.")
+        report['timings'] = timer.summary()
+
+    if not success:
+        return (False, "Something went wrong during comparison. Please check server logs.", report)
+    return (True, f"Comparison processing is complete and results have been saved. "
+                  f"Processed {len(report['processed'])} pairs, skipped {len(report['skipped'])} unchanged pairs.", report)
 
 def run_top_detection(bucket_name:str, path:str):
     """
@@ -123,6 +257,19 @@ def run_top_detection(bucket_name:str, path:str):
         
         logging.info(f"Uploading results from {output_dir} to s3://{bucket_name}/{output_path}")
         upload_to_s3_from_folder(output_dir, bucket_name, output_path)
+
+        # The summary is only an optimisation (readers fall back to the JSONs), so it cannot fail the run.
+        try:
+            summary_entries = {}
+            for name in os.listdir(output_dir):
+                if name.endswith('.json'):
+                    with open(os.path.join(output_dir, name)) as f:
+                        data = json.load(f)
+                    summary_entries[name] = summary_entry(data, data.get('image_name'))
+            existing_jsons = [os.path.basename(key) for key in list_s3_objects(bucket_name, output_path, extension='.json')]
+            refresh_folder_summary(bucket_name, output_path, existing_jsons, summary_entries)
+        except Exception as e:
+            logging.warning(f"Failed to write summary manifest for {output_path}: {e}")
     except Exception as e:
         logging.error(f"An error occurred during top detection: {e}", exc_info=True)
         return (False, "An error occurred during top detection. Please check the logs.")
@@ -0,0 +1,369 @@
+"""
+Materialized index of comparison results for the /comparisons endpoint.
+
+Results live under
+    {base}/{date}/{user}/Comparision_Results/{left|right}/{wagon}.json
+    {base}/{date}/{user}/Comparision_Results/top/{entry|exit}/{wagon}.json
+and answering /comparisons straight from S3 means listing every date, user
+and view and reading every JSON. Instead, each (date, user, view) is read once
+when a comparison task finishes (index_task_path) and stored in Redis; the
+endpoint only reads the index and presigns image URLs at request time, since
+presigned URLs expire and must not be stored.
+
+Redis layout, per bucket and base prefix:
+    cmpidx:{bucket}:{base}:members   sorted set "date|user|view", scored by the date as YYYYMMDD
+    cmpidx:{bucket}:{base}:views     hash "date|user|view" -> JSON list of wagons
+    cmpidx:{bucket}:{base}:built     timestamp of the last full rebuild
+
+Each wagon is stored as {'data': <result JSON + wagon_id/direction>,
+'images': {url field: S3 key}}. A full rebuild (rebuild_index) indexes
+everything under the base prefix, for all users, from one listing.
+"""
+import re
+import json
+import time
+import base64
+import logging
+from datetime import datetime
+from collections import defaultdict
+
+from .s3_catalog import get_redis, get_ready_catalog
+from .s3_client import client_manager
+from .presigner import presign_urls
+from .com_s3_utils import list_s3_objects, read_folder_jsons
+from .response_cache import single_flight, mark_stale
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FOLDER = 'Comparision_Results'
+VIEWS = ('left', 'right', 'top')
+TOP_DIRECTIONS = ('entry', 'exit')
+URL_EXPIRATION = 3600
+# The /comparisons body embeds presigned URLs, which the presigner hands out with
+# at least PRESIGN_MIN_REMAINING (600s) left, so cached bodies must stay younger.
+RESPONSE_CACHE_SECONDS = 60
+RESPONSE_STALE_SECONDS = 300
+# Index members fetched per round trip while paging.
+PAGE_BATCH = 200
+
+
+def _base(base_prefix):
+    return base_prefix.strip('/')
+
+
+def member_name(date, user, view):
+    return f"{date}|{user}|{view}"
+
+
+def split_member(member):
+    date, user, view = member.split('|')
+    return date, user, view
+
+
+def date_score(date):
+    """Sort score of a date folder (DD-MM-YYYY or YYYY-MM-DD) as YYYYMMDD; 0 if unparseable."""
+    for fmt in ('%d-%m-%Y', '%Y-%m-%d'):
+        try:
+            return int(datetime.strptime(date, fmt).strftime('%Y%m%d'))
+        except ValueError:
+            continue
+    return 0
+
+
+def view_prefix(base_prefix, date, user, view):
+    return f"{_base(base_prefix)}/{date}/{user}/{RESULTS_FOLDER}/{view}/"
+
+
+def parse_task_path(relative_path):
+    """
+    Splits a comparison task path ({base}/{date}/{user}/Processed_Frames/{view}[/{direction}])
+    into (base_prefix, date, user, view). Returns None if it does not have that shape.
+    """
+    head, sep, tail = relative_path.strip('/').partition('/Processed_Frames/')
+    parts = head.split('/')
+    if not sep or len(parts) < 3 or not tail:
+        return None
+    return '/'.join(parts[:-2]), parts[-2], parts[-1], tail.split('/')[0]
+
+
+def _wagon(data, json_key, folder, direction=None):
+    if data is None:
+        data = {'error': 'Invalid JSON'}
+    data['wagon_id'] = json_key.split('/')[-1].replace('.json', '')
+    images = {'image_url': json_key[:-5] + '.jpg'}
+    if direction:
+        data['direction'] = direction
+    else:
+        for img_key in ('entry_image', 'exit_image'):
+            if img_key in data:
+                images[img_key + '_url'] = f"{folder}{data[img_key]}"
+    return {'data': data, 'images': images}
+
+
+def _read_folder(bucket_name, folder, json_keys, direction=None):
+    # One GET for the folder's summary manifest; individual reads only for what it misses
+    return [_wagon(data, key, folder, direction)
+            for key, data in zip(json_keys, read_folder_jsons(bucket_name, folder, json_keys))]
+
+
+def load_view(bucket_name, base_prefix, date, user, view, json_keys=None):
+    """
+    Reads the wagons of one (date, user, view) from S3. `json_keys` maps a
+    folder to its JSON keys when the caller already listed them.
+    """
+    prefix = view_prefix(base_prefix, date, user, view)
+    folders = [(f"{prefix}{direction}/", direction) for direction in TOP_DIRECTIONS] if view == 'top' else [(prefix, None)]
+    wagons = []
+    for folder, direction in folders:
+        keys = json_keys.get(folder, []) if json_keys is not None else list_s3_objects(bucket_name, folder, extension='.json', use_catalog=True)
+        if keys:
+            wagons.extend(_read_folder(bucket_name, folder, sorted(keys), direction))
+    return wagons
+
+
+def scan_views(bucket_name, base_prefix):
+    """
+    Lists every result JSON under the base prefix once and yields
+    (date, user, view, wagons) for each view that has results.
+    """
+    base = _base(base_prefix) + '/'
+    pattern = re.compile(re.escape(base) + rf"([^/]+)/([^/]+)/{RESULTS_FOLDER}/(left|right|top)/(.*/)?[^/]+\.json$")
+    catalog = get_ready_catalog(bucket_name, base)
+    if catalog:
+        keys = catalog.iter_keys(base)
+    else:
+        pages = client_manager.get_client().get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=base)
+        keys = (obj['Key'] for page in pages for obj in page.get('Contents', []))
+
+    grouped = defaultdict(lambda: defaultdict(list))
+    for key in keys:
+        match = pattern.match(key)
+        if match:
+            date, user, view = match.group(1), match.group(2), match.group(3)
+            grouped[(date, user, view)][key.rsplit('/', 1)[0] + '/'].append(key)
+
+    for (date, user, view), json_keys in sorted(grouped.items()):
+        wagons = load_view(bucket_name, base_prefix, date, user, view, json_keys)
+        if wagons:
+            yield date, user, view, wagons
+
+
+class ComparisonIndex:
+    """Index of one bucket and base prefix in Redis."""
+
+    def __init__(self, redis_client, bucket_name, base_prefix):
+        self.redis = redis_client
+        self.bucket = bucket_name
+        self.base_prefix = _base(base_prefix)
+        key = f"cmpidx:{bucket_name}:{self.base_prefix}"
+        self.members_key = f"{key}:members"
+        self.views_key = f"{key}:views"
+        self.built_key = f"{key}:built"
+
+    def is_built(self):
+        return bool(self.redis.exists(self.built_key))
+
+    def store_view(self, date, user, view, wagons, pipe=None):
+        member = member_name(date, user, view)
+        target = pipe if pipe is not None else self.redis.pipeline()
+        if wagons:
+            target.zadd(self.members_key, {member: date_score(date)})
+            target.hset(self.views_key, member, json.dumps(wagons))
+        else:
+            target.zrem(self.members_key, member)
+            target.hdel(self.views_key, member)
+        if pipe is None:
+            target.execute()
+
+    def update_view(self, date, user, view):
+        """Re-reads one (date, user, view) from S3 into the index. Returns the wagon count."""
+        wagons = load_view(self.bucket, self.base_prefix, date, user, view)
+        self.store_view(date, user, view, wagons)
+        mark_stale(self.redis, response_cache_key(self.bucket, self.base_prefix))
+        return len(wagons)
+
+    def rebuild(self):
+        """Re-indexes everything under the base prefix and drops views that no longer exist."""
+        start = time.perf_counter()
+        seen = set()
+        pipe = self.redis.pipeline(transaction=False)
+        for date, user, view, wagons in scan_views(self.bucket, self.base_prefix):
+            seen.add(member_name(date, user, view))
+            self.store_view(date, user, view, wagons, pipe)
+        stale = [m.decode('utf-8') for m in self.redis.zrange(self.members_key, 0, -1)]
+        for member in set(stale) - seen:
+            self.store_view(*split_member(member), [], pipe)
+        pipe.set(self.built_key, time.time())
+        pipe.execute()
+        mark_stale(self.redis, response_cache_key(self.bucket, self.base_prefix))
+        logger.info(f"Rebuilt comparison index for {self.bucket}/{self.base_prefix}: "
+                    f"{len(seen)} views in {time.perf_counter() - start:.1f}s.")
+        return len(seen)
+
+    def members(self):
+        return [m.decode('utf-8') for m in self.redis.zrange(self.members_key, 0, -1)]
+
+    def iter_members(self, min_score='-inf', max_score='+inf', descending=False):
+        """Yields (score, member) within a score range in index order (or reversed), in batches."""
+        offset = 0
+        while True:
+            if descending:
+                batch = self.redis.zrevrangebyscore(self.members_key, max_score, min_score,
+                                                    start=offset, num=PAGE_BATCH, withscores=True)
+            else:
+                batch = self.redis.zrangebyscore(self.members_key, min_score, max_score,
+                                                 start=offset, num=PAGE_BATCH, withscores=True)
+            for member, score in batch:
+                yield int(score), member.decode('utf-8')
+            if len(batch) < PAGE_BATCH:
+                return
+            offset += PAGE_BATCH
+
+    def views(self, members):
+        """[(member, wagons)] for the given members, in order, skipping any that vanished."""
+        if not members:
+            return []
+        raw = self.redis.hmget(self.views_key, members)
+        return [(member, json.loads(value)) for member, value in zip(members, raw) if value]
+
+
+def response_cache_key(bucket_name, base_prefix):
+    """Response cache key of the /comparisons body for this bucket and base prefix."""
+    return f"comparisons:{bucket_name}:{_base(base_prefix)}"
+
+
+def get_comparison_index(bucket_name, base_prefix):
+    """Returns the ComparisonIndex, or None if Redis is unavailable."""
+    client = get_redis()
+    return ComparisonIndex(client, bucket_name, base_prefix) if client else None
+
+
+def index_task_path(bucket_name, relative_path):
+    """Updates the index entry a comparison task wrote to. Never raises."""
+    parsed = parse_task_path(relative_path)
+    if not parsed:
+        logger.warning(f"Not indexing comparison results of unexpected path: {relative_path}")
+        return
+    base_prefix, date, user, view = parsed
+    try:
+        index = get_comparison_index(bucket_name, base_prefix)
+        if index:
+            count = index.update_view(date, user, view)
+            logger.info(f"Indexed {count} comparison results for {date}/{user}/{view}.")
+    except Exception as e:
+        logger.error(f"Failed to index comparison results of {relative_path}: {e}", exc_info=True)
+
+
+def rebuild_index(bucket_name, base_prefix):
+    index = get_comparison_index(bucket_name, base_prefix)
+    return index.rebuild() if index else 0
+
+
+def _ready_index(bucket_name, base_prefix):
+    """The index, built if it has never been; None without Redis."""
+    index = get_comparison_index(bucket_name, base_prefix)
+    if index is not None and not index.is_built():
+        # Concurrent first requests wait for one rebuild instead of each scanning S3.
+        single_flight(index.redis, index.built_key, index.rebuild, index.is_built)
+    return index
+
+
+def _scanned_views(bucket_name, base_prefix):
+    """{member: wagons} straight from S3, for when Redis is unavailable."""
+    return {member_name(date, user, view): wagons for date, user, view, wagons in scan_views(bucket_name, base_prefix)}
+
+
+def comparison_views(bucket_name, base_prefix):
+    """
+    [(member, wagons)] for every indexed view, oldest date first. Builds the
+    index on first use; without Redis, scans S3 directly.
+    """
+    index = _ready_index(bucket_name, base_prefix)
+    if index is None:
+        scanned = _scanned_views(bucket_name, base_prefix)
+        return [(member, scanned[member]) for member in sorted(scanned, key=lambda m: (date_score(m.split('|')[0]), m))]
+    return index.views(index.members())
+
+
+def encode_cursor(score, member):
+    return base64.urlsafe_b64encode(json.dumps([score, member]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Returns the (score, member) a cursor points after. Raises ValueError for malformed cursors."""
+    try:
+        score, member = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        split_member(member)
+        return int(score), member
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+
+def comparison_page(bucket_name, base_prefix, limit, cursor=None, date_from=None, date_to=None,
+                    users=None, views=None, descending=False):
+    """
+    One page of /comparisons: up to `limit` (date, user) entries in date order
+    (newest first when descending), optionally limited to a date range
+    (inclusive, YYYY-MM-DD), users and views. Only the page's views are read
+    from the index and only their images presigned.
+    Returns (entries, next_cursor); next_cursor is None on the last page.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    min_score = date_score(date_from) if date_from else '-inf'
+    max_score = date_score(date_to) if date_to else '+inf'
+    # Resume at the cursor's date instead of walking the index from the start.
+    if after and descending:
+        max_score = after[0] if max_score == '+inf' else min(max_score, after[0])
+    elif after:
+        min_score = after[0] if min_score == '-inf' else max(min_score, after[0])
+
+    index = _ready_index(bucket_name, base_prefix)
+    if index is None:
+        scanned = _scanned_views(bucket_name, base_prefix)
+        members = sorted(((date_score(m.split('|')[0]), m) for m in scanned), reverse=descending)
+        members = [(score, m) for score, m in members
+                   if (min_score == '-inf' or score >= min_score) and (max_score == '+inf' or score <= max_score)]
+    else:
+        members = index.iter_members(min_score, max_score, descending)
+
+    selected, groups, last_group, next_cursor = [], 0, None, None
+    for score, member in members:
+        if after and ((score, member) >= after if descending else (score, member) <= after):
+            continue
+        date, user, view = split_member(member)
+        if (users and user not in users) or (views and view not in views):
+            continue
+        # A (date, user) entry's views are adjacent in the index, so entries are never split across pages.
+        if (date, user) != last_group:
+            if groups == limit:
+                next_cursor = encode_cursor(*selected[-1])
+                break
+            groups += 1
+            last_group = (date, user)
+        selected.append((score, member))
+
+    page_members = [member for _, member in selected]
+    page_views = index.views(page_members) if index is not None else [(m, scanned[m]) for m in page_members]
+    return group_comparisons(bucket_name, page_views), next_cursor
+
+
+def group_comparisons(bucket_name, views):
+    """
+    Turns [(member, wagons)] into the /comparisons shape
+    [{'date', 'user', 'results': {view: [wagon, ...]}}], presigning image URLs.
+    """
+    entries = {}
+    pending = []
+    for member, wagons in views:
+        date, user, view = split_member(member)
+        entry = entries.setdefault((date, user), {'date': date, 'user': user, 'results': {}})
+        items = entry['results'].setdefault(view, [])
+        for wagon in wagons:
+            item = wagon['data']
+            pending.extend((item, field, key) for field, key in wagon['images'].items())
+            items.append(item)
+
+    signed = presign_urls(bucket_name, [key for _, _, key in pending], URL_EXPIRATION)
+    for item, field, key in pending:
+        item[field] = signed.get(key)
+    return list(entries.values())
@@ -15,6 +15,7 @@ from dotenv import load_dotenv
 import yaml
 # FIX: Correctly import the S3 utility functions
 from . import com_s3_utils
+from .metrics import timed
 import logging
 
 
@@ -118,36 +119,38 @@ def compute_centroid(bbox):
     x1, y1, x2, y2 = bbox
     return ((x1 + x2) / 2, (y1 + y2) / 2)
 
-def match_defects(entry_list, exit_list, entry_img, exit_img):
+def match_defects(entry_list, exit_list, entry_img, exit_img, timer=None):
     matched_exit = set()
     results = {"OLD": [], "NEW": [], "RESOLVED": []}
     # Extract descriptors
-    for e in entry_list:
-        e["desc"] = get_descriptor(entry_img, e["bbox"])
-        e["centroid"] = compute_centroid(e["bbox"])
-    for x in exit_list:
-        x["desc"] = get_descriptor(exit_img, x["bbox"])
-        x["centroid"] = compute_centroid(x["bbox"])
-    # Match entry to exit
-    for e in entry_list:
-        best_sim, best_idx = -1, -1
+    with timed(timer, "descriptor_extraction"):
+        for e in entry_list:
+            e["desc"] = get_descriptor(entry_img, e["bbox"])
+            e["centroid"] = compute_centroid(e["bbox"])
+        for x in exit_list:
+            x["desc"] = get_descriptor(exit_img, x["bbox"])
+            x["centroid"] = compute_centroid(x["bbox"])
+    with timed(timer, "matching"):
+        # Match entry to exit
+        for e in entry_list:
+            best_sim, best_idx = -1, -1
+            for i, x in enumerate(exit_list):
+                if i in matched_exit: continue
+                same_class = (e["label"] == x["label"])
+                desc_sim = F.cosine_similarity(e["desc"], x["desc"], dim=0).item()
+                dist = np.linalg.norm(np.array(e["centroid"]) - np.array(x["centroid"]))
+                if same_class and desc_sim > 0.3 and dist < 30:
+                    if desc_sim > best_sim:
+                        best_sim, best_idx = desc_sim, i
+            if best_idx >= 0:
+                results["OLD"].append(exit_list[best_idx])
+                matched_exit.add(best_idx)
+            else:
+                results["RESOLVED"].append(e)
+        # Remaining exit = NEW
         for i, x in enumerate(exit_list):
-            if i in matched_exit: continue
-            same_class = (e["label"] == x["label"])
-            desc_sim = F.cosine_similarity(e["desc"], x["desc"], dim=0).item()
-            dist = np.linalg.norm(np.array(e["centroid"]) - np.array(x["centroid"]))
-            if same_class and desc_sim > 0.3 and dist < 30:
-                if desc_sim > best_sim:
-                    best_sim, best_idx = desc_sim, i
-        if best_idx >= 0:
-            results["OLD"].append(exit_list[best_idx])
-            matched_exit.add(best_idx)
-        else:
-            results["RESOLVED"].append(e)
-    # Remaining exit = NEW
-    for i, x in enumerate(exit_list):
-        if i not in matched_exit:
-            results["NEW"].append(x)
+            if i not in matched_exit:
+                results["NEW"].append(x)
     return results
     
 def draw_defects(image, defects, label_map, color, tag):
@@ -167,18 +170,21 @@ def resize_to_same_height(img1, img2):
     img2_resized = cv2.resize(img2, (int(w2 * target_height / h2), target_height))
     return img1_resized, img2_resized
 
-def pipeline(entry_img: np.ndarray, exit_img: np.ndarray, wagon_model_path: str, defect_model_path: str):
+def pipeline(entry_img: np.ndarray, exit_img: np.ndarray, wagon_model_path: str, defect_model_path: str, timer=None):
     """
     Processes entry and exit images to detect, classify, and compare wagon defects,
     ignoring specified classes like 'gunny_bag' and 'wire'.
+    Pass a metrics.StageTimer as `timer` to record how long each stage takes.
     """
     # --- 1. Crop wagon from the full image ---
-    entry_crop = detect_and_crop_wagon(entry_img, wagon_model_path)
-    exit_crop = detect_and_crop_wagon(exit_img, wagon_model_path)
+    with timed(timer, "crop_detection"):
+        entry_crop = detect_and_crop_wagon(entry_img, wagon_model_path)
+        exit_crop = detect_and_crop_wagon(exit_img, wagon_model_path)
 
     # --- 2. Detect all defects in the cropped images ---
-    entry_defects_all = detect_defects(entry_crop, defect_model_path)
-    exit_defects_all = detect_defects(exit_crop, defect_model_path)
+    with timed(timer, "defect_detection"):
+        entry_defects_all = detect_defects(entry_crop, defect_model_path)
+        exit_defects_all = detect_defects(exit_crop, defect_model_path)
 
     # --- 3. Define class map and classes to ignore ---
     label_map = {0: 'Dent', 1: 'gunny_bag', 2: 'hole', 3: 'missing_door', 4: 'open_door', 5: 'scratch', 6: 'wire'}
@@ -192,23 +198,24 @@ def pipeline(entry_img: np.ndarray, exit_img: np.ndarray, wagon_model_path: str,
     exit_defects_filtered = [d for d in exit_defects_all if d["label"] not in labels_to_ignore]
 
     # --- 5. Match the filtered defects between entry and exit ---
-    classified = match_defects(entry_defects_filtered, exit_defects_filtered, entry_crop, exit_crop)
+    classified = match_defects(entry_defects_filtered, exit_defects_filtered, entry_crop, exit_crop, timer=timer)
 
-    # --- 6. Draw bounding boxes on the images for visualization ---
-    entry_copy = entry_crop.copy()
-    exit_copy = exit_crop.copy()
+    with timed(timer, "drawing"):
+        # --- 6. Draw bounding boxes on the images for visualization ---
+        entry_copy = entry_crop.copy()
+        exit_copy = exit_crop.copy()
 
-    # Draw resolved and old defects on the entry image
-    entry_copy = draw_defects(entry_copy, classified["RESOLVED"], label_map, (0, 0, 255), "RESOLVED")
-    entry_copy = draw_defects(entry_copy, classified["OLD"], label_map, (0, 255, 0), "OLD")
-    
-    # Draw old and new defects on the exit image
-    exit_copy = draw_defects(exit_copy, classified["OLD"], label_map, (0, 255, 0), "OLD")
-    exit_copy = draw_defects(exit_copy, classified["NEW"], label_map, (0, 0, 255), "NEW")
+        # Draw resolved and old defects on the entry image
+        entry_copy = draw_defects(entry_copy, classified["RESOLVED"], label_map, (0, 0, 255), "RESOLVED")
+        entry_copy = draw_defects(entry_copy, classified["OLD"], label_map, (0, 255, 0), "OLD")
+        
+        # Draw old and new defects on the exit image
+        exit_copy = draw_defects(exit_copy, classified["OLD"], label_map, (0, 255, 0), "OLD")
+        exit_copy = draw_defects(exit_copy, classified["NEW"], label_map, (0, 0, 255), "NEW")
 
-    # --- 7. Combine images and prepare JSON output ---
-    entry_resized, exit_resized = resize_to_same_height(entry_copy, exit_copy)
-    combined_image = np.hstack((entry_resized, exit_resized))
+        # --- 7. Combine images and prepare JSON output ---
+        entry_resized, exit_resized = resize_to_same_height(entry_copy, exit_copy)
+        combined_image = np.hstack((entry_resized, exit_resized))
 
     # Create JSON output, ensuring not to include descriptor and centroid data
     json_data = {
@@ -267,10 +274,9 @@ def get_total_damage_counts(s3_base_path, bucket_name):
     try:
         # Get Top View Counts
         top_details_dir = f"{s3_base_path}/top/exit/"
-        top_json_files = com_s3_utils.list_s3_objects(bucket_name, top_details_dir, extension=".json")
+        top_json_files = com_s3_utils.list_s3_objects(bucket_name, top_details_dir, extension=".json", use_catalog=True)
         top_damages = 0
-        for file_key in top_json_files:
-            wagon_json = com_s3_utils.read_s3_json(bucket_name, file_key)
+        for wagon_json in com_s3_utils.read_folder_jsons(bucket_name, top_details_dir, top_json_files):
             if wagon_json:
                 top_damages += wagon_json.get('cracks', 0) + wagon_json.get('gravel', 0) + wagon_json.get('hole', 0)
         
@@ -289,49 +295,68 @@ def get_total_damage_counts(s3_base_path, bucket_name):
         return {"success": False, "error": str(e)}
 
 
+def _wagon_number(s3_key):
+    """Numeric suffix of a result file name (.../wagon_12.json -> 12), or None."""
+    try:
+        return int(os.path.splitext(os.path.basename(s3_key))[0].split('_')[-1])
+    except ValueError:
+        return None
+
+
+def _collect_top_view_details(bucket_name, top_details_dir, top_json_files, existing_keys):
+    """Builds the per-wagon top view details from the given result JSONs, keyed by wagon id."""
+    all_wagons_data = {}
+
+    wagon_jsons = com_s3_utils.read_folder_jsons(bucket_name, top_details_dir, top_json_files)
+
+    for file_key, wagon_json in zip(top_json_files, wagon_jsons):
+        if not (wagon_json and 'image_name' in wagon_json): continue
+        
+        try:
+            wagon_id = os.path.splitext(wagon_json['image_name'])[0].split('_')[-1]
+            
+            if wagon_id not in all_wagons_data:
+                all_wagons_data[wagon_id] = {
+                    "wagon_id": wagon_id,
+                    "left_view_details": [], # Mocked for this fix
+                    "right_view_details": [], # Mocked for this fix
+                    "top_view_details": []
+                }
+            
+            image_path = f"{top_details_dir}{wagon_json['image_name']}"
+            image_url = com_s3_utils.get_s3_public_url(bucket_name, image_path, existing_keys=existing_keys)
+
+            cracks = wagon_json.get('cracks', 0)
+            gravel = wagon_json.get('gravel', 0)
+            hole = wagon_json.get('hole', 0)
+            total_damages = cracks + gravel + hole
+
+            if total_damages > 0:
+                if cracks > 0: all_wagons_data[wagon_id]['top_view_details'].append({"type": "Cracks", "count": cracks, "image": image_url})
+                if gravel > 0: all_wagons_data[wagon_id]['top_view_details'].append({"type": "Gravel", "count": gravel, "image": image_url})
+                if hole > 0: all_wagons_data[wagon_id]['top_view_details'].append({"type": "Holes", "count": hole, "image": image_url})
+            else:
+                all_wagons_data[wagon_id]['top_view_details'].append({"status": "No damages detected", "image": image_url})
+
+        except (IndexError, KeyError) as e:
+            print(f"Skipping file due to parsing error: {file_key}, Error: {e}")
+            continue
+
+    return all_wagons_data
+
+
 def get_comparison_details(s3_base_path, bucket_name):
     """
     Gathers detailed comparison data for each wagon, with special handling for the top view.
     """
     try:
         top_details_dir = f"{s3_base_path}/top/exit/"
-        top_json_files = com_s3_utils.list_s3_objects(bucket_name, top_details_dir, extension=".json")
-        all_wagons_data = {}
+        # One listing gives both the JSON files and the set of images that exist,
+        # so image URLs can be presigned without a HEAD request per wagon.
+        existing_keys = set(com_s3_utils.list_s3_objects(bucket_name, top_details_dir, use_catalog=True))
+        top_json_files = sorted(key for key in existing_keys if key.endswith(".json"))
 
-        for file_key in top_json_files:
-            wagon_json = com_s3_utils.read_s3_json(bucket_name, file_key)
-            if not (wagon_json and 'image_name' in wagon_json): continue
-            
-            try:
-                wagon_id = os.path.splitext(wagon_json['image_name'])[0].split('_')[-1]
-                
-                if wagon_id not in all_wagons_data:
-                    all_wagons_data[wagon_id] = {
-                        "wagon_id": wagon_id,
-                        "left_view_details": [], # Mocked for this fix
-                        "right_view_details": [], # Mocked for this fix
-                        "top_view_details": []
-                    }
-                
-                image_path = f"{top_details_dir}{wagon_json['image_name']}"
-                image_url = com_s3_utils.get_s3_public_url(bucket_name, image_path)
-
-                cracks = wagon_json.get('cracks', 0)
-                gravel = wagon_json.get('gravel', 0)
-                hole = wagon_json.get('hole', 0)
-                total_damages = cracks + gravel + hole
-
-                if total_damages > 0:
-                    if cracks > 0: all_wagons_data[wagon_id]['top_view_details'].append({"type": "Cracks", "count": cracks, "image": image_url})
-                    if gravel > 0: all_wagons_data[wagon_id]['top_view_details'].append({"type": "Gravel", "count": gravel, "image": image_url})
-                    if hole > 0: all_wagons_data[wagon_id]['top_view_details'].append({"type": "Holes", "count": hole, "image": image_url})
-                else:
-                    all_wagons_data[wagon_id]['top_view_details'].append({"status": "No damages detected", "image": image_url})
-
-            except (IndexError, KeyError) as e:
-                print(f"Skipping file due to parsing error: {file_key}, Error: {e}")
-                continue
-        
+        all_wagons_data = _collect_top_view_details(bucket_name, top_details_dir, top_json_files, existing_keys)
         sorted_details = sorted(all_wagons_data.values(), key=lambda x: int(x['wagon_id']))
 
         return {"success": True, "details": sorted_details}
@@ -339,3 +364,34 @@ def get_comparison_details(s3_base_path, bucket_name):
     except Exception as e:
         print(f"Error in get_comparison_details: {e}")
         return {"success": False, "error": str(e)}
+
+
+def get_comparison_details_page(s3_base_path, bucket_name, limit, cursor=None):
+    """
+    One page of get_comparison_details, in wagon number order. `cursor` is the
+    'next_cursor' of the previous page ('next_cursor' is None on the last page).
+    Wagons are paged by the number in their result file name, so only the
+    page's JSONs are read and only its images presigned.
+    """
+    try:
+        after = int(cursor) if cursor else None
+    except ValueError:
+        return {"success": False, "error": "Invalid cursor."}
+    try:
+        top_details_dir = f"{s3_base_path}/top/exit/"
+        existing_keys = set(com_s3_utils.list_s3_objects(bucket_name, top_details_dir, use_catalog=True))
+        numbered = sorted(
+            (number, key) for key in existing_keys if key.endswith(".json")
+            for number in [_wagon_number(key)] if number is not None and (after is None or number > after)
+        )
+        page = numbered[:limit]
+
+        all_wagons_data = _collect_top_view_details(bucket_name, top_details_dir, [key for _, key in page], existing_keys)
+        sorted_details = sorted(all_wagons_data.values(), key=lambda x: int(x['wagon_id']))
+        next_cursor = str(page[-1][0]) if len(numbered) > limit else None
+
+        return {"success": True, "details": sorted_details, "next_cursor": next_cursor}
+
+    except Exception as e:
+        print(f"Error in get_comparison_details_page: {e}")
+        return {"success": False, "error": str(e)}
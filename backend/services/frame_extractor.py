@@ -3,7 +3,10 @@ import os
 import collections
 import logging
 from ultralytics import YOLO
-from .s3_utils import download_file_from_s3, upload_bytes_to_s3, generate_presigned_url
+from .s3_utils import download_file_from_s3, upload_bytes_to_s3
+from .s3_client import client_manager
+from .presigner import presign_urls
+from .video_dedup import hash_file, get_content_hash, record_content_hash, find_extraction, record_extraction, frame_keys, copy_frames
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -15,14 +18,24 @@ class FrameExtractor:
         """
         if os.path.exists(model_path):
             self.model = YOLO(model_path)
+            # Extractions are only reused when they came from the same weights.
+            self.model_version = f"{os.path.basename(model_path)}:{hash_file(model_path)[:16]}"
         else:
             self.model = None
+            self.model_version = None
             logger.error(f"YOLO model not found at path: {model_path}")
 
     def extract_frames_from_video_s3(self, s3_key, bucket_name, output_prefix, frame_interval=10, task=None):
         if not self.model:
             return {'success': False, 'error': 'YOLO model not loaded.'}
 
+        # A re-upload of a video we already processed reuses its frames.
+        content_hash = get_content_hash(bucket_name, s3_key)
+        if content_hash:
+            reused = self._reuse_extraction(bucket_name, content_hash, output_prefix)
+            if reused:
+                return reused
+
         # Create a temporary directory to store the downloaded video
         temp_dir = 'temp_downloads'
         os.makedirs(temp_dir, exist_ok=True)
@@ -32,11 +45,24 @@ class FrameExtractor:
         if not download_file_from_s3(bucket_name, s3_key, local_video_path):
             return {'success': False, 'error': f'Failed to download video from S3: {s3_key}'}
 
-        # Process the video to extract frames, passing the task object for progress updates
-        saved_frame_count, saved_frames = self.extract_wagon_frames(local_video_path, self.model, task=task)
+        try:
+            if not content_hash:
+                # Uploaded by a path that does not hash (e.g. presigned uploads): hash it now.
+                content_hash = hash_file(local_video_path)
+                record_content_hash(bucket_name, s3_key, content_hash, self._etag_of(bucket_name, s3_key))
+                reused = self._reuse_extraction(bucket_name, content_hash, output_prefix)
+                if reused:
+                    return reused
+
+            # Process the video to extract frames, passing the task object for progress updates
+            saved_frame_count, saved_frames = self.extract_wagon_frames(local_video_path, self.model, task=task)
+        finally:
+            # Clean up the local video file
+            if os.path.exists(local_video_path):
+                os.remove(local_video_path)
 
         # Upload frames to S3
-        frame_urls = []
+        uploaded_keys = []
         if saved_frame_count > 0:
             for i, frame_img in enumerate(saved_frames):
                 frame_filename = f"frame_{i+1}.jpg"
@@ -49,17 +75,51 @@ class FrameExtractor:
                 # Upload to S3
                 success, message = upload_bytes_to_s3(image_bytes, bucket_name, frame_s3_key)
                 if success:
-                    # Generate a presigned URL for the uploaded frame
-                    presigned_url = generate_presigned_url(bucket_name, frame_s3_key)
-                    if presigned_url:
-                        frame_urls.append(presigned_url)
+                    uploaded_keys.append(frame_s3_key)
                 else:
                     logger.error(f"Failed to upload frame {frame_s3_key}: {message}")
 
-        # Clean up the local video file
-        if os.path.exists(local_video_path):
-            os.remove(local_video_path)
+        # Only a complete set of frames can stand in for a later duplicate.
+        if len(uploaded_keys) == saved_frame_count:
+            record_extraction(bucket_name, content_hash, self.model_version, output_prefix, saved_frame_count)
+
+        return self._frames_result(bucket_name, uploaded_keys)
 
+    def _reuse_extraction(self, bucket_name, content_hash, output_prefix):
+        """
+        Serves an extraction of identical video content from its earlier frames:
+        as-is when it wrote to the same prefix, otherwise by a server-side copy.
+        Returns None when there is nothing to reuse.
+        """
+        previous = find_extraction(bucket_name, content_hash, self.model_version)
+        if not previous:
+            return None
+        count = previous['count']
+        if previous['output_prefix'] == output_prefix:
+            keys = frame_keys(output_prefix, count)
+        else:
+            keys = copy_frames(bucket_name, previous['output_prefix'], output_prefix, count)
+            if keys is None:
+                return None
+            record_extraction(bucket_name, content_hash, self.model_version, output_prefix, count)
+        logger.info(f"Reused {count} frames of identical video content from {previous['output_prefix']}.")
+        result = self._frames_result(bucket_name, keys)
+        result['reused_from'] = previous['output_prefix']
+        return result
+
+    @staticmethod
+    def _etag_of(bucket_name, s3_key):
+        try:
+            return client_manager.get_client().head_object(Bucket=bucket_name, Key=s3_key)['ETag']
+        except Exception as e:
+            logger.warning(f"Could not read the ETag of s3://{bucket_name}/{s3_key}: {e}")
+            return None
+
+    @staticmethod
+    def _frames_result(bucket_name, keys):
+        # Presign all frames in one batch
+        signed = presign_urls(bucket_name, keys)
+        frame_urls = [signed[key] for key in keys if key in signed]
         return {'success': True, 'frame_urls': frame_urls, 'count': len(frame_urls)}
 
     def extract_wagon_frames(self, video_path, model, task=None):
@@ -0,0 +1,118 @@
+"""
+Lightweight timing instrumentation for the comparison pipeline.
+
+A StageTimer aggregates wall-clock time per named stage for one task, and every
+measurement is also observed into a Prometheus histogram that the Celery worker
+exposes over HTTP (see start_metrics_server). The S3 scheduler's gauges and
+counters are defined here as well.
+"""
+import os
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+
+# The multiprocess collector needs its directory to exist before any metric is created.
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+from prometheus_client import Histogram, Gauge, Counter, CollectorRegistry, start_http_server, multiprocess
+
+logger = logging.getLogger(__name__)
+
+# Stage durations range from a few ms (matching) to seconds (YOLO on CPU, uploads).
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PIPELINE_STAGE_SECONDS = Histogram(
+    'comparison_pipeline_stage_seconds',
+    'Time spent in each stage of the comparison pipeline.',
+    ['stage'],
+    buckets=STAGE_BUCKETS
+)
+
+# Adaptive S3 concurrency limits (see services.s3_scheduler); limits are per process.
+S3_PREFIX_LIMIT = Gauge(
+    's3_scheduler_concurrency_limit',
+    'Current concurrency limit for S3 requests under a prefix.',
+    ['prefix'],
+    multiprocess_mode='liveall'
+)
+S3_PREFIX_IN_FLIGHT = Gauge(
+    's3_scheduler_in_flight_requests',
+    'S3 requests currently in flight under a prefix.',
+    ['prefix'],
+    multiprocess_mode='livesum'
+)
+S3_THROTTLED_TOTAL = Counter(
+    's3_scheduler_throttled_total',
+    'Throttling responses (SlowDown / 503) received per prefix.',
+    ['prefix']
+)
+S3_RETRIES_TOTAL = Counter(
+    's3_scheduler_retries_total',
+    'Retries botocore made before an S3 call returned, per operation.',
+    ['operation']
+)
+
+
+class StageTimer:
+    """Accumulates per-stage durations for a single task."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        totals = self.stages.setdefault(name, {'count': 0, 'total_s': 0.0, 'max_s': 0.0})
+        totals['count'] += 1
+        totals['total_s'] += seconds
+        totals['max_s'] = max(totals['max_s'], seconds)
+        PIPELINE_STAGE_SECONDS.labels(stage=name).observe(seconds)
+
+    def summary(self):
+        """Returns a JSON-serialisable summary suitable for task result meta."""
+        return {
+            name: {
+                'count': totals['count'],
+                'total_ms': round(totals['total_s'] * 1000, 2),
+                'mean_ms': round(totals['total_s'] * 1000 / totals['count'], 2),
+                'max_ms': round(totals['max_s'] * 1000, 2)
+            }
+            for name, totals in self.stages.items()
+        }
+
+
+def timed(timer, name):
+    """Context manager that times a stage when a timer is given, and is a no-op otherwise."""
+    return timer.stage(name) if timer else nullcontext()
+
+
+def start_metrics_server(port=None):
+    """
+    Starts the Prometheus HTTP endpoint for this process.
+    With a prefork pool, set PROMETHEUS_MULTIPROC_DIR so the child processes'
+    observations are collected from the shared directory.
+    """
+    port = int(port or os.environ.get('WORKER_METRICS_PORT', 9100))
+    try:
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            start_http_server(port, registry=registry)
+        else:
+            start_http_server(port)
+        logger.info(f"Prometheus metrics exposed on port {port}.")
+    except OSError as e:
+        logger.error(f"Could not start metrics server on port {port}: {e}")
+
+
+def mark_process_dead(pid):
+    """Cleans up a dead worker child's multiprocess metric files."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,290 @@
+"""
+Streaming S3 multipart uploads.
+
+StreamingMultipartUpload turns a sequence of writes into an S3 multipart
+upload: data is cut into fixed-size parts that are uploaded in parallel on
+the shared S3 client, each part retried on its own. At most `concurrency`
+parts are in flight and one more is being filled, so memory stays around
+(concurrency + 1) * part_size regardless of the object size.
+
+stream_form_upload() feeds a multipart/form-data request body straight into
+such an upload, without Werkzeug spooling the file to memory or disk first.
+
+The presigned helpers at the bottom let the browser upload the parts straight
+to S3 instead; the API only starts, signs, completes or aborts the upload.
+The bucket's CORS configuration must allow PUT and expose the ETag header.
+
+Tuning is read from the environment:
+    S3_UPLOAD_PART_SIZE_MB     part size in MiB, at least 5 (default 16)
+    S3_UPLOAD_CONCURRENCY      parts uploaded in parallel (default 4)
+    S3_UPLOAD_PART_ATTEMPTS    attempts per part on top of botocore's retries (default 3)
+    S3_PART_URL_EXPIRATION     lifetime of presigned part URLs in seconds (default 3600)
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+from .s3_client import client_manager
+from .s3_catalog import record_upload
+from .video_dedup import record_content_hash
+
+logger = logging.getLogger(__name__)
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+PART_SIZE = max(int(os.getenv('S3_UPLOAD_PART_SIZE_MB', 16)) * 1024 * 1024, MIN_PART_SIZE)
+CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', 4))
+PART_ATTEMPTS = int(os.getenv('S3_UPLOAD_PART_ATTEMPTS', 3))
+# Size of the reads from the request body.
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class StreamingMultipartUpload:
+    """Writes a single S3 object as a multipart upload, part by part, as data arrives."""
+
+    def __init__(self, bucket_name, s3_key, content_type=None, part_size=None, concurrency=None):
+        self.bucket = bucket_name
+        self.key = s3_key
+        self.part_size = max(part_size or PART_SIZE, MIN_PART_SIZE)
+        self.concurrency = concurrency or CONCURRENCY
+        self.size = 0
+        # Content hash for deduplication, computed as the bytes go by.
+        self._sha256 = hashlib.sha256()
+        self._client = client_manager.get_client()
+        kwargs = {'Bucket': bucket_name, 'Key': s3_key}
+        if content_type:
+            kwargs['ContentType'] = content_type
+        self.upload_id = self._client.create_multipart_upload(**kwargs)['UploadId']
+        self._buffer = bytearray()
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='s3-part')
+        self._context = contextvars.copy_context()
+        self._closed = False
+
+    def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        self._sha256.update(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(part)
+
+    def _submit(self, body):
+        # Fail fast instead of receiving the rest of the body after a part gave up.
+        for future in self._futures:
+            if future.done() and future.exception():
+                raise future.exception()
+        # Blocks the writer while `concurrency` parts are already in flight.
+        self._slots.acquire()
+        part_number = len(self._futures) + 1
+        context = self._context.copy()
+        future = self._executor.submit(context.run, self._upload_part, part_number, body)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _upload_part(self, part_number, body):
+        for attempt in range(1, PART_ATTEMPTS + 1):
+            try:
+                response = self._client.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    PartNumber=part_number, Body=body
+                )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            except Exception as e:
+                if attempt == PART_ATTEMPTS:
+                    raise
+                logger.warning(f"Part {part_number} of s3://{self.bucket}/{self.key} failed (attempt {attempt}): {e}")
+                time.sleep(2 ** attempt)
+
+    def complete(self):
+        """Uploads the last part, waits for all parts and completes the upload. Returns the ETag."""
+        try:
+            if self._buffer or not self._futures:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            parts = [future.result() for future in self._futures]
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._executor.shutdown(wait=True)
+        try:
+            response = self._client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            self.abort()
+            raise
+        self._closed = True
+        record_upload(self.bucket, self.key, self.size, response.get('ETag'))
+        record_content_hash(self.bucket, self.key, self.sha256, response.get('ETag'))
+        logger.info(f"Completed multipart upload of s3://{self.bucket}/{self.key}: {len(parts)} parts, {self.size} bytes.")
+        return response.get('ETag')
+
+    @property
+    def sha256(self):
+        """Hex SHA-256 of everything written so far."""
+        return self._sha256.hexdigest()
+
+    def abort(self):
+        """Cancels the upload so S3 does not keep (and bill for) the uploaded parts."""
+        if self._closed:
+            return
+        self._closed = True
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        try:
+            self._client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            logger.error(f"Failed to abort multipart upload {self.upload_id} for s3://{self.bucket}/{self.key}: {e}")
+
+
+def stream_form_upload(stream, boundary, bucket_name, file_field, resolve_key):
+    """
+    Parses a multipart/form-data body from `stream` and uploads the part named
+    `file_field` to S3 while it is being received.
+
+    Form fields must come before the file part: when the file starts,
+    resolve_key(fields, filename) is called with the fields read so far and
+    returns the S3 key to write (or raises ValueError to reject the request).
+    Any other file part is rejected.
+    Returns (fields, s3_key, size). Raises ValueError for malformed requests;
+    a partially uploaded object is aborted on any error.
+    """
+    decoder = MultipartDecoder(boundary.encode('utf-8') if isinstance(boundary, str) else boundary)
+    fields = {}
+    field_name, field_value = None, []
+    upload, s3_key = None, None
+    done = False
+
+    try:
+        while not done:
+            chunk = stream.read(READ_CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, NeedData):
+                if isinstance(event, Epilogue):
+                    done = True
+                    break
+                if isinstance(event, Field):
+                    field_name, field_value = event.name, []
+                elif isinstance(event, File):
+                    # Other files would have to be buffered whole, so they are refused.
+                    if event.name != file_field:
+                        raise ValueError(f"Unexpected file '{event.name}'; only '{file_field}' is accepted.")
+                    if upload:
+                        raise ValueError(f"Only one '{file_field}' file is accepted per request.")
+                    field_name, field_value = event.name, []
+                    s3_key = resolve_key(fields, event.filename)
+                    upload = StreamingMultipartUpload(bucket_name, s3_key, event.headers.get('Content-Type'))
+                elif isinstance(event, Data):
+                    if upload and field_name == file_field:
+                        upload.write(event.data)
+                    else:
+                        field_value.append(event.data)
+                        if not event.more_data:
+                            try:
+                                fields[field_name] = b''.join(field_value).decode('utf-8')
+                            except UnicodeDecodeError:
+                                raise ValueError(f"Form field '{field_name}' is not valid UTF-8.")
+                event = decoder.next_event()
+            if not chunk and not done:
+                raise ValueError("Request body ended before the multipart form was complete.")
+
+        if not upload:
+            raise ValueError(f"No '{file_field}' file found in request.")
+        upload.complete()
+        return fields, s3_key, upload.size
+    except Exception:
+        if upload:
+            upload.abort()
+        raise
+
+
+# --- Presigned multipart uploads (the browser sends the parts straight to S3) ---
+
+# S3 allows at most 10,000 parts per upload.
+MAX_PARTS = 10000
+PART_URL_EXPIRATION = int(os.getenv('S3_PART_URL_EXPIRATION', 3600))
+
+
+def part_size_for(total_size):
+    """Smallest part size >= PART_SIZE (whole MiB) that keeps the upload within MAX_PARTS."""
+    if not total_size:
+        return PART_SIZE
+    needed = -(-total_size // MAX_PARTS)
+    mib = 1024 * 1024
+    return max(PART_SIZE, -(-needed // mib) * mib)
+
+
+def start_presigned_upload(bucket_name, s3_key, content_type=None, total_size=None):
+    """Creates a multipart upload. Returns {'upload_id', 's3_key', 'part_size', 'part_count'}."""
+    kwargs = {'Bucket': bucket_name, 'Key': s3_key}
+    if content_type:
+        kwargs['ContentType'] = content_type
+    upload_id = client_manager.get_client().create_multipart_upload(**kwargs)['UploadId']
+    part_size = part_size_for(total_size)
+    return {
+        'upload_id': upload_id,
+        's3_key': s3_key,
+        'part_size': part_size,
+        'part_count': -(-total_size // part_size) if total_size else None
+    }
+
+
+def presign_part_urls(bucket_name, s3_key, upload_id, part_numbers, expiration=None):
+    """Returns {part_number: presigned PUT URL}. Raises ValueError for out-of-range part numbers."""
+    client = client_manager.get_client()
+    urls = {}
+    for part_number in part_numbers:
+        part_number = int(part_number)
+        if not 1 <= part_number <= MAX_PARTS:
+            raise ValueError(f"Part number {part_number} is out of range.")
+        urls[part_number] = client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': bucket_name, 'Key': s3_key, 'UploadId': upload_id, 'PartNumber': part_number},
+            ExpiresIn=expiration or PART_URL_EXPIRATION
+        )
+    return urls
+
+
+def complete_presigned_upload(bucket_name, s3_key, upload_id, parts=None):
+    """
+    Completes a multipart upload. `parts` is the client's list of
+    {'PartNumber', 'ETag'}; when omitted, or when any ETag is missing (the
+    bucket's CORS configuration does not expose the header), the parts S3 has
+    received are used. Returns the size of the assembled object.
+    """
+    client = client_manager.get_client()
+    if parts and all(isinstance(p, dict) and p.get('ETag') for p in parts):
+        try:
+            parts = sorted(({'PartNumber': int(p['PartNumber']), 'ETag': p['ETag']} for p in parts), key=lambda p: p['PartNumber'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Each part needs an integer PartNumber and an ETag.")
+    else:
+        paginator = client.get_paginator('list_parts')
+        parts = [{'PartNumber': p['PartNumber'], 'ETag': p['ETag']}
+                 for page in paginator.paginate(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+                 for p in page.get('Parts', [])]
+    if not parts:
+        raise ValueError("No parts have been uploaded.")
+    response = client.complete_multipart_upload(
+        Bucket=bucket_name, Key=s3_key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+    )
+    size = client.head_object(Bucket=bucket_name, Key=s3_key)['ContentLength']
+    record_upload(bucket_name, s3_key, size, response.get('ETag'))
+    logger.info(f"Completed presigned multipart upload of s3://{bucket_name}/{s3_key}: {len(parts)} parts, {size} bytes.")
+    return size
+
+
+def abort_presigned_upload(bucket_name, s3_key, upload_id):
+    client_manager.get_client().abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
@@ -0,0 +1,119 @@
+"""
+Batch presigned-URL service with expiry-aware caching.
+
+Presigning is a purely local operation (no network call), but botocore still
+costs a few hundred microseconds per key. Dashboard endpoints presign hundreds
+of the same image keys on every load, so signed URLs are cached per process
+and reused until shortly before they expire.
+
+A URL stops working when the credentials that signed it do, which with
+temporary credentials (instance role, STS) can be well before its own
+expiry. Entries are therefore keyed by the signing access key, so rotated
+credentials never reuse old URLs, and their expiry is capped at the
+credentials' expiry when it is known.
+
+Tuning is read from the environment:
+    PRESIGN_CACHE_MAX_ENTRIES  maximum cached URLs (default 50000)
+    PRESIGN_MIN_REMAINING      seconds of validity a cached URL must still have
+                               when handed out (default 600)
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from .s3_client import client_manager
+
+logger = logging.getLogger(__name__)
+
+
+def signing_identity():
+    """(access key, expiry epoch seconds or None) of the credentials the shared client signs with."""
+    credentials = client_manager.get_credentials()
+    if credentials is None:
+        return None, None
+    # Refreshes temporary credentials that are about to expire.
+    access_key = credentials.get_frozen_credentials().access_key
+    # Only botocore's RefreshableCredentials carry an expiry.
+    expiry = getattr(credentials, '_expiry_time', None)
+    return access_key, (expiry.timestamp() if expiry else None)
+
+
+class PresignedUrlCache:
+    """Thread-safe LRU of presigned GET URLs keyed by (bucket, key, expiration, signing access key)."""
+
+    def __init__(self, max_entries=None, min_remaining=None):
+        self.max_entries = int(max_entries or os.getenv('PRESIGN_CACHE_MAX_ENTRIES', 50000))
+        self.min_remaining = int(min_remaining or os.getenv('PRESIGN_MIN_REMAINING', 600))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, bucket_name, keys, expiration=3600):
+        """
+        Returns {key: url} for every key, signing only the keys that are not
+        cached or whose cached URL is too close to expiry.
+        """
+        now = time.time()
+        access_key, credentials_expiry = signing_identity()
+        # Short-lived URLs are still worth caching for half their lifetime.
+        min_remaining = min(self.min_remaining, expiration // 2)
+        urls, to_sign = {}, []
+        with self._lock:
+            for key in keys:
+                cache_key = (bucket_name, key, expiration, access_key)
+                entry = self._entries.get(cache_key)
+                if entry and entry[1] - now > min_remaining:
+                    self._entries.move_to_end(cache_key)
+                    urls[key] = entry[0]
+                    self.hits += 1
+                else:
+                    to_sign.append(key)
+            self.misses += len(to_sign)
+
+        if not to_sign:
+            return urls
+
+        client = client_manager.get_client()
+        signed = {}
+        for key in dict.fromkeys(to_sign):
+            signed[key] = client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': bucket_name, 'Key': key},
+                ExpiresIn=expiration
+            )
+        expires_at = now + expiration
+        if credentials_expiry:
+            expires_at = min(expires_at, credentials_expiry)
+        with self._lock:
+            for key, url in signed.items():
+                cache_key = (bucket_name, key, expiration, access_key)
+                self._entries[cache_key] = (url, expires_at)
+                self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        urls.update(signed)
+        return urls
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+url_cache = PresignedUrlCache()
+
+
+def presign_urls(bucket_name, keys, expiration=3600):
+    """Presigns many keys in one call. Returns {key: url}; keys that fail are omitted."""
+    try:
+        return url_cache.get_many(bucket_name, [key for key in keys if key], expiration)
+    except Exception as e:
+        logger.error(f"Failed to generate presigned URLs in s3://{bucket_name}: {e}")
+        return {}
+
+
+def presign_url(bucket_name, s3_key, expiration=3600):
+    """Presigns a single key through the cache. Returns None on failure."""
+    return presign_urls(bucket_name, [s3_key], expiration).get(s3_key)
@@ -0,0 +1,327 @@
+"""
+Two-tier cache for expensive API payloads, with single-flight recomputation
+and stale-while-revalidate.
+
+Payloads are cached as their serialized JSON response body, so a hit is
+handed to Flask as bytes without being decoded and re-encoded. Every body
+carries an ETag (a digest computed once, when it is stored) for conditional
+requests:
+
+  * tier 1: a small in-process LRU (LOCAL_CACHE_SECONDS, LOCAL_CACHE_MAX_BYTES)
+    that answers repeated requests without a Redis round trip;
+  * tier 2: Redis, where each value is a short header (format marker, the
+    fresh-until time and the body digest) followed by the zlib-compressed
+    body. Values are kept for CACHE_TTL_SECONDS + CACHE_STALE_SECONDS.
+
+Reads then go:
+
+  * fresh value   -> served as is;
+  * stale value   -> served as is, while one background thread recomputes it;
+  * no value      -> one caller computes it under a per-key Redis lock, the
+                     others poll Redis for the result instead of repeating
+                     the same S3 scan.
+
+The lock expires after CACHE_LOCK_SECONDS so a crashed process cannot block a
+key forever; waiters give up after CACHE_WAIT_SECONDS and compute themselves.
+Values written in the older JSON format are still read (a bare JSON payload
+counts as fresh).
+"""
+import os
+import json
+import time
+import uuid
+import zlib
+import struct
+import logging
+import threading
+import hashlib
+import contextvars
+from collections import OrderedDict, namedtuple
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = int(os.getenv('CACHE_TTL_SECONDS', 3600))
+CACHE_STALE = int(os.getenv('CACHE_STALE_SECONDS', 86400))
+LOCK_SECONDS = int(os.getenv('CACHE_LOCK_SECONDS', 300))
+WAIT_SECONDS = float(os.getenv('CACHE_WAIT_SECONDS', 60))
+LOCAL_CACHE_SECONDS = float(os.getenv('LOCAL_CACHE_SECONDS', 5))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv('LOCAL_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+POLL_INTERVAL = 0.1
+
+# Redis value: marker, fresh-until epoch seconds (big-endian double), body digest, zlib(body).
+_MAGIC = b'\x00rc2'
+_HEADER = struct.Struct('>d16s')
+# Values written before the digest was added: marker, fresh-until, zlib(body).
+_MAGIC_V1 = b'\x00rc1'
+_HEADER_V1 = struct.Struct('>d')
+
+# What get_or_compute returns: the JSON body, its ETag, and the payload when it was computed by this call.
+CachedBody = namedtuple('CachedBody', ['body', 'etag', 'payload'])
+
+# Deletes the lock only if this caller still holds it.
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def serialize(payload):
+    """Compact JSON body for a payload, as served to clients."""
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def _digest(body):
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+def etag_for(digest):
+    return digest.hex()
+
+
+class LocalCache:
+    """Thread-safe per-process LRU of response bodies, bounded in total bytes."""
+
+    def __init__(self, max_bytes=None, ttl=None):
+        self.max_bytes = LOCAL_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttl = LOCAL_CACHE_SECONDS if ttl is None else ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (body, digest, fresh_until), or None when absent or older than the local TTL."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            body, digest, fresh_until, expires = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return body, digest, fresh_until
+
+    def put(self, key, body, digest, fresh_until):
+        if self.ttl <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (body, digest, fresh_until, time.monotonic() + self.ttl)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def drop(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._size -= len(entry[0])
+
+
+local_cache = LocalCache()
+
+
+def _lock_key(key):
+    return f"lock:{key}"
+
+
+def _encode(body, digest, fresh_until):
+    return _MAGIC + _HEADER.pack(fresh_until, digest) + zlib.compress(body, 6)
+
+
+def store_body(redis_client, key, body, ttl=None, stale=None):
+    """
+    Caches a serialized body as fresh for `ttl` seconds, then stale for `stale`
+    seconds. Returns its ETag.
+    """
+    ttl = ttl or CACHE_TTL
+    stale = CACHE_STALE if stale is None else stale
+    fresh_until = time.time() + ttl
+    digest = _digest(body)
+    redis_client.set(key, _encode(body, digest, fresh_until), ex=int(ttl + stale))
+    local_cache.put(key, body, digest, fresh_until)
+    return etag_for(digest)
+
+
+def store(redis_client, key, payload, ttl=None, stale=None):
+    """Caches a payload (see store_body)."""
+    store_body(redis_client, key, serialize(payload), ttl, stale)
+
+
+def _decode(raw):
+    """Returns (body, digest, fresh_until) of a stored value."""
+    if raw.startswith(_MAGIC):
+        header_end = len(_MAGIC) + _HEADER.size
+        fresh_until, digest = _HEADER.unpack(raw[len(_MAGIC):header_end])
+        return zlib.decompress(raw[header_end:]), digest, fresh_until
+    if raw.startswith(_MAGIC_V1):
+        header_end = len(_MAGIC_V1) + _HEADER_V1.size
+        (fresh_until,) = _HEADER_V1.unpack(raw[len(_MAGIC_V1):header_end])
+        body = zlib.decompress(raw[header_end:])
+        return body, _digest(body), fresh_until
+    value = json.loads(raw)
+    if isinstance(value, dict) and value.keys() == {'fresh_until', 'payload'}:
+        body, fresh_until = serialize(value['payload']), value['fresh_until']
+    else:
+        body, fresh_until = serialize(value), float('inf')
+    return body, _digest(body), fresh_until
+
+
+def _load_entry(redis_client, key):
+    raw = redis_client.get(key)
+    if raw is None:
+        return None
+    body, digest, fresh_until = _decode(raw)
+    local_cache.put(key, body, digest, fresh_until)
+    return body, digest, fresh_until
+
+
+def load_body(redis_client, key):
+    """Returns (body, is_fresh) from Redis, or (None, False) when nothing is cached."""
+    entry = _load_entry(redis_client, key)
+    if entry is None:
+        return None, False
+    return entry[0], entry[2] > time.time()
+
+
+def load(redis_client, key):
+    """Returns (payload, is_fresh), or (None, False) when nothing is cached."""
+    body, fresh = load_body(redis_client, key)
+    return (json.loads(body) if body is not None else None), fresh
+
+
+def mark_stale(redis_client, *keys):
+    """
+    Keeps cached values servable but makes the next read recompute them. Each
+    key keeps its remaining TTL, so values stored with a short stale window
+    (e.g. bodies embedding presigned URLs) still expire on time.
+    """
+    for key in keys:
+        local_cache.drop(key)
+        raw = redis_client.get(key)
+        if raw is None:
+            continue
+        body, digest, _ = _decode(raw)
+        redis_client.set(key, _encode(body, digest, 0), keepttl=True, xx=True)
+
+
+def _acquire(redis_client, key):
+    token = uuid.uuid4().hex
+    return token if redis_client.set(_lock_key(key), token, nx=True, ex=LOCK_SECONDS) else None
+
+
+def _release(redis_client, key, token):
+    try:
+        redis_client.eval(_RELEASE_SCRIPT, 1, _lock_key(key), token)
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"Could not release cache lock for {key}: {e}")
+
+
+def single_flight(redis_client, key, work, ready):
+    """
+    Runs work() in at most one process at a time per key. Callers that find the
+    lock taken wait until ready() is true (or the lock is gone) and return None
+    instead of running it; after WAIT_SECONDS they run work() anyway.
+    """
+    deadline = time.monotonic() + WAIT_SECONDS
+    while True:
+        token = _acquire(redis_client, key)
+        if token:
+            try:
+                return work()
+            finally:
+                _release(redis_client, key, token)
+        while redis_client.exists(_lock_key(key)):
+            if ready():
+                return None
+            if time.monotonic() > deadline:
+                logger.warning(f"Gave up waiting for {key} after {WAIT_SECONDS}s; computing it here.")
+                return work()
+            time.sleep(POLL_INTERVAL)
+        if ready():
+            return None
+
+
+def _compute_and_store(redis_client, key, compute, ttl, stale, cacheable):
+    payload = compute()
+    body = serialize(payload)
+    etag = None
+    if redis_client is not None and cacheable(payload):
+        try:
+            etag = store_body(redis_client, key, body, ttl, stale)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Could not cache {key}: {e}")
+    return CachedBody(body, etag or etag_for(_digest(body)), payload)
+
+
+def _revalidate(redis_client, key, compute, ttl, stale, cacheable):
+    token = _acquire(redis_client, key)
+    if not token:
+        return  # someone else is already refreshing it
+
+    def run():
+        try:
+            _compute_and_store(redis_client, key, compute, ttl, stale, cacheable)
+        except Exception as e:
+            logger.error(f"Background refresh of {key} failed: {e}", exc_info=True)
+        finally:
+            _release(redis_client, key, token)
+
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), name=f"revalidate:{key}", daemon=True).start()
+
+
+def get_or_compute(redis_client, key, compute, ttl=None, stale=None, cacheable=None):
+    """
+    Returns a CachedBody for `key`: the serialized JSON body, its ETag, and the
+    payload dict only when it was computed by this call (None for cache hits,
+    which are never decoded). Only payloads for which cacheable(payload) is
+    true are stored (default: payloads with a truthy 'success'). Without
+    Redis, just computes.
+    """
+    cacheable = cacheable or (lambda payload: bool(payload and payload.get('success')))
+    if redis_client is None:
+        return _compute_and_store(None, key, compute, ttl, stale, cacheable)
+
+    local = local_cache.get(key)
+    if local and local[2] > time.time():
+        return CachedBody(local[0], etag_for(local[1]), None)
+    try:
+        entry = _load_entry(redis_client, key)
+        if entry is not None:
+            body, digest, fresh_until = entry
+            if fresh_until <= time.time():
+                _revalidate(redis_client, key, compute, ttl, stale, cacheable)
+            return CachedBody(body, etag_for(digest), None)
+
+        result = {}
+
+        def work():
+            result['computed'] = _compute_and_store(redis_client, key, compute, ttl, stale, cacheable)
+
+        def ready():
+            result['cached'] = _load_entry(redis_client, key)
+            return result['cached'] is not None
+
+        single_flight(redis_client, key, work, ready)
+        if result.get('computed'):
+            return result['computed']
+        if result.get('cached'):
+            body, digest, _ = result['cached']
+            return CachedBody(body, etag_for(digest), None)
+        return _compute_and_store(redis_client, key, compute, ttl, stale, cacheable)
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"Cache unavailable for {key}, computing directly: {e}")
+        return _compute_and_store(None, key, compute, ttl, stale, cacheable)
@@ -0,0 +1,420 @@
+"""
+Local catalog of S3 keys, sizes, ETags and LastModified times, stored in Redis.
+
+Dashboard endpoints used to walk the whole upload prefix on every call. The
+catalog lets them answer from Redis instead:
+
+    s3catalog:{bucket}:keys      sorted set of every key (score 0) for prefix range queries
+    s3catalog:{bucket}:meta      hash key -> "size|etag|last_modified_epoch"
+    s3catalog:{bucket}:cursors   hash date prefix -> last key seen by an incremental listing
+    s3catalog:{bucket}:bases     hash base prefix -> epoch of its last full listing
+    s3catalog:{bucket}:usage:{base}
+                                 hash of usage counters for a base prefix (videos,
+                                 stored bytes, detections), see usage_category()
+
+It is kept current in three ways:
+  * write-through: our upload helpers call record_upload() after each PUT;
+  * incremental sync: per date prefix, list only keys after the last seen one
+    (StartAfter), which picks up frames written by other services;
+  * reconcile: a periodic full listing that repairs anything the incremental
+    listing cannot see (keys sorting before the cursor, deletions).
+
+Every write adjusts the usage counters of the base prefixes it falls under,
+so /system-status reads three numbers instead of scanning. The counters are
+recomputed from the catalog on every reconcile to correct any drift.
+
+Keys never expire, so they survive the volatile-lru eviction policy. The
+catalog can be rebuilt offline:
+
+    python -m services.s3_catalog rebuild --prefix <base prefix> [--from-scratch]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+import redis
+
+from .s3_client import client_manager
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
+# Redis commands are batched in pipelines of this many operations.
+BATCH_SIZE = 1000
+# After a failed connection attempt, wait this long before trying Redis again.
+RETRY_AFTER_SECONDS = 30
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+FRAME_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+_redis_client = None
+_last_failure = 0.0
+
+
+def get_redis():
+    """Returns the Redis client used by the catalog, or None if Redis is unreachable."""
+    global _redis_client, _last_failure
+    if _redis_client is None:
+        if time.time() - _last_failure < RETRY_AFTER_SECONDS:
+            return None
+        try:
+            client = redis.from_url(REDIS_URL, socket_timeout=5, socket_connect_timeout=2)
+            client.ping()
+            _redis_client = client
+        except redis.exceptions.RedisError as e:
+            _last_failure = time.time()
+            logger.warning(f"S3 catalog unavailable, falling back to S3 listings: {e}")
+            return None
+    return _redis_client
+
+
+def normalize_prefix(prefix):
+    return prefix if not prefix or prefix.endswith('/') else prefix + '/'
+
+
+def usage_category(key):
+    """Classifies a key for the usage counters: 'video', 'detection' or None."""
+    key_lower = key.lower()
+    if '/raw-videos/' in key_lower and key_lower.endswith(VIDEO_EXTENSIONS):
+        return 'video'
+    if '/processed frames/' in key_lower and key_lower.endswith(FRAME_EXTENSIONS):
+        return 'detection'
+    return None
+
+
+def empty_usage():
+    return {'total_videos': 0, 'total_size_bytes': 0, 'total_detections': 0}
+
+
+def add_usage(usage, key, size, sign=1):
+    """Adds (or, with sign=-1, subtracts) one object to a usage dict."""
+    category = usage_category(key)
+    if category == 'video':
+        usage['total_videos'] += sign
+        usage['total_size_bytes'] += sign * (size or 0)
+    elif category == 'detection':
+        usage['total_detections'] += sign
+
+
+def encode_meta(size, etag, last_modified):
+    return f"{size if size is not None else ''}|{etag or ''}|{last_modified if last_modified is not None else ''}"
+
+
+def decode_meta(raw):
+    if raw is None:
+        return None
+    size, etag, last_modified = raw.decode('utf-8').split('|', 2)
+    return {
+        'size': int(size) if size else 0,
+        'etag': etag or None,
+        'last_modified': float(last_modified) if last_modified else None
+    }
+
+
+class S3Catalog:
+    """Redis-backed index of the objects in one bucket."""
+
+    def __init__(self, redis_client, bucket_name):
+        self.redis = redis_client
+        self.bucket = bucket_name
+        self.keys_key = f"s3catalog:{bucket_name}:keys"
+        self.meta_key = f"s3catalog:{bucket_name}:meta"
+        self.cursors_key = f"s3catalog:{bucket_name}:cursors"
+        self.bases_key = f"s3catalog:{bucket_name}:bases"
+
+    # --- Writes ---
+
+    def record_objects(self, objects):
+        """
+        Upserts an iterable of (key, size, etag, last_modified_epoch) and adjusts
+        the usage counters by the difference with the replaced entries.
+        """
+        count = 0
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            count += 1
+            if len(batch) == BATCH_SIZE:
+                self._record_batch(batch)
+                batch = []
+        if batch:
+            self._record_batch(batch)
+        return count
+
+    def _record_batch(self, batch):
+        # MULTI/EXEC, so each HGET sees exactly the entry its HSET replaces even
+        # when two writers record the same key concurrently.
+        pipe = self.redis.pipeline(transaction=True)
+        for key, size, etag, last_modified in batch:
+            pipe.hget(self.meta_key, key)
+            pipe.hset(self.meta_key, key, encode_meta(size, etag, last_modified))
+            pipe.zadd(self.keys_key, {key: 0})
+        results = pipe.execute()
+
+        deltas = {}
+        for i, (key, size, _, _) in enumerate(batch):
+            if not usage_category(key):
+                continue
+            delta = deltas.setdefault(key, empty_usage())
+            previous = decode_meta(results[3 * i])
+            if previous:
+                add_usage(delta, key, previous['size'], sign=-1)
+            add_usage(delta, key, size)
+        self._apply_usage(deltas)
+
+    def remove_objects(self, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch = keys[i:i + BATCH_SIZE]
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.hmget(self.meta_key, batch)
+            pipe.zrem(self.keys_key, *batch)
+            pipe.hdel(self.meta_key, *batch)
+            previous = pipe.execute()[0]
+
+            deltas = {}
+            for key, raw in zip(batch, previous):
+                meta = decode_meta(raw)
+                if meta and usage_category(key):
+                    add_usage(deltas.setdefault(key, empty_usage()), key, meta['size'], sign=-1)
+            self._apply_usage(deltas)
+
+    # --- Usage counters ---
+
+    def usage_key(self, base_prefix):
+        return f"s3catalog:{self.bucket}:usage:{base_prefix}"
+
+    def _apply_usage(self, deltas):
+        """Adds per-key usage deltas to the counters of every base prefix that contains the key."""
+        if not deltas:
+            return
+        bases = [base.decode('utf-8') for base in self.redis.hkeys(self.bases_key)]
+        # Counters that have not been seeded by a recount yet would end up partial.
+        pipe = self.redis.pipeline(transaction=False)
+        for base in bases:
+            pipe.exists(self.usage_key(base))
+        bases = [base for base, seeded in zip(bases, pipe.execute()) if seeded]
+        if not bases:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for key, delta in deltas.items():
+            for base in bases:
+                if not key.startswith(base):
+                    continue
+                for field, value in delta.items():
+                    if value:
+                        pipe.hincrby(self.usage_key(base), field, value)
+        pipe.execute()
+
+    def recount_usage(self, base_prefix):
+        """Recomputes the usage counters of base_prefix from the catalog (no S3 calls)."""
+        base_prefix = normalize_prefix(base_prefix)
+        usage = empty_usage()
+        for key, meta in self.iter_objects(base_prefix):
+            if meta:
+                add_usage(usage, key, meta['size'])
+        self.redis.hset(self.usage_key(base_prefix), mapping=usage)
+        return usage
+
+    def usage(self, prefix):
+        """Returns the usage counters for prefix in O(1), or None if it is not a reconciled base prefix."""
+        raw = self.redis.hgetall(self.usage_key(normalize_prefix(prefix)))
+        if not raw:
+            return None
+        usage = empty_usage()
+        usage.update({field.decode('utf-8'): int(value) for field, value in raw.items()})
+        return usage
+
+    # --- Reads ---
+
+    def covers(self, prefix):
+        """True when prefix lies under a base prefix that has been fully listed at least once."""
+        prefix = normalize_prefix(prefix)
+        bases = self.redis.hkeys(self.bases_key)
+        return any(prefix.startswith(base.decode('utf-8')) for base in bases)
+
+    def iter_keys(self, prefix):
+        """Yields every catalogued key under prefix, in lexicographic order."""
+        start = b"[" + prefix.encode('utf-8') if prefix else '-'
+        end = b"[" + prefix.encode('utf-8') + b"\xff" if prefix else '+'
+        offset = 0
+        while True:
+            batch = self.redis.zrangebylex(self.keys_key, start, end, start=offset, num=BATCH_SIZE)
+            for key in batch:
+                yield key.decode('utf-8')
+            if len(batch) < BATCH_SIZE:
+                return
+            offset += BATCH_SIZE
+
+    def iter_objects(self, prefix):
+        """Yields (key, meta) for every catalogued key under prefix."""
+        batch = []
+        for key in self.iter_keys(prefix):
+            batch.append(key)
+            if len(batch) == BATCH_SIZE:
+                yield from zip(batch, map(decode_meta, self.redis.hmget(self.meta_key, batch)))
+                batch = []
+        if batch:
+            yield from zip(batch, map(decode_meta, self.redis.hmget(self.meta_key, batch)))
+
+    def list_keys(self, prefix, extension=None):
+        return [key for key in self.iter_keys(prefix) if not key.endswith('/') and (not extension or key.endswith(extension))]
+
+    def list_common_prefixes(self, prefix):
+        """Equivalent of a Delimiter='/' listing: the distinct child 'folders' of prefix."""
+        prefix = normalize_prefix(prefix)
+        end = b"[" + prefix.encode('utf-8') + b"\xff"
+        start = b"[" + prefix.encode('utf-8')
+        children = []
+        while True:
+            # Fetch the next key, then jump past everything under its child folder.
+            batch = self.redis.zrangebylex(self.keys_key, start, end, start=0, num=1)
+            if not batch:
+                return children
+            rest = batch[0].decode('utf-8')[len(prefix):]
+            if '/' not in rest:
+                start = b"(" + batch[0]
+                continue
+            child = prefix + rest.split('/', 1)[0] + '/'
+            children.append(child)
+            start = b"(" + child.encode('utf-8') + b"\xff"
+
+    # --- Sync with S3 ---
+
+    def _list(self, prefix, start_after=None, delimiter=None):
+        paginator = client_manager.get_client().get_paginator('list_objects_v2')
+        kwargs = {'Bucket': self.bucket, 'Prefix': prefix}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        if delimiter:
+            kwargs['Delimiter'] = delimiter
+        return paginator.paginate(**kwargs)
+
+    def _date_prefixes(self, base_prefix):
+        return [cp['Prefix'] for page in self._list(base_prefix, delimiter='/') for cp in page.get('CommonPrefixes', [])]
+
+    def sync(self, base_prefix):
+        """
+        Incremental sync: for every date prefix under base_prefix, lists only the
+        keys after the last one seen. Falls back to a full reconcile the first
+        time a base prefix is synced. Returns the number of objects recorded.
+        """
+        base_prefix = normalize_prefix(base_prefix)
+        if not self.redis.hexists(self.bases_key, base_prefix):
+            return self.reconcile(base_prefix)
+        if not self.redis.exists(self.usage_key(base_prefix)):
+            self.recount_usage(base_prefix)
+
+        recorded = 0
+        cursors = {k.decode('utf-8'): v.decode('utf-8') for k, v in self.redis.hgetall(self.cursors_key).items()}
+        for date_prefix in self._date_prefixes(base_prefix):
+            last_key = cursors.get(date_prefix)
+            new_objects = []
+            for page in self._list(date_prefix, start_after=last_key):
+                for obj in page.get('Contents', []):
+                    new_objects.append((obj['Key'], obj['Size'], obj['ETag'].strip('"'), obj['LastModified'].timestamp()))
+            if new_objects:
+                recorded += self.record_objects(new_objects)
+                self.redis.hset(self.cursors_key, date_prefix, new_objects[-1][0])
+        if recorded:
+            logger.info(f"S3 catalog sync recorded {recorded} new objects under {base_prefix}.")
+        return recorded
+
+    def reconcile(self, base_prefix, from_scratch=False):
+        """
+        Full listing of base_prefix: upserts every object, drops catalogued keys
+        that no longer exist and resets the per-date cursors.
+        """
+        base_prefix = normalize_prefix(base_prefix)
+        if from_scratch:
+            self.remove_objects(list(self.iter_keys(base_prefix)))
+
+        seen = set()
+        cursors = {}
+        objects = []
+        for page in self._list(base_prefix):
+            for obj in page.get('Contents', []):
+                key = obj['Key']
+                seen.add(key)
+                objects.append((key, obj['Size'], obj['ETag'].strip('"'), obj['LastModified'].timestamp()))
+                rest = key[len(base_prefix):]
+                if '/' in rest:
+                    cursors[base_prefix + rest.split('/', 1)[0] + '/'] = key
+        recorded = self.record_objects(objects)
+        stale = [key for key in self.iter_keys(base_prefix) if key not in seen]
+        if stale:
+            self.remove_objects(stale)
+        if cursors:
+            self.redis.hset(self.cursors_key, mapping=cursors)
+        self.redis.hset(self.bases_key, base_prefix, time.time())
+        usage = self.recount_usage(base_prefix)
+        logger.info(f"S3 catalog reconciled {base_prefix}: {recorded} objects, {len(stale)} removed, usage {usage}.")
+        return recorded
+
+
+def get_catalog(bucket_name):
+    """Returns an S3Catalog for the bucket, or None when Redis is unavailable."""
+    client = get_redis()
+    return S3Catalog(client, bucket_name) if client else None
+
+
+def get_ready_catalog(bucket_name, prefix):
+    """Returns the catalog only if it can answer queries under prefix."""
+    try:
+        catalog = get_catalog(bucket_name)
+        if catalog and catalog.covers(prefix):
+            return catalog
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"S3 catalog lookup failed, falling back to S3: {e}")
+    return None
+
+
+def record_upload(bucket_name, s3_key, size=None, etag=None):
+    """Write-through hook for upload helpers. Never raises."""
+    try:
+        catalog = get_catalog(bucket_name)
+        if catalog:
+            catalog.record_objects([(s3_key, size, etag.strip('"') if etag else None, time.time())])
+    except Exception as e:
+        logger.warning(f"Could not record s3://{bucket_name}/{s3_key} in the catalog: {e}")
+
+
+def sync_prefixes(bucket_name, prefixes, full=False):
+    """Scheduler entry point: incrementally syncs (or fully reconciles) each prefix."""
+    catalog = get_catalog(bucket_name)
+    if not catalog:
+        return
+    for prefix in prefixes:
+        try:
+            if full:
+                catalog.reconcile(prefix)
+            else:
+                catalog.sync(prefix)
+        except Exception as e:
+            logger.error(f"S3 catalog sync failed for {prefix}: {e}", exc_info=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the Redis S3 key catalog.")
+    parser.add_argument('command', choices=['sync', 'rebuild'])
+    parser.add_argument('--bucket', default=os.getenv('S3_BUCKET_NAME', 'aispry-project'))
+    parser.add_argument('--prefix', action='append', required=True, help='Base prefix; may be repeated.')
+    parser.add_argument('--from-scratch', action='store_true', help='Drop the catalogued keys first (rebuild only).')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    catalog = get_catalog(args.bucket)
+    if not catalog:
+        print("Redis is not reachable; nothing to do.")
+        return 1
+    for prefix in args.prefix:
+        if args.command == 'rebuild':
+            catalog.reconcile(prefix, from_scratch=args.from_scratch)
+        else:
+            catalog.sync(prefix)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Process-wide S3 client shared by every S3 helper.
+
+boto3 low-level clients are thread-safe, so one client (and one connection
+pool) per process is enough. The client is rebuilt lazily after a fork, so
+Celery prefork children never reuse the parent's sockets.
+
+Tuning is read from the environment:
+    S3_MAX_POOL_CONNECTIONS  connection pool size (default 50)
+    S3_MAX_ATTEMPTS          total attempts per call, including retries (default 5)
+    S3_RETRY_MODE            botocore retry mode: standard / adaptive / legacy (default standard)
+    S3_CONNECT_TIMEOUT       seconds (default 5)
+    S3_READ_TIMEOUT          seconds (default 60)
+    S3_ENDPOINT_URL          custom endpoint, e.g. a local S3 stand-in (default: AWS)
+
+Requests are rate-limited per key prefix by the adaptive scheduler in
+services.s3_scheduler. Every API call made through the client is counted, per operation, both
+process-wide and for the current request or task (see start_call_tracking).
+"""
+import os
+import logging
+import threading
+import contextvars
+from collections import Counter
+
+import boto3
+from botocore.config import Config as BotoConfig
+
+from .s3_scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Counts for the request/task running in the current context; None when not tracking.
+_tracked_calls = contextvars.ContextVar('s3_tracked_calls', default=None)
+
+
+def build_client_config():
+    """Builds the botocore client config from the environment."""
+    return BotoConfig(
+        max_pool_connections=int(os.getenv('S3_MAX_POOL_CONNECTIONS', 50)),
+        retries={
+            'max_attempts': int(os.getenv('S3_MAX_ATTEMPTS', 5)),
+            'mode': os.getenv('S3_RETRY_MODE', 'standard')
+        },
+        connect_timeout=float(os.getenv('S3_CONNECT_TIMEOUT', 5)),
+        read_timeout=float(os.getenv('S3_READ_TIMEOUT', 60))
+    )
+
+
+class S3ClientManager:
+    """Lazily creates one S3 client per process and hands it out to every caller."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._session = None
+        self._pid = None
+        self._totals = Counter()
+        self._totals_lock = threading.Lock()
+
+    def get_client(self):
+        client, pid = self._client, self._pid
+        if client is not None and pid == os.getpid():
+            return client
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                self._client = self._create_client()
+                self._pid = os.getpid()
+            return self._client
+
+    def reset(self):
+        """Drops the client; the next get_client() builds a fresh one."""
+        self._lock = threading.Lock()
+        self._client = None
+        self._session = None
+        self._pid = None
+
+    def get_credentials(self):
+        """The credentials the shared client signs with (refreshable for roles and STS), or None."""
+        self.get_client()
+        return self._session.get_credentials()
+
+    def _create_client(self):
+        # A dedicated session avoids sharing boto3's non-thread-safe default session.
+        session = boto3.session.Session(
+            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            region_name=os.getenv('AWS_REGION', 'us-east-1')
+        )
+        client = session.client('s3', config=build_client_config(), endpoint_url=os.getenv('S3_ENDPOINT_URL') or None)
+        self._session = session
+        client.meta.events.register('before-call.s3', self._count_call)
+        scheduler.register(client)
+        logger.info(f"Created shared S3 client for process {os.getpid()}.")
+        return client
+
+    def _count_call(self, model, **kwargs):
+        with self._totals_lock:
+            self._totals[model.name] += 1
+        tracked = _tracked_calls.get()
+        if tracked is not None:
+            tracked[model.name] += 1
+
+    def total_calls(self):
+        """Process-wide S3 API call counts per operation since start-up."""
+        with self._totals_lock:
+            return dict(self._totals)
+
+
+client_manager = S3ClientManager()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=client_manager.reset)
+
+
+def start_call_tracking():
+    """Starts counting S3 calls made from the current request or task context."""
+    _tracked_calls.set(Counter())
+
+
+def stop_call_tracking():
+    """Stops tracking and returns {operation: count} for the current context."""
+    tracked = _tracked_calls.get()
+    _tracked_calls.set(None)
+    return dict(tracked or {})
+
+
+def tracked_call_count():
+    """Total S3 calls recorded so far in the current context."""
+    return sum((_tracked_calls.get() or {}).values())
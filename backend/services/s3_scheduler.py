@@ -0,0 +1,196 @@
+"""
+Adaptive per-prefix concurrency limits for S3 requests.
+
+S3 rate limits apply per key prefix, so a burst of parallel downloads, JSON
+reads or uploads into one date folder can be answered with 503 SlowDown even
+when the bucket as a whole is idle. The scheduler hooks into the shared
+client's events and caps the requests in flight per prefix (the bucket plus
+the first S3_SCHED_PREFIX_DEPTH key segments, i.e. up to the date folder by
+default). The cap adapts AIMD-style:
+
+  * every successful request raises the limit by 1/limit, i.e. by one per
+    "window" of requests, up to S3_SCHED_MAX_LIMIT;
+  * a throttling response (SlowDown / 503) multiplies it by
+    S3_SCHED_DECREASE_FACTOR, at most once per S3_SCHED_DECREASE_COOLDOWN
+    seconds so one burst of throttles does not collapse it to the minimum.
+
+botocore's own retries (S3_MAX_ATTEMPTS) still handle the throttled request
+itself; the scheduler makes the next ones back off. Limits are per process.
+
+Tuning is read from the environment:
+    S3_SCHEDULER_ENABLED          'false' disables the limits (default true)
+    S3_SCHED_PREFIX_DEPTH         key segments that make up a prefix (default 3)
+    S3_SCHED_INITIAL_LIMIT        starting limit per prefix (default 32)
+    S3_SCHED_MIN_LIMIT            floor (default 1)
+    S3_SCHED_MAX_LIMIT            ceiling (default 256)
+    S3_SCHED_DECREASE_FACTOR      multiplicative decrease (default 0.5)
+    S3_SCHED_DECREASE_COOLDOWN    seconds between decreases (default 1.0)
+
+Limits, in-flight requests, throttles and retries are exported as Prometheus
+metrics (see services.metrics) and by snapshot().
+"""
+import os
+import time
+import logging
+import threading
+
+from .metrics import S3_PREFIX_LIMIT, S3_PREFIX_IN_FLIGHT, S3_THROTTLED_TOTAL, S3_RETRIES_TOTAL
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                  'TooManyRequestsException', 'ServiceUnavailable', '503'}
+# Idle limiters beyond this many are forgotten.
+MAX_TRACKED_PREFIXES = 1024
+_CONTEXT_KEY = 's3_scheduler_slot'
+_PREFIX_CONTEXT_KEY = 's3_scheduler_prefix'
+
+
+class PrefixLimiter:
+    """AIMD concurrency limit for one prefix."""
+
+    def __init__(self, prefix, initial, minimum, maximum, decrease_factor, cooldown):
+        self.prefix = prefix
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.throttled = 0
+        self.retries = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= max(int(self.limit), self.minimum):
+                self._cond.wait()
+            self.in_flight += 1
+        S3_PREFIX_IN_FLIGHT.labels(prefix=self.prefix).inc()
+
+    def release(self, success=True, retries=0):
+        with self._cond:
+            self.in_flight -= 1
+            self.retries += retries
+            if success and not retries:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+            limit = self.limit
+        S3_PREFIX_IN_FLIGHT.labels(prefix=self.prefix).dec()
+        S3_PREFIX_LIMIT.labels(prefix=self.prefix).set(limit)
+
+    def on_throttle(self):
+        with self._cond:
+            self.throttled += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+                logger.warning(f"S3 throttled requests under {self.prefix}; concurrency limit lowered to {int(self.limit)}.")
+            limit = self.limit
+        S3_THROTTLED_TOTAL.labels(prefix=self.prefix).inc()
+        S3_PREFIX_LIMIT.labels(prefix=self.prefix).set(limit)
+
+    def idle(self):
+        return self.in_flight == 0
+
+
+class S3Scheduler:
+    """Keeps a PrefixLimiter per prefix and wires them into a client's event hooks."""
+
+    def __init__(self):
+        self.enabled = os.getenv('S3_SCHEDULER_ENABLED', 'true').lower() != 'false'
+        self.depth = int(os.getenv('S3_SCHED_PREFIX_DEPTH', 3))
+        self.initial = int(os.getenv('S3_SCHED_INITIAL_LIMIT', 32))
+        self.minimum = int(os.getenv('S3_SCHED_MIN_LIMIT', 1))
+        self.maximum = int(os.getenv('S3_SCHED_MAX_LIMIT', 256))
+        self.decrease_factor = float(os.getenv('S3_SCHED_DECREASE_FACTOR', 0.5))
+        self.cooldown = float(os.getenv('S3_SCHED_DECREASE_COOLDOWN', 1.0))
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def prefix_for(self, params):
+        """Bucket plus the first `depth` segments of the request's Key (or listing Prefix)."""
+        key = params.get('Key') or params.get('Prefix') or ''
+        segments = [segment for segment in key.split('/')[:self.depth] if segment]
+        return '/'.join([params.get('Bucket', '')] + segments)
+
+    def limiter(self, prefix):
+        with self._lock:
+            limiter = self._limiters.get(prefix)
+            if limiter is None:
+                if len(self._limiters) >= MAX_TRACKED_PREFIXES:
+                    self._forget_idle()
+                limiter = self._limiters[prefix] = PrefixLimiter(
+                    prefix, self.initial, self.minimum, self.maximum, self.decrease_factor, self.cooldown
+                )
+            return limiter
+
+    def _forget_idle(self):
+        for prefix in [p for p, limiter in self._limiters.items() if limiter.idle()]:
+            del self._limiters[prefix]
+
+    def register(self, client):
+        """Installs the scheduler on a botocore S3 client."""
+        if not self.enabled:
+            return
+        events = client.meta.events
+        events.register('before-parameter-build.s3', self._before_parameter_build)
+        events.register('before-call.s3', self._before_call)
+        events.register('needs-retry.s3', self._needs_retry)
+        events.register('after-call.s3', self._after_call)
+        events.register('after-call-error.s3', self._after_call_error)
+
+    # --- botocore event handlers ---
+
+    def _before_parameter_build(self, params, context, **kwargs):
+        # Only this event sees the API parameters (Bucket, Key, Prefix) as passed in.
+        context[_PREFIX_CONTEXT_KEY] = self.prefix_for(params)
+
+    def _before_call(self, model, params, context, **kwargs):
+        limiter = self.limiter(context.get(_PREFIX_CONTEXT_KEY, ''))
+        limiter.acquire()
+        context[_CONTEXT_KEY] = limiter
+
+    def _needs_retry(self, response=None, request_dict=None, **kwargs):
+        if not response or not request_dict:
+            return None
+        http_response, parsed = response
+        code = (parsed or {}).get('Error', {}).get('Code')
+        if code in THROTTLE_CODES or http_response.status_code == 503:
+            limiter = request_dict.get('context', {}).get(_CONTEXT_KEY)
+            if limiter:
+                limiter.on_throttle()
+        # Never influences botocore's retry decision.
+        return None
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        limiter = context.pop(_CONTEXT_KEY, None)
+        if limiter:
+            retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            if retries:
+                S3_RETRIES_TOTAL.labels(operation=model.name).inc(retries)
+            limiter.release(success=http_response.status_code < 300, retries=retries)
+
+    def _after_call_error(self, exception, context, **kwargs):
+        limiter = context.pop(_CONTEXT_KEY, None)
+        if limiter:
+            limiter.release(success=False)
+
+    def snapshot(self):
+        """Current state per prefix: limit, in-flight requests, throttles and retries seen."""
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {
+            limiter.prefix: {
+                'limit': int(limiter.limit),
+                'in_flight': limiter.in_flight,
+                'throttled': limiter.throttled,
+                'retries': limiter.retries
+            }
+            for limiter in limiters
+        }
+
+
+scheduler = S3Scheduler()
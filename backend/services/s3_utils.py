@@ -9,19 +9,18 @@ from werkzeug.utils import secure_filename
 from collections import defaultdict
 import json
 import re
+from .s3_client import client_manager
+from .presigner import presign_url, presign_urls
+from .s3_transfer import download_to_path
+from .s3_catalog import record_upload, get_ready_catalog, add_usage, empty_usage
+from .video_dedup import hash_fileobj, record_content_hash
 
 logger = logging.getLogger(__name__)
 
 def get_s3_client():
-    """Initialize and return an S3 client using environment variables."""
+    """Return the process-wide pooled S3 client (see services.s3_client)."""
     try:
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION', 'us-east-1')
-        )
-        return s3_client
+        return client_manager.get_client()
     except Exception as e:
         logger.error(f"Error initializing S3 client: {str(e)}")
         return None
@@ -73,10 +72,11 @@ def get_comparison_details_from_s3(bucket_name, prefix):
     
     left_view_details = []
     right_view_details = []
+    image_urls = presign_urls(bucket_name, [image_keys.get(frame) for frame in json_contents], 3600)
 
     for (view, frame_id), json_data in json_contents.items():
         image_key = image_keys.get((view, frame_id))
-        presigned_url = generate_presigned_url(bucket_name, image_key, 3600) if image_key else None
+        presigned_url = image_urls.get(image_key) if image_key else None
 
         def format_damage_count(data_list):
             if not data_list:
@@ -116,41 +116,39 @@ def get_comparison_details_from_s3(bucket_name, prefix):
 def get_s3_usage_stats(bucket_name, prefix=''):
     """
     Calculates total videos, storage size, and detected frames from an S3 bucket.
-    This is an efficient approach that gets all stats in a single pass.
+    Served in constant time from the catalog's usage counters when the prefix is
+    a catalogued base prefix; otherwise gets all stats in a single pass over
+    the catalog or, failing that, the S3 listing.
     """
-    s3_client = get_s3_client()
-    if not s3_client:
-        return {'total_videos': 0, 'total_size_bytes': 0, 'total_detections': 0}
-
-    paginator = s3_client.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+    catalog = get_ready_catalog(bucket_name, prefix)
+    if catalog:
+        try:
+            usage = catalog.usage(prefix)
+            if usage is not None:
+                return usage
+        except Exception as e:
+            logger.warning(f"Could not read usage counters for {prefix}: {e}")
+        pages = [{'Contents': ({'Key': key, 'Size': meta['size']} for key, meta in catalog.iter_objects(prefix) if meta)}]
+    else:
+        s3_client = get_s3_client()
+        if not s3_client:
+            return empty_usage()
 
-    total_videos = 0
-    total_size_bytes = 0
-    total_detections = 0
-    video_extensions = ('.mp4', '.avi', '.mov')
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix)
 
+    usage = empty_usage()
     try:
         for page in pages:
             if 'Contents' in page:
                 for obj in page['Contents']:
-                    key_lower = obj['Key'].lower()
-                    # Count raw videos and their size
-                    if '/raw-videos/' in key_lower and key_lower.endswith(video_extensions):
-                        total_videos += 1
-                        total_size_bytes += obj['Size']
-                    # Count extracted frames (detections)
-                    elif '/processed frames/' in key_lower and key_lower.endswith(('.jpg', '.jpeg', '.png')):
-                        total_detections += 1
+                    # Raw videos count with their size, extracted frames as detections
+                    add_usage(usage, obj['Key'], obj['Size'])
     except ClientError as e:
         logger.error(f"Error scanning S3 bucket for stats: {e}")
-        return {'total_videos': 0, 'total_size_bytes': 0, 'total_detections': 0}
+        return empty_usage()
 
-    return {
-        'total_videos': total_videos,
-        'total_size_bytes': total_size_bytes,
-        'total_detections': total_detections
-    }
+    return usage
 
 
 def upload_bytes_to_s3(image_bytes, bucket_name, s3_key, content_type='image/jpeg'):
@@ -160,12 +158,13 @@ def upload_bytes_to_s3(image_bytes, bucket_name, s3_key, content_type='image/jpe
         if s3_client is None:
             return False, "S3 client initialization failed"
         
-        s3_client.put_object(
+        response = s3_client.put_object(
             Bucket=bucket_name,
             Key=s3_key,
             Body=image_bytes,
             ContentType=content_type
         )
+        record_upload(bucket_name, s3_key, len(image_bytes), response.get('ETag'))
         return True, f"Successfully uploaded to {s3_key}"
     except ClientError as e:
         logger.error(f"S3 client error during bytes upload: {e}")
@@ -175,21 +174,8 @@ def upload_bytes_to_s3(image_bytes, bucket_name, s3_key, content_type='image/jpe
         return False, f"Error: {str(e)}"
 
 def generate_presigned_url(bucket_name, s3_key, expiration=3600):
-    """Generate a presigned URL to share an S3 object."""
-    try:
-        s3_client = get_s3_client()
-        if s3_client is None:
-            return None
-        
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket_name, 'Key': s3_key},
-            ExpiresIn=expiration
-        )
-        return url
-    except ClientError as e:
-        logger.error(f"Failed to generate presigned URL: {e}")
-        return None
+    """Generate a presigned URL to share an S3 object, reusing a cached one when still valid."""
+    return presign_url(bucket_name, s3_key, expiration)
 
 
 def upload_file_to_s3(file, bucket_name, folder_path, filename=None):
@@ -208,12 +194,16 @@ def upload_file_to_s3(file, bucket_name, folder_path, filename=None):
         logger.info(f"Uploading file to S3 key: {s3_key}")
         
         file.seek(0)
-        s3_client.put_object(
+        # The spooled upload is local, so hashing it first costs one extra local read.
+        sha256 = hash_fileobj(file)
+        response = s3_client.put_object(
             Bucket=bucket_name,
             Key=s3_key,
             Body=file,
             ContentType=file.content_type
         )
+        record_upload(bucket_name, s3_key, file.tell(), response.get('ETag'))
+        record_content_hash(bucket_name, s3_key, sha256, response.get('ETag'))
         
         logger.info(f"Successfully uploaded {safe_filename} to S3.")
         return True, f"File {safe_filename} uploaded successfully.", s3_key
@@ -272,7 +262,7 @@ def download_file_from_s3(bucket_name, s3_key, local_path):
             return False
         
         logger.info(f"Downloading {s3_key} from bucket {bucket_name} to {local_path}...")
-        s3_client.download_file(bucket_name, s3_key, local_path)
+        download_to_path(bucket_name, s3_key, local_path)
         logger.info("Download successful.")
         return True
         
@@ -316,8 +306,12 @@ import json
 def get_damage_counts_from_s3(bucket_name, base_prefix):
     """
     Calculates the number of new and resolved damages for each view (left, right, top)
-    by scanning JSON files in the specified S3 path.
+    by scanning JSON files in the specified S3 path. Each result folder is read
+    from its summary manifest when it has one.
     """
+    # Imported here: com_s3_utils itself imports this module.
+    from .com_s3_utils import read_folder_jsons
+
     s3_client = get_s3_client()
     if not s3_client:
         logger.error("S3 client not available for damage count.")
@@ -334,20 +328,23 @@ def get_damage_counts_from_s3(bucket_name, base_prefix):
             paginator = s3_client.get_paginator('list_objects_v2')
             page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=prefix)
 
+            # Group the JSON files by the folder that holds them
+            json_keys_by_folder = {}
             for page in page_iterator:
                 for obj in page.get('Contents', []):
                     key = obj['Key']
                     if key.endswith('.json'):
-                        response = s3_client.get_object(Bucket=bucket_name, Key=key)
-                        content = response['Body'].read().decode('utf-8')
-                        try:
-                            data = json.loads(content)
-                            # Count items in NEW and RESOLVED arrays
-                            count = len(data.get('NEW', [])) + len(data.get('RESOLVED', []))
-                            report[view_key] += count
-                        except json.JSONDecodeError:
-                            logger.warning(f"Skipping invalid JSON file: {key}")
+                        json_keys_by_folder.setdefault(os.path.dirname(key), []).append(key)
+
+            for json_folder, json_keys in json_keys_by_folder.items():
+                for key, data in zip(json_keys, read_folder_jsons(bucket_name, json_folder, json_keys)):
+                    if data is None:
+                        logger.warning(f"Skipping invalid JSON file: {key}")
+                        continue
+                    # Count items in NEW and RESOLVED arrays
+                    count = len(data.get('NEW', [])) + len(data.get('RESOLVED', []))
+                    report[view_key] += count
         except Exception as e:
             logger.error(f"Error accessing S3 folder {prefix}: {e}")
 
-    return report
\ No newline at end of file
+    return report
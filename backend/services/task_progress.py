@@ -0,0 +1,225 @@
+"""
+Push-based task progress over Redis pub/sub.
+
+Workers publish every state change of a task to the channel
+task-progress:{task_id}; the API's /task-events/<task_id> endpoint relays it
+to the browser as Server-Sent Events, so clients get updates as they happen
+instead of polling /task-status against the result backend.
+
+  * PROGRESS updates are throttled per task to one every
+    TASK_PROGRESS_MIN_INTERVAL seconds (default 0.5); an update arriving
+    sooner is held and published when the interval ends, replaced by any
+    newer one. The result backend is only written when an update is
+    published, so /task-status pollers see the same, slightly coarser,
+    progress. Other states always go through.
+  * The final state (SUCCESS, FAILURE, REVOKED) is published from the
+    task_postrun signal, so failures reach subscribers too.
+  * The latest event is also kept under task-progress:{task_id}:last for
+    TASK_PROGRESS_TTL_SECONDS, so a client that subscribes mid-task starts
+    from the current state without touching the result backend.
+
+Events have the same shape as /task-status responses (see status_payload).
+Publishing never raises; without Redis, tasks run exactly as before.
+
+task_infos reads the states of many tasks with one MGET against the Redis
+result backend, for the bulk status endpoint.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+from celery import Task
+from celery.result import AsyncResult
+from celery.backends.base import BaseKeyValueStoreBackend
+
+from .s3_catalog import get_redis
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = float(os.getenv('TASK_PROGRESS_MIN_INTERVAL', 0.5))
+LAST_EVENT_TTL = int(os.getenv('TASK_PROGRESS_TTL_SECONDS', 3600))
+# Seconds between keep-alive comments on an idle event stream.
+HEARTBEAT_SECONDS = float(os.getenv('TASK_EVENTS_HEARTBEAT_SECONDS', 15))
+# Streams are closed after this long; EventSource reconnects by itself.
+STREAM_MAX_SECONDS = float(os.getenv('TASK_EVENTS_MAX_SECONDS', 600))
+
+FINAL_STATES = {'SUCCESS', 'FAILURE', 'REVOKED'}
+
+
+def channel(task_id):
+    return f"task-progress:{task_id}"
+
+
+def _last_key(task_id):
+    return f"task-progress:{task_id}:last"
+
+
+def status_payload(state, info):
+    """The /task-status response for a task in `state` with Celery's info (meta, result or exception)."""
+    response = {'state': state}
+    if state == 'PENDING':
+        response.update({'status': 'Task is pending.', 'progress': 0})
+    elif state == 'PROGRESS':
+        response.update(info if isinstance(info, dict) else {'status': 'Processing...', 'progress': 0})
+    elif state == 'SUCCESS':
+        response.update({'status': 'Task completed successfully!', 'progress': 100, 'result': info})
+    elif state == 'FAILURE':
+        # info is the exception; the frontend only needs its message.
+        response.update({'status': str(info), 'progress': 100, 'error': True})
+    else:
+        # Other states like REVOKED
+        response.update({'status': state})
+    return response
+
+
+def task_infos(celery_app, task_ids):
+    """
+    {task_id: (state, info)} for many tasks, as AsyncResult.state and .info
+    would give them, fetched in a single MGET from a key-value result
+    backend. Unknown tasks are PENDING, as with AsyncResult. Other backends
+    fall back to one lookup per task.
+    """
+    backend = celery_app.backend
+    if isinstance(backend, BaseKeyValueStoreBackend):
+        try:
+            values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+        except NotImplementedError:
+            values = None
+        if values is not None:
+            infos = {}
+            for task_id, value in zip(task_ids, values):
+                if value is None:
+                    infos[task_id] = ('PENDING', None)
+                else:
+                    meta = backend.decode_result(value)
+                    infos[task_id] = (meta['status'], meta['result'])
+            return infos
+    results = {task_id: AsyncResult(task_id, app=celery_app) for task_id in task_ids}
+    return {task_id: (result.state, result.info) for task_id, result in results.items()}
+
+
+def publish(task_id, payload, redis_client=None):
+    """Publishes an event for a task and remembers it as the latest. Never raises."""
+    try:
+        client = redis_client or get_redis()
+        if not client:
+            return
+        data = json.dumps(payload, default=str)
+        pipe = client.pipeline(transaction=False)
+        pipe.set(_last_key(task_id), data, ex=LAST_EVENT_TTL)
+        pipe.publish(channel(task_id), data)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not publish progress of task {task_id}: {e}")
+
+
+def last_event(redis_client, task_id):
+    """The latest published event of a task, or None."""
+    raw = redis_client.get(_last_key(task_id))
+    return json.loads(raw) if raw else None
+
+
+class ProgressTask(Task):
+    """
+    Task base class whose update_state also publishes the update, with
+    PROGRESS updates throttled to one per MIN_INTERVAL seconds. An update held
+    back by the throttle is published when the interval ends (or when the task
+    body returns), so subscribers always converge on the latest progress.
+    """
+    # One task runs at a time per worker process, so this per-class state is safe.
+    _progress_lock = threading.Lock()
+    _progress_task_id = None
+    _progress_published = 0.0
+    _pending_progress = None
+    _flush_timer = None
+
+    def __call__(self, *args, **kwargs):
+        try:
+            return super().__call__(*args, **kwargs)
+        finally:
+            # Runs before Celery stores the final state, so a late flush cannot overwrite it.
+            self._flush_progress(final=True)
+
+    def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+        task_id = task_id or self.request.id
+        if state == 'PROGRESS':
+            with self._progress_lock:
+                now = time.monotonic()
+                wait = MIN_INTERVAL - (now - self._progress_published)
+                if self._progress_task_id == task_id and wait > 0:
+                    ProgressTask._pending_progress = (task_id, meta, kwargs)
+                    if self._flush_timer is None:
+                        timer = threading.Timer(wait, self._flush_progress)
+                        timer.daemon = True
+                        ProgressTask._flush_timer = timer
+                        timer.start()
+                    return
+                ProgressTask._pending_progress = None
+                self._store_and_publish(task_id, state, meta, **kwargs)
+            return
+        self._store_and_publish(task_id, state, meta, **kwargs)
+
+    def _flush_progress(self, final=False):
+        """Publishes the PROGRESS update held back by the throttle, if any."""
+        with self._progress_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                ProgressTask._flush_timer = None
+            pending, ProgressTask._pending_progress = self._pending_progress, None
+            if pending:
+                task_id, meta, kwargs = pending
+                self._store_and_publish(task_id, 'PROGRESS', meta, **kwargs)
+            if final:
+                ProgressTask._progress_task_id = None
+
+    def _store_and_publish(self, task_id, state, meta, **kwargs):
+        if state == 'PROGRESS':
+            ProgressTask._progress_task_id, ProgressTask._progress_published = task_id, time.monotonic()
+        super().update_state(task_id=task_id, state=state, meta=meta, **kwargs)
+        if task_id and state:
+            # The final state is published from task_postrun, once Celery has stored it.
+            if state not in FINAL_STATES:
+                publish(task_id, status_payload(state, meta))
+
+
+def publish_final_state(task_id, state, retval):
+    """Publishes a finished task's final state (SUCCESS result or FAILURE exception)."""
+    if task_id and state in FINAL_STATES:
+        publish(task_id, status_payload(state, retval))
+
+
+def format_event(payload):
+    return f"data: {json.dumps(payload, default=str)}\n\n"
+
+
+def event_stream(redis_client, task_id, current_state):
+    """
+    Server-Sent Events for one task: the current state, then each published
+    update, until the task finishes or STREAM_MAX_SECONDS pass. Sends a
+    keep-alive comment every HEARTBEAT_SECONDS while idle. `current_state()`
+    returns the /task-status payload and is only called when no event has
+    been published yet.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    # Subscribe before reading the current state so no update in between is lost.
+    pubsub.subscribe(channel(task_id))
+    try:
+        payload = last_event(redis_client, task_id) or current_state()
+        yield format_event(payload)
+        if payload.get('state') in FINAL_STATES:
+            return
+
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=HEARTBEAT_SECONDS)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            payload = json.loads(message['data'])
+            yield format_event(payload)
+            if payload.get('state') in FINAL_STATES:
+                return
+    finally:
+        pubsub.close()
@@ -0,0 +1,126 @@
+"""
+Content-hash deduplication of uploaded videos and their extracted frames.
+
+Operators re-upload the same recording under new names (e.g. another
+load_status suffix). Uploads record the SHA-256 of the bytes they stream, and
+frame extraction keeps a content-hash -> output-prefix index, so extracting a
+duplicate becomes a server-side copy of the existing frames instead of a YOLO
+pass over the whole video.
+
+Redis layout (shared with the S3 catalog's connection):
+    s3hash:{bucket}:keys          hash key -> "sha256|etag" of the object when it was hashed
+    s3hash:{bucket}:extractions   hash "sha256|model version" -> JSON {output_prefix, count}
+
+A recorded hash is only trusted while the object's ETag is unchanged, so an
+overwrite by a path that does not record hashes never reuses stale frames.
+Every function here degrades to "no information" when Redis is unavailable.
+"""
+import json
+import hashlib
+import logging
+
+from botocore.exceptions import ClientError
+
+from .s3_client import client_manager
+from .s3_catalog import get_redis, record_upload
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _keys_key(bucket_name):
+    return f"s3hash:{bucket_name}:keys"
+
+
+def _extractions_key(bucket_name):
+    return f"s3hash:{bucket_name}:extractions"
+
+
+def hash_fileobj(fileobj):
+    """SHA-256 of a seekable file object from its current position; the position is restored."""
+    position = fileobj.tell()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    fileobj.seek(position)
+    return digest.hexdigest()
+
+
+def hash_file(path):
+    with open(path, 'rb') as f:
+        return hash_fileobj(f)
+
+
+def record_content_hash(bucket_name, s3_key, sha256, etag=None):
+    """Remembers the content hash of an object we just wrote. Never raises."""
+    try:
+        client = get_redis()
+        if client:
+            client.hset(_keys_key(bucket_name), s3_key, f"{sha256}|{(etag or '').strip(chr(34))}")
+    except Exception as e:
+        logger.warning(f"Could not record content hash of s3://{bucket_name}/{s3_key}: {e}")
+
+
+def get_content_hash(bucket_name, s3_key):
+    """
+    Returns the recorded SHA-256 of an object, or None when it is unknown or
+    the object has changed since it was hashed.
+    """
+    try:
+        client = get_redis()
+        raw = client.hget(_keys_key(bucket_name), s3_key) if client else None
+        if not raw:
+            return None
+        sha256, etag = raw.decode('utf-8').split('|', 1)
+        current = client_manager.get_client().head_object(Bucket=bucket_name, Key=s3_key)['ETag'].strip('"')
+        return sha256 if etag and etag == current else None
+    except Exception as e:
+        logger.warning(f"Could not look up content hash of s3://{bucket_name}/{s3_key}: {e}")
+        return None
+
+
+def find_extraction(bucket_name, sha256, model_version):
+    """Returns {'output_prefix', 'count'} of an earlier extraction of identical content, or None."""
+    try:
+        client = get_redis()
+        raw = client.hget(_extractions_key(bucket_name), f"{sha256}|{model_version}") if client else None
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.warning(f"Could not look up extraction for {sha256[:12]}: {e}")
+        return None
+
+
+def record_extraction(bucket_name, sha256, model_version, output_prefix, count):
+    try:
+        client = get_redis()
+        if client:
+            client.hset(_extractions_key(bucket_name), f"{sha256}|{model_version}",
+                        json.dumps({'output_prefix': output_prefix, 'count': count}))
+    except Exception as e:
+        logger.warning(f"Could not record extraction for {sha256[:12]}: {e}")
+
+
+def frame_keys(output_prefix, count):
+    """Keys of the frames FrameExtractor writes for an extraction of `count` frames."""
+    return [f"{output_prefix}/frame_{i}.jpg" for i in range(1, count + 1)]
+
+
+def copy_frames(bucket_name, source_prefix, target_prefix, count):
+    """
+    Server-side copies the frames of an earlier extraction. Returns the new keys,
+    or None if any source frame is gone (the caller then extracts from scratch).
+    """
+    client = client_manager.get_client()
+    copied = []
+    for source, target in zip(frame_keys(source_prefix, count), frame_keys(target_prefix, count)):
+        try:
+            response = client.copy_object(
+                Bucket=bucket_name, Key=target, CopySource={'Bucket': bucket_name, 'Key': source}
+            )
+        except ClientError as e:
+            logger.warning(f"Cannot reuse frames from {source_prefix}: copying {source} failed: {e}")
+            return None
+        record_upload(bucket_name, target, etag=response.get('CopyObjectResult', {}).get('ETag'))
+        copied.append(target)
+    return copied
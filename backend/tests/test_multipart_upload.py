@@ -0,0 +1,180 @@
+"""
+Streaming multipart uploads (services/multipart_upload.py) against moto's
+in-process S3.
+
+Run from the backend/ directory:
+    pip install -r tests/requirements.txt
+    python -m pytest tests
+"""
+import io
+import os
+import time
+
+import jwt
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from services import multipart_upload, s3_catalog
+from services.s3_client import client_manager
+
+BUCKET = 'upload-test'
+BOUNDARY = 'test-boundary'
+FIELDS = {'upload_date': '2025-01-02', 'camera_angle': 'left', 'video_type': 'entry', 'user_name': 'admin1'}
+
+
+def form_body(fields, filename, data, fields_first=True):
+    """A multipart/form-data body with the fields before (or after) the 'video' file part."""
+    field_parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        for name, value in fields.items()
+    ]
+    file_part = (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="video"; filename="{filename}"\r\n'
+        f'Content-Type: video/mp4\r\n\r\n'
+    ).encode('utf-8') + data + b'\r\n'
+    parts = field_parts + [file_part] if fields_first else [file_part] + field_parts
+    return b''.join(parts) + f'--{BOUNDARY}--\r\n'.encode('utf-8')
+
+
+def resolve_key(fields, filename):
+    if not all(fields.get(name) for name in FIELDS):
+        raise ValueError('Missing form data for S3 upload; send the form fields before the video.')
+    return f"uploads/{fields['upload_date']}/{filename}"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in (('AWS_ACCESS_KEY_ID', 'test'), ('AWS_SECRET_ACCESS_KEY', 'test'), ('AWS_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv('S3_ENDPOINT_URL', raising=False)
+    # Smallest parts S3 accepts, no retry back-off, and no Redis for the catalog.
+    monkeypatch.setattr(multipart_upload, 'PART_SIZE', multipart_upload.MIN_PART_SIZE)
+    monkeypatch.setattr(multipart_upload, 'PART_ATTEMPTS', 1)
+    monkeypatch.setattr(s3_catalog, '_redis_client', None)
+    monkeypatch.setattr(s3_catalog, '_last_failure', time.time())
+    with mock_aws():
+        client_manager.reset()
+        client = client_manager.get_client()
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    client_manager.reset()
+
+
+def open_uploads(client):
+    return client.list_multipart_uploads(Bucket=BUCKET).get('Uploads', [])
+
+
+def test_stream_form_upload_reads_back_identical(s3):
+    data = os.urandom(2 * multipart_upload.MIN_PART_SIZE + 12345)
+
+    fields, s3_key, size = multipart_upload.stream_form_upload(
+        io.BytesIO(form_body(FIELDS, 'video.mp4', data)), BOUNDARY, BUCKET, 'video', resolve_key
+    )
+
+    assert fields == FIELDS
+    assert s3_key == 'uploads/2025-01-02/video.mp4'
+    assert size == len(data)
+    obj = s3.get_object(Bucket=BUCKET, Key=s3_key)
+    assert obj['Body'].read() == data
+    assert obj['ETag'].strip('"').endswith('-3')
+    assert open_uploads(s3) == []
+
+
+def test_part_failure_aborts_upload(s3, monkeypatch):
+    upload_part = s3.upload_part
+
+    def failing_upload_part(**kwargs):
+        if kwargs['PartNumber'] == 2:
+            raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'injected'}}, 'UploadPart')
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(s3, 'upload_part', failing_upload_part)
+    data = os.urandom(3 * multipart_upload.MIN_PART_SIZE)
+
+    with pytest.raises(ClientError):
+        multipart_upload.stream_form_upload(
+            io.BytesIO(form_body(FIELDS, 'video.mp4', data)), BOUNDARY, BUCKET, 'video', resolve_key
+        )
+
+    assert open_uploads(s3) == []
+    assert 'Contents' not in s3.list_objects_v2(Bucket=BUCKET)
+
+
+def test_complete_failure_aborts_upload(s3, monkeypatch):
+    def failing_complete(**kwargs):
+        raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'injected'}}, 'CompleteMultipartUpload')
+
+    monkeypatch.setattr(s3, 'complete_multipart_upload', failing_complete)
+    data = os.urandom(multipart_upload.MIN_PART_SIZE + 1)
+
+    with pytest.raises(ClientError):
+        multipart_upload.stream_form_upload(
+            io.BytesIO(form_body(FIELDS, 'video.mp4', data)), BOUNDARY, BUCKET, 'video', resolve_key
+        )
+
+    assert open_uploads(s3) == []
+
+
+@pytest.fixture
+def api_app(s3):
+    """The API blueprint on a bare Flask app: no Redis, scheduler or model weights."""
+    pytest.importorskip('torchvision')
+    from benchmarks import stubs
+    # Fake YOLO and offline ResNet, so importing the routes downloads nothing.
+    stubs.install()
+    from flask import Flask
+    from api.routes import api_bp
+    from config import Config
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(S3_STREAMING_UPLOAD=True, S3_BUCKET=BUCKET)
+    app.redis = None
+    app.register_blueprint(api_bp, url_prefix='/api')
+    return app
+
+
+def test_fields_after_file_are_rejected_with_400(s3, api_app):
+    from config import Config
+
+    token = jwt.encode({'user': 'admin1', 'role': 's3_uploader'}, Config.JWT_SECRET_KEY, algorithm='HS256')
+
+    response = api_app.test_client().post(
+        '/api/s3-upload',
+        data=form_body(FIELDS, 'video.mp4', os.urandom(1024), fields_first=False),
+        headers={'Authorization': f'Bearer {token}', 'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'}
+    )
+
+    assert response.status_code == 400
+    assert 'before the video' in response.get_json()['error']
+    assert open_uploads(s3) == []
+    assert 'Contents' not in s3.list_objects_v2(Bucket=BUCKET)
+
+
+def test_presigned_complete_without_etags_uses_listed_parts(s3):
+    data = os.urandom(multipart_upload.MIN_PART_SIZE + 100)
+    upload = multipart_upload.start_presigned_upload(BUCKET, 'uploads/direct.mp4', 'video/mp4', len(data))
+    for part_number, offset in ((1, 0), (2, multipart_upload.MIN_PART_SIZE)):
+        s3.upload_part(Bucket=BUCKET, Key='uploads/direct.mp4', UploadId=upload['upload_id'],
+                       PartNumber=part_number, Body=data[offset:offset + multipart_upload.MIN_PART_SIZE])
+
+    # What the browser sends when the bucket's CORS rules do not expose ETag.
+    parts = [{'PartNumber': 1, 'ETag': None}, {'PartNumber': 2, 'ETag': None}]
+    size = multipart_upload.complete_presigned_upload(BUCKET, 'uploads/direct.mp4', upload['upload_id'], parts)
+
+    assert size == len(data)
+    assert s3.get_object(Bucket=BUCKET, Key='uploads/direct.mp4')['Body'].read() == data
+
+
+def test_unexpected_file_part_is_rejected(s3):
+    stray = (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="thumbnail"; filename="thumb.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode('utf-8') + b'\xff\xd8\xff\xe0' + b'\r\n'
+    body = stray + form_body(FIELDS, 'video.mp4', os.urandom(1024))
+
+    with pytest.raises(ValueError, match='thumbnail'):
+        multipart_upload.stream_form_upload(io.BytesIO(body), BOUNDARY, BUCKET, 'video', resolve_key)
+
+    assert open_uploads(s3) == []
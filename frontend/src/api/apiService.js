@@ -75,6 +75,36 @@ export const getTaskStatus = async (taskId) => {
     return response.json();
 };
 
+/**
+ * Subscribes to a Celery task's progress over Server-Sent Events.
+ * onUpdate receives the same payload as getTaskStatus; the stream closes
+ * itself once the task has finished. EventSource cannot send headers, so the
+ * stream is opened with a short-lived token that is only valid for this task.
+ * Resolves to the EventSource.
+ */
+export const subscribeTaskStatus = async (taskId, onUpdate, onError) => {
+    const response = await fetchWithAuth(`${API_URL}/task-events/${taskId}/token`, {
+        method: 'POST',
+        headers: getAuthHeaders(),
+    });
+    const { token } = await response.json();
+    const source = new EventSource(`${API_URL}/task-events/${taskId}?token=${encodeURIComponent(token)}`);
+    source.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        onUpdate(data);
+        if (['SUCCESS', 'FAILURE', 'REVOKED'].includes(data.state)) {
+            source.close();
+        }
+    };
+    source.onerror = (err) => {
+        // EventSource reconnects on its own unless the server refused the stream.
+        if (source.readyState === EventSource.CLOSED && onError) {
+            onError(err);
+        }
+    };
+    return source;
+};
+
 /**
  * Sends a request to cancel a running Celery task.
  */
@@ -111,6 +141,111 @@ export const uploadVideoToS3 = async (formData, signal) => {
     return response.json();
 }
 
+const postJson = async (path, body) => {
+    const response = await fetchWithAuth(`${API_URL}${path}`, {
+        method: 'POST',
+        headers: getAuthHeaders(),
+        body: JSON.stringify(body),
+    });
+    return response.json();
+};
+
+// Parts uploaded to S3 at the same time, attempts per part, and parts signed per request.
+const DIRECT_UPLOAD_CONCURRENCY = 4;
+const DIRECT_UPLOAD_PART_ATTEMPTS = 3;
+const DIRECT_UPLOAD_SIGN_BATCH = 20;
+
+/**
+ * Uploads a video straight to S3 as a presigned multipart upload; the API only
+ * signs the parts. `fields` holds the same metadata as the /s3-upload form.
+ * Resolves to the same shape as uploadVideoToS3: { success, s3_key, error }.
+ */
+export const uploadVideoDirectToS3 = async (file, fields, onProgress, signal) => {
+    const start = await postJson('/s3-multipart/start', {
+        ...fields,
+        filename: file.name,
+        size: file.size,
+        content_type: file.type,
+    });
+    if (!start.success) {
+        return start;
+    }
+    const { s3_key, upload_id, part_size } = start;
+    const partCount = Math.max(1, Math.ceil(file.size / part_size));
+
+    try {
+        const queue = Array.from({ length: partCount }, (_, i) => i + 1);
+
+        // Part URLs expire, so they are signed a batch at a time as the queue
+        // drains (not all up front), and signed again after a 403.
+        const urls = {};
+        const signing = {};
+        const signParts = (batch) => {
+            const request = postJson('/s3-multipart/part-urls', { s3_key, upload_id, part_numbers: batch })
+                .then((signed) => {
+                    if (!signed.success) {
+                        throw new Error(signed.error || 'Could not sign upload parts');
+                    }
+                    Object.assign(urls, signed.urls);
+                })
+                .finally(() => batch.forEach((n) => { delete signing[n]; }));
+            batch.forEach((n) => { signing[n] = request; });
+            return request;
+        };
+        const partUrl = async (partNumber) => {
+            if (!urls[partNumber]) {
+                if (!signing[partNumber]) {
+                    const upcoming = queue.filter((n) => !urls[n] && !signing[n]);
+                    signParts([partNumber, ...upcoming.slice(0, DIRECT_UPLOAD_SIGN_BATCH - 1)]);
+                }
+                await signing[partNumber];
+            }
+            return urls[partNumber];
+        };
+
+        const parts = [];
+        let uploadedBytes = 0;
+        const uploadPart = async (partNumber) => {
+            const blob = file.slice((partNumber - 1) * part_size, partNumber * part_size);
+            for (let attempt = 1; ; attempt++) {
+                try {
+                    const response = await fetch(await partUrl(partNumber), { method: 'PUT', body: blob, signal });
+                    if (response.status === 403) {
+                        // Most likely an expired URL; the next attempt signs the part again.
+                        delete urls[partNumber];
+                    }
+                    if (!response.ok) {
+                        throw new Error(`Part ${partNumber} failed with status ${response.status}`);
+                    }
+                    parts.push({ PartNumber: partNumber, ETag: response.headers.get('ETag') });
+                    uploadedBytes += blob.size;
+                    if (onProgress) onProgress(Math.round((uploadedBytes / file.size) * 100));
+                    return;
+                } catch (error) {
+                    if (attempt >= DIRECT_UPLOAD_PART_ATTEMPTS || (signal && signal.aborted)) throw error;
+                }
+            }
+        };
+
+        const workers = Array.from({ length: Math.min(DIRECT_UPLOAD_CONCURRENCY, partCount) }, async () => {
+            while (queue.length) {
+                await uploadPart(queue.shift());
+            }
+        });
+        await Promise.all(workers);
+
+        const completed = await postJson('/s3-multipart/complete', { s3_key, upload_id, parts });
+        if (!completed.success) {
+            // Not completed: abort below so S3 does not keep (and bill for) the parts.
+            throw new Error(completed.error || 'Could not complete the upload');
+        }
+        return completed;
+    } catch (error) {
+        await postJson('/s3-multipart/abort', { s3_key, upload_id }).catch(() => {});
+        throw error;
+    }
+};
+
 /**
  * Checks the status of a file on S3.
  */
@@ -289,3 +424,13 @@ export const refreshCache = async () => {
     });
     return response.json();
 };
+
+/**
+ * Gets the status of a cache refresh job started by refreshCache.
+ */
+export const getCacheRefreshStatus = async (jobId) => {
+    const response = await fetchWithAuth(`${API_URL}/cache/refresh/${jobId}`, {
+        headers: getAuthHeaders(),
+    });
+    return response.json();
+};
@@ -1,5 +1,5 @@
 import React, { createContext, useState, useRef, useEffect, useContext } from 'react';
-import { getTaskStatus, processS3Videos, cancelTask as apiCancelTask } from '../api/apiService';
+import { getTaskStatus, subscribeTaskStatus, processS3Videos, cancelTask as apiCancelTask } from '../api/apiService';
 import { toast } from 'react-toastify';
 
 export const TaskContext = createContext();
@@ -14,12 +14,21 @@ export const TaskProvider = ({ children }) => {
     const [taskResult, setTaskResult] = useState(null);
     const [error, setError] = useState(null);
     const pollIntervalRef = useRef(null);
+    const eventSourceRef = useRef(null);
 
-    const clearTask = () => {
+    const stopTracking = () => {
+        if (eventSourceRef.current) {
+            eventSourceRef.current.close();
+            eventSourceRef.current = null;
+        }
         if (pollIntervalRef.current) {
             clearInterval(pollIntervalRef.current);
             pollIntervalRef.current = null;
         }
+    };
+
+    const clearTask = () => {
+        stopTracking();
         setTaskId(null);
         setTaskState('IDLE');
         setTaskProgress(0);
@@ -48,35 +57,49 @@ export const TaskProvider = ({ children }) => {
         }
     };
 
-    const pollTaskStatus = (id) => {
-        if (pollIntervalRef.current) {
-            clearInterval(pollIntervalRef.current);
+    const applyTaskStatus = (data) => {
+        setTaskProgress(data.progress || 0);
+        setTaskStatusText(data.status_text || 'Processing...');
+
+        if (data.state === 'SUCCESS') {
+            setTaskState('SUCCESS');
+            setTaskResult(data.result);
+            stopTracking();
+        } else if (data.state === 'FAILURE' || data.state === 'REVOKED') {
+            setTaskState('FAILURE');
+            setError(data.error || 'Task failed or was cancelled.');
+            stopTracking();
         }
-        
+    };
+
+    const pollTaskStatus = (id) => {
+        stopTracking();
+
         pollIntervalRef.current = setInterval(async () => {
             try {
-                const data = await getTaskStatus(id);
-                
-                setTaskProgress(data.progress || 0);
-                setTaskStatusText(data.status_text || 'Processing...');
-
-                if (data.state === 'SUCCESS') {
-                    setTaskState('SUCCESS');
-                    setTaskResult(data.result);
-                    clearInterval(pollIntervalRef.current);
-                } else if (data.state === 'FAILURE' || data.state === 'REVOKED') {
-                    setTaskState('FAILURE');
-                    setError(data.error || 'Task failed or was cancelled.');
-                    clearInterval(pollIntervalRef.current);
-                }
+                applyTaskStatus(await getTaskStatus(id));
             } catch (err) {
                 setError('Failed to get task status.');
                 setTaskState('FAILURE');
-                clearInterval(pollIntervalRef.current);
+                stopTracking();
             }
         }, 2000);
     };
 
+    // Progress is pushed over SSE; falls back to polling if the stream is unavailable.
+    const trackTaskStatus = async (id) => {
+        stopTracking();
+        if (typeof EventSource === 'undefined') {
+            pollTaskStatus(id);
+            return;
+        }
+        try {
+            eventSourceRef.current = await subscribeTaskStatus(id, applyTaskStatus, () => pollTaskStatus(id));
+        } catch (err) {
+            pollTaskStatus(id);
+        }
+    };
+
     const startS3FrameExtraction = async (videoKey) => {
         clearTask();
         setTaskState('PROCESSING');
@@ -84,7 +107,7 @@ export const TaskProvider = ({ children }) => {
             const response = await processS3Videos(videoKey);
             if (response.success) {
                 setTaskId(response.task_id);
-                pollTaskStatus(response.task_id);
+                trackTaskStatus(response.task_id);
             } else {
                 setTaskState('FAILURE');
                 setError(response.error || 'Failed to start task.');
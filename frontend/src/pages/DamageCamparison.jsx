@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 // --- NEW: Import the refreshCache function ---
-import { postCompare, cancelTask, refreshCache } from '../api/apiService.js';
+import { postCompare, cancelTask, refreshCache, getCacheRefreshStatus } from '../api/apiService.js';
 
 const DamageComparison = () => {
     const [clientId, setClientId] = useState('');
@@ -83,10 +83,25 @@ const DamageComparison = () => {
         setError('');
         try {
             const res = await refreshCache();
-            if (res.success) {
-                setStatus(res.message);
-            } else {
+            if (!res.success) {
                 setError(res.error || 'Failed to reload data.');
+                return;
+            }
+            // The refresh runs in the background; follow its job until it finishes.
+            let job = res.job;
+            while (job.state !== 'SUCCESS' && job.state !== 'FAILURE') {
+                setStatus(`${job.status} (${job.progress || 0}%)`);
+                await new Promise((resolve) => setTimeout(resolve, 2000));
+                job = await getCacheRefreshStatus(res.job_id);
+                if (job.success === false) {
+                    setError(job.error || 'Lost track of the data reload.');
+                    return;
+                }
+            }
+            if (job.state === 'SUCCESS') {
+                setStatus(job.status);
+            } else {
+                setError(job.status || 'Failed to reload data.');
             }
         } catch (err) {
             console.error(err);
@@ -7,7 +7,8 @@ import {
     checkS3UploadStatus,
     retrieveVideos,
     getVideoUrl,
-    uploadVideoToS3
+    uploadVideoToS3,
+    uploadVideoDirectToS3
 } from '/src/api/apiService.js';
 
 // Import CSS
@@ -160,13 +161,14 @@ const S3DashboardPage = () => {
         setUploads(prev => [newUpload, ...prev].slice(0, 10));
         removeFile(null); // Reset the form for the next upload
 
+        // The video goes last: a streaming upload needs the fields before the file data.
         const formData = new FormData();
-        formData.append('video', fileToUpload);
         formData.append('upload_date', uploadDate);
         formData.append('camera_angle', cameraAngle);
         formData.append('video_type', videoType);
         formData.append('load_status', loadStatus);
         formData.append('user_name', localStorage.getItem('username') || 'Unknown User');
+        formData.append('video', fileToUpload);
 
         // Start simulated progress for better UX
         const progressInterval = setInterval(() => {
@@ -181,8 +183,19 @@ const S3DashboardPage = () => {
         }, 500);
 
         try {
-            // Use the API service instead of custom XMLHttpRequest
-            const response = await uploadVideoToS3(formData);
+            // Upload straight to S3; fall back to sending the file through the API
+            // (e.g. when the bucket's CORS rules do not allow browser uploads).
+            const fields = Object.fromEntries([...formData.entries()].filter(([key]) => key !== 'video'));
+            const onProgress = (progress) => setUploads(prev => prev.map(up =>
+                up.id === uploadId ? { ...up, progress: Math.max(up.progress, Math.min(progress, 99)) } : up
+            ));
+            let response;
+            try {
+                response = await uploadVideoDirectToS3(fileToUpload, fields, onProgress);
+            } catch (directError) {
+                console.warn('Direct S3 upload failed, uploading through the API instead:', directError);
+                response = await uploadVideoToS3(formData);
+            }
             
             // Clear the progress interval
             clearInterval(progressInterval);
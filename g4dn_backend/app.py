@@ -14,11 +14,31 @@ import signal
 from dotenv import load_dotenv
 from utils.yaml_loader import load_yaml
 from utils.celery_worker import frame_extraction_task
+from utils.s3_client import start_call_tracking, stop_call_tracking
+from utils.task_status import status_payload, task_infos
 
 load_dotenv()
 
 app=Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-S3-Calls'])
+
+# Most task IDs one bulk /task-status request may ask for.
+MAX_BULK_TASK_IDS = 500
+
+
+@app.before_request
+def track_s3_calls():
+    start_call_tracking()
+
+
+@app.after_request
+def report_s3_calls(response):
+    """Reports how many S3 calls the request made."""
+    calls = stop_call_tracking()
+    if calls:
+        response.headers['X-S3-Calls'] = str(sum(calls.values()))
+        logging.debug(f"S3 calls for {request.path}: {calls}")
+    return response
 
 
 @app.route('/cancel-task/<task_id>', methods=['POST'])
@@ -53,28 +73,26 @@ def cancel_task(task_id):
 def task_status(task_id):
     """Gets the status of a Celery task."""
     task = AsyncResult(task_id, app=celery)
-    response = {'state': task.state}
-
-    if task.state == 'PENDING':
-        response.update({'status': 'Pending...', 'progress': 0})
-    elif task.state == 'PROGRESS':
-        response.update(task.info or {})
-    elif task.state == 'SUCCESS':
-        response.update(task.info or {})
-        response['result'] = task.result
-    elif task.state == 'FAILURE':
-        # When a task fails by raising an exception, task.info contains the exception object.
-        # We convert it to a string to send it as a JSON response.
-        response.update({
-            'status': str(task.info),
-            'error': True,
-            'progress': 100
-        })
-    else:
-        # Handle other states like REVOKED
-        response.update({'status': task.state, 'progress': 100})
-
-    return jsonify(response)
+    return jsonify(status_payload(task.state, task.info))
+
+
+@app.route('/task-status', methods=['POST'])
+def bulk_task_status():
+    """
+    Gets the status of many Celery tasks with one result-backend round trip.
+    Takes {"task_ids": [...]}, returns {"tasks": {task_id: status}} with each
+    status shaped like /task-status/<task_id>.
+    """
+    data = request.get_json(silent=True) or {}
+    task_ids = data.get('task_ids')
+    if not isinstance(task_ids, list) or not all(isinstance(t, str) and t for t in task_ids):
+        return jsonify({'error': 'task_ids must be a list of task IDs.'}), 400
+    task_ids = list(dict.fromkeys(task_ids))
+    if len(task_ids) > MAX_BULK_TASK_IDS:
+        return jsonify({'error': f'At most {MAX_BULK_TASK_IDS} task IDs per request.'}), 400
+
+    infos = task_infos(celery, task_ids)
+    return jsonify({'tasks': {task_id: status_payload(*infos[task_id]) for task_id in task_ids}})
 
 
 @app.route('/frame-extract',methods=['POST'])
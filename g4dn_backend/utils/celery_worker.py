@@ -1,4 +1,5 @@
 from celery import Celery,shared_task
+from celery.signals import task_prerun, task_postrun
 from kombu import Queue
 import time
 import logging
@@ -8,6 +9,7 @@ import shutil
 
 from .frame_extractor import FrameExtractor
 from .s3_utils import *
+from .s3_client import start_call_tracking, stop_call_tracking
 
 
 # Configure logging
@@ -37,6 +39,17 @@ celery.conf.update(
 )
 
 
+@task_prerun.connect
+def track_task_s3_calls(**kwargs):
+    start_call_tracking()
+
+
+@task_postrun.connect
+def report_task_s3_calls(task_id=None, task=None, **kwargs):
+    calls = stop_call_tracking()
+    logger.info(f"Task {task.name if task else ''}[{task_id}] made {sum(calls.values())} S3 calls: {calls}")
+
+
 @celery.task(bind=True)
 def frame_extraction_task(self, bucket_name:str, path:str):
     self.update_state(state='PENDING', meta={'status': 'Initializing...', 'progress': 0})
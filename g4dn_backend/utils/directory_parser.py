@@ -1,10 +1,10 @@
-import boto3
+from .s3_utils import get_s3_client
 
 def list_s3_files(bucket_name, prefix):
     """
     List all files and folders recursively under a given prefix in S3.
     """
-    s3 = boto3.client('s3')
+    s3 = get_s3_client()
     paginator = s3.get_paginator('list_objects_v2')
     result = paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter='/')
 
@@ -0,0 +1,132 @@
+"""
+Tuned downloads of large S3 objects (raw videos).
+
+Objects are fetched as parallel ranged GETs on the shared S3 client, with the
+concurrency and chunk size set per deployment instead of boto3's defaults:
+
+    S3_TRANSFER_CONCURRENCY    ranged GETs in flight per download (default 10);
+                               keep it below S3_MAX_POOL_CONNECTIONS
+    S3_TRANSFER_CHUNK_MB       size of each ranged GET in MiB (default 16)
+    S3_TRANSFER_THRESHOLD_MB   objects smaller than this use a single GET (default 16)
+
+download_to_path() goes through boto3's managed transfer with that config.
+download_into_buffer() and download_to_fd() write each range straight to its
+offset in a preallocated bytearray or file descriptor, so no part is buffered
+twice and nothing has to be reassembled afterwards.
+"""
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+
+from .s3_client import client_manager
+
+logger = logging.getLogger(__name__)
+
+MIB = 1024 * 1024
+# Each ranged GET body is consumed in reads of this size.
+READ_SIZE = 1 * MIB
+
+
+def transfer_settings(concurrency=None, chunk_size=None, threshold=None):
+    """Resolves (concurrency, chunk_size, threshold), falling back to the environment."""
+    return (
+        int(concurrency or os.getenv('S3_TRANSFER_CONCURRENCY', 10)),
+        int(chunk_size or int(os.getenv('S3_TRANSFER_CHUNK_MB', 16)) * MIB),
+        int(threshold or int(os.getenv('S3_TRANSFER_THRESHOLD_MB', 16)) * MIB)
+    )
+
+
+def build_transfer_config(concurrency=None, chunk_size=None, threshold=None):
+    """boto3 TransferConfig for managed transfers, from the same settings."""
+    concurrency, chunk_size, threshold = transfer_settings(concurrency, chunk_size, threshold)
+    return TransferConfig(
+        multipart_threshold=threshold,
+        multipart_chunksize=chunk_size,
+        max_concurrency=concurrency,
+        use_threads=concurrency > 1
+    )
+
+
+def download_to_path(bucket_name, s3_key, local_path, concurrency=None, chunk_size=None):
+    """Downloads an object to a local file with the tuned transfer config."""
+    client_manager.get_client().download_file(
+        bucket_name, s3_key, local_path,
+        Config=build_transfer_config(concurrency, chunk_size)
+    )
+
+
+def _ranges(size, chunk_size):
+    return [(start, min(start + chunk_size, size) - 1) for start in range(0, size, chunk_size)]
+
+
+def _parallel_ranged_get(bucket_name, s3_key, size, write, concurrency, chunk_size):
+    """Fetches [0, size) as ranged GETs and hands every piece to write(offset, data)."""
+    client = client_manager.get_client()
+
+    def fetch(byte_range):
+        start, end = byte_range
+        body = client.get_object(Bucket=bucket_name, Key=s3_key, Range=f"bytes={start}-{end}")['Body']
+        offset = start
+        for data in iter(lambda: body.read(READ_SIZE), b''):
+            write(offset, data)
+            offset += len(data)
+        if offset != end + 1:
+            raise IOError(f"Short read for s3://{bucket_name}/{s3_key} bytes {start}-{end}: got {offset - start} bytes")
+
+    ranges = _ranges(size, chunk_size)
+    if len(ranges) == 1 or concurrency <= 1:
+        for byte_range in ranges:
+            fetch(byte_range)
+        return
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(ranges)), thread_name_prefix='s3-range') as executor:
+        # list() re-raises the first failed range
+        list(executor.map(fetch, ranges))
+
+
+def download_into_buffer(bucket_name, s3_key, buffer=None, concurrency=None, chunk_size=None):
+    """
+    Downloads an object into memory. Pass a preallocated bytearray (at least the
+    object's size) to reuse it across downloads. Returns a memoryview of exactly
+    the object's bytes.
+    """
+    concurrency, chunk_size, threshold = transfer_settings(concurrency, chunk_size)
+    size = client_manager.get_client().head_object(Bucket=bucket_name, Key=s3_key)['ContentLength']
+    if buffer is None:
+        buffer = bytearray(size)
+    elif len(buffer) < size:
+        raise ValueError(f"Buffer of {len(buffer)} bytes is too small for s3://{bucket_name}/{s3_key} ({size} bytes)")
+    view = memoryview(buffer)
+
+    def write(offset, data):
+        view[offset:offset + len(data)] = data
+
+    _parallel_ranged_get(bucket_name, s3_key, size, write, concurrency if size >= threshold else 1, chunk_size)
+    return view[:size]
+
+
+def download_to_fd(bucket_name, s3_key, fd, concurrency=None, chunk_size=None):
+    """
+    Downloads an object into an open file descriptor opened for writing. The file is
+    preallocated to the object's size and each range is written at its offset
+    with os.pwrite, so parts can land in any order. Returns the object size.
+    """
+    concurrency, chunk_size, threshold = transfer_settings(concurrency, chunk_size)
+    size = client_manager.get_client().head_object(Bucket=bucket_name, Key=s3_key)['ContentLength']
+    os.ftruncate(fd, size)
+    if hasattr(os, 'posix_fallocate') and size:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            # Not supported by every filesystem; the truncate above is enough.
+            pass
+
+    def write(offset, data):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+
+    _parallel_ranged_get(bucket_name, s3_key, size, write, concurrency if size >= threshold else 1, chunk_size)
+    return size
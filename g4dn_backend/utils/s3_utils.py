@@ -1,20 +1,18 @@
 import boto3
 import os
 from dotenv import load_dotenv
+from .s3_client import client_manager
+from .s3_transfer import download_to_path
 
 load_dotenv()
 
 def get_s3_client():
-    return boto3.client(
-        's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_REGION')
-    )
+    """Return the process-wide pooled S3 client (see utils.s3_client)."""
+    return client_manager.get_client()
 
 def download_file_from_s3(bucket, s3_key, local_path):
-    client = get_s3_client()
-    client.download_file(bucket, s3_key, local_path)
+    """Downloads with the deployment's ranged concurrency and chunk size (see utils.s3_transfer)."""
+    download_to_path(bucket, s3_key, local_path)
 
 def upload_bytes_to_s3(bytes_data, bucket, s3_key):
     client = get_s3_client()
@@ -0,0 +1,61 @@
+"""
+Task status lookups for /task-status.
+
+status_payload builds the response for one task; task_infos reads the states
+of many tasks with a single MGET against the Redis result backend instead of
+one AsyncResult lookup per task.
+"""
+from celery.result import AsyncResult
+from celery.backends.base import BaseKeyValueStoreBackend
+
+
+def status_payload(state, info):
+    """The /task-status response for a task in `state` with Celery's info (meta, result or exception)."""
+    response = {'state': state}
+
+    if state == 'PENDING':
+        response.update({'status': 'Pending...', 'progress': 0})
+    elif state == 'PROGRESS':
+        response.update(info or {})
+    elif state == 'SUCCESS':
+        response.update(info if isinstance(info, dict) else {})
+        response['result'] = info
+    elif state == 'FAILURE':
+        # When a task fails by raising an exception, info is the exception object.
+        # We convert it to a string to send it as a JSON response.
+        response.update({
+            'status': str(info),
+            'error': True,
+            'progress': 100
+        })
+    else:
+        # Handle other states like REVOKED
+        response.update({'status': state, 'progress': 100})
+
+    return response
+
+
+def task_infos(celery_app, task_ids):
+    """
+    {task_id: (state, info)} for many tasks, as AsyncResult.state and .info
+    would give them, fetched in a single MGET from a key-value result
+    backend. Unknown tasks are PENDING, as with AsyncResult. Other backends
+    fall back to one lookup per task.
+    """
+    backend = celery_app.backend
+    if isinstance(backend, BaseKeyValueStoreBackend):
+        try:
+            values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+        except NotImplementedError:
+            values = None
+        if values is not None:
+            infos = {}
+            for task_id, value in zip(task_ids, values):
+                if value is None:
+                    infos[task_id] = ('PENDING', None)
+                else:
+                    meta = backend.decode_result(value)
+                    infos[task_id] = (meta['status'], meta['result'])
+            return infos
+    results = {task_id: AsyncResult(task_id, app=celery_app) for task_id in task_ids}
+    return {task_id: (result.state, result.info) for task_id, result in results.items()}